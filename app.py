@@ -1,7 +1,42 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, abort, make_response, Response, stream_with_context, g
+import gzip
+import itertools
 import os
+import hmac
+import json
+import mimetypes
+import shutil
+import tempfile
+import time
 import traceback
-from app.controllers.map_controller import generate_map, get_region_data
+from werkzeug.datastructures import FileStorage
+from app.controllers.map_controller import generate_map, get_region_data, MAPS_OUTPUT_FOLDER
+from app.controllers.profiling import run_profiled, list_profiles, get_profile_path
+from app.controllers.storage import get_map_storage
+from app.controllers.boundary_store import (
+    PROJECTIONS, DEFAULT_PROJECTION, get_boundary_store, pin_boundary_store, unpin_boundary_store,
+    iter_with_boundary_store, reload_boundary_data, boundary_data_stats
+)
+from app.controllers.map_options import parse_map_options
+from app.controllers.choropleth import load_value_table
+from app.controllers.points import load_point_table, read_point_chunks
+from app.controllers.locate import (
+    LOCATE_FORMATS, coordinate_chunks, iter_locate_batches, encode_ndjson, encode_arrow, normalize_levels
+)
+from app.controllers.animation import generate_animation, DEFAULT_FRAME_DPI
+from app.controllers.poster import generate_poster
+from app.controllers.sessions import get_session_manager, SESSION_PREVIEW_DPI, MAP_SESSION_TTL_SECONDS
+from app.controllers.region_search import search_regions, DEFAULT_SEARCH_LIMIT, LEVEL_ORDER
+from app.controllers.admission import (
+    AdmissionRejected, DeadlineExceeded, REQUEST_DEADLINE_SECONDS,
+    request_deadline, estimate_render_cost, get_admission_controller
+)
+from app.controllers.telemetry import record_render, collect_worker_metrics
+from app.controllers.quality import track_quality, get_quality_controller
+from app.controllers.job_queue import get_render_queue, inline_render_count
+from app.controllers.geometry_export import (
+    BROTLI_AVAILABLE, normalize_geometry_options, geometry_etag, get_geometry_export
+)
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -9,48 +44,108 @@ load_dotenv()
 
 app = Flask(__name__, static_folder='app/static', template_folder='app/templates')
 
+# 管理接口令牌（未设置时管理接口和按请求性能分析均不可用）
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+def is_admin_request():
+    """检查请求是否携带了正确的管理令牌（请求头 X-Admin-Token）"""
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+def is_profile_requested(data):
+    """是否对本次请求开启性能分析（请求头 X-Profile-Render: 1 或参数 profile=true，仅限管理员）"""
+    requested = request.headers.get('X-Profile-Render', '').lower() in ('1', 'true') or data.get('profile') is True
+    return requested and is_admin_request()
+
+@app.before_request
+def pin_request_data():
+    """整个请求使用同一版本的边界数据（请求期间边界数据更新也不会混用新旧数据）"""
+    g.boundary_store_token = pin_boundary_store()
+
+@app.teardown_request
+def unpin_request_data(exc=None):
+    token = g.pop('boundary_store_token', None)
+    if token is not None:
+        unpin_boundary_store(token)
+
 @app.route('/')
 def index():
     """渲染首页"""
     return render_template('index.html')
 
+def get_map_request_data():
+    """
+    读取地图生成请求的参数
+
+    支持JSON请求体，也支持multipart表单：options字段为JSON参数，file字段为分级统计数据文件（CSV/Parquet），
+    pointsFile字段为点数据文件（CSV/Parquet，按批读取）
+    """
+    if request.files or request.form:
+        data = json.loads(request.form.get('options') or '{}')
+        upload = request.files.get('file')
+        if upload is not None and upload.filename:
+            choropleth = data.get('choropleth') or {}
+            choropleth['table'] = load_value_table(file=upload)
+            data['choropleth'] = choropleth
+        points_upload = request.files.get('pointsFile')
+        if points_upload is not None and points_upload.filename:
+            points = data.get('points') or {}
+            points['table'] = load_point_table(file=points_upload)
+            data['points'] = points
+        return data
+    return request.json
+
+def get_request_timeout(data=None):
+    """
+    请求的截止时间（秒）
+
+    客户端可以通过 X-Request-Timeout 请求头或 timeoutSeconds 参数缩短（不能超过REQUEST_DEADLINE_SECONDS），
+    超时后服务器停止为该请求渲染
+    """
+    value = request.headers.get('X-Request-Timeout') or (data or {}).get('timeoutSeconds')
+    try:
+        timeout = float(value) if value else REQUEST_DEADLINE_SECONDS
+    except (TypeError, ValueError):
+        timeout = REQUEST_DEADLINE_SECONDS
+    return max(0.1, min(timeout, REQUEST_DEADLINE_SECONDS))
+
+def overload_response(e):
+    """服务器繁忙（429/503，带Retry-After）或请求超时（503）的响应"""
+    print(f"请求未完成: {str(e)}")
+    if isinstance(e, AdmissionRejected):
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'retryAfter': e.retry_after
+        }), e.status_code, {'Retry-After': str(e.retry_after)}
+    return jsonify({
+        'success': False,
+        'error': str(e)
+    }), 503
+
 @app.route('/api/generate-map', methods=['POST'])
 def create_map():
     """生成地图API"""
-    data = request.json
-    map_type = data.get('mapType', '省')  # 默认是省级地图
-    region_name = data.get('regionName', '').strip()  # 可选的区域名称筛选
-    
-    # 新增高亮和颜色自定义参数
-    highlight_regions = data.get('highlightRegions', [])  # 多个高亮区域（包含区域名和颜色）
-    # 兼容旧版单区域参数
-    if not highlight_regions and data.get('highlightRegion'):
-        highlight_regions = [{
-            'name': data.get('highlightRegion').strip(),
-            'color': data.get('highlightColor', '#FF5733')
-        }]
-    base_color = data.get('baseColor', '#EAEAEA')  # 底图颜色
-    border_color = data.get('borderColor', 'white')  # 边界线颜色
-    border_width = float(data.get('borderWidth', 0.5))  # 边界线宽度
-    show_labels = data.get('showLabels', True)  # 是否显示标签
-    
-    # 新增标题自定义参数
-    show_title = data.get('showTitle', True)  # 是否显示标题
-    custom_title = data.get('customTitle', '').strip()  # 自定义标题
-    title_font_size = int(data.get('titleFontSize', 15))  # 标题字体大小
-    
-    # 新增经纬度显示参数
-    show_coordinates = data.get('showCoordinates', False)  # 是否显示经纬度
-    coordinates_font_size = int(data.get('coordinatesFontSize', 8))  # 经纬度字体大小
-    
-    # 新增比例尺显示参数
-    show_scale_bar = data.get('showScaleBar', False)  # 是否显示比例尺
-    scale_bar_style = data.get('scaleBarStyle', 'default')  # 比例尺样式
-    scale_bar_location = data.get('scaleBarLocation', 'lower right')  # 比例尺位置
-    scale_bar_font_size = int(data.get('scaleBarFontSize', 12))  # 比例尺字体大小
-    
-    # 新增本地保存控制参数
-    save_local = data.get('saveLocal', False)  # 是否保存到本地文件系统
+    try:
+        data = get_map_request_data()
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f"请求参数无效: {str(e)}"
+        }), 400
+    map_kwargs = parse_map_options(data)
+    map_type = map_kwargs['map_type']
+    region_name = map_kwargs['region_name']
+    highlight_regions = map_kwargs['highlight_regions']
+    save_local = map_kwargs['save_local']
+    show_title, custom_title = map_kwargs['showTitle'], map_kwargs['customTitle']
+    title_font_size = map_kwargs['titleFontSize']
+    show_coordinates = map_kwargs['showCoordinates']
+    coordinates_font_size = map_kwargs['coordinatesFontSize']
+    show_scale_bar = map_kwargs['showScaleBar']
+    scale_bar_style = map_kwargs['scaleBarStyle']
+    scale_bar_location = map_kwargs['scaleBarLocation']
+    scale_bar_font_size = map_kwargs['scaleBarFontSize']
     
     print(f"接收到地图生成请求: 类型={map_type}, 区域名称={region_name}, 高亮区域={highlight_regions}")
     if show_title and custom_title:
@@ -61,34 +156,28 @@ def create_map():
         print(f"显示比例尺, 样式: {scale_bar_style}, 位置: {scale_bar_location}, 字体大小: {scale_bar_font_size}")
     print(f"保存方式: {'本地保存' if save_local else 'Base64编码'}")
     
+    # 管理员可针对单个请求开启cProfile和tracemalloc
+    profile_render = is_profile_requested(data)
+    
     try:
         # 调用地图生成函数
-        result = generate_map(
-            map_type=map_type, 
-            region_name=region_name,
-            highlight_regions=highlight_regions,  # 传递多区域数组
-            base_color=base_color,
-            border_color=border_color,
-            border_width=border_width,
-            show_labels=show_labels,
-            showTitle=show_title,
-            customTitle=custom_title,
-            titleFontSize=title_font_size,
-            showCoordinates=show_coordinates,
-            coordinatesFontSize=coordinates_font_size,
-            showScaleBar=show_scale_bar,
-            scaleBarStyle=scale_bar_style,
-            scaleBarLocation=scale_bar_location,
-            scaleBarFontSize=scale_bar_font_size,
-            save_local=save_local
-        )
+        profile_id = None
+        with request_deadline(get_request_timeout(data)), track_quality() as quality:
+            if profile_render:
+                result, profile_id = run_profiled(generate_map, label=f"{map_type} {region_name}",
+                                                  inline=True, **map_kwargs)
+            else:
+                result = generate_map(**map_kwargs)
         
         response_data = {
             'success': True,
             'mapType': map_type,
             'regionName': region_name,
-            'highlightRegions': highlight_regions
+            'highlightRegions': highlight_regions,
+            'qualityTier': quality['tier']
         }
+        if profile_id:
+            response_data['profileId'] = profile_id
         
         # 根据保存模式返回不同的数据
         if save_local:
@@ -97,6 +186,8 @@ def create_map():
             response_data['imageData'] = result  # 返回Base64数据
         
         return jsonify(response_data)
+    except (AdmissionRejected, DeadlineExceeded) as e:
+        return overload_response(e)
     except Exception as e:
         # 获取详细的错误跟踪
         error_trace = traceback.format_exc()
@@ -112,6 +203,254 @@ def create_map():
             'highlightRegions': highlight_regions
         }), 500
 
+@app.route('/api/generate-animation', methods=['POST'])
+def create_animation():
+    """
+    生成动画地图API
+
+    除地图参数外还需要 frames（每帧的 highlightRegions 和可选的 title），
+    可选 format（gif/webp/zip）、frameDuration（毫秒）、dpi
+    """
+    try:
+        data = get_map_request_data()
+        map_kwargs = parse_map_options(data)
+        frames = data.get('frames') or []
+        animation_format = data.get('format', 'gif')
+        frame_duration = int(data.get('frameDuration', 500))
+        dpi = int(data.get('dpi', DEFAULT_FRAME_DPI))
+        if not isinstance(frames, list):
+            raise ValueError("frames必须是列表")
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f"请求参数无效: {str(e)}"
+        }), 400
+    
+    print(f"接收到动画生成请求: 类型={map_kwargs['map_type']}, 帧数={len(frames)}, 格式={animation_format}")
+    
+    try:
+        with request_deadline(get_request_timeout(data)), track_quality() as quality:
+            result = generate_animation(frames, animation_format=animation_format,
+                                        frame_duration=frame_duration, dpi=dpi, **map_kwargs)
+        
+        response_data = {
+            'success': True,
+            'mapType': map_kwargs['map_type'],
+            'regionName': map_kwargs['region_name'],
+            'format': animation_format,
+            'frameCount': len(frames),
+            'qualityTier': quality['tier']
+        }
+        if map_kwargs['save_local']:
+            response_data['imagePath'] = result
+        else:
+            response_data['imageData'] = result
+        
+        return jsonify(response_data)
+    except (AdmissionRejected, DeadlineExceeded) as e:
+        return overload_response(e)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"生成动画时出错: {str(e)}")
+        print(f"错误详情: {error_trace}")
+        
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/generate-poster', methods=['POST'])
+def create_poster():
+    """
+    生成大幅面地图API（印刷用，如宽度20000像素以上）
+
+    参数与生成地图相同，width/height可以超过普通地图的上限，可选 format（png/tiff）。
+    地图按条带渲染并直接写入文件，总是返回保存后的路径
+    """
+    try:
+        data = get_map_request_data()
+        map_kwargs = parse_map_options(data)
+        output_format = data.get('format', 'png')
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f"请求参数无效: {str(e)}"
+        }), 400
+    
+    print(f"接收到大幅面地图请求: 类型={map_kwargs['map_type']}, 尺寸={map_kwargs['width']}×{map_kwargs['height']}, 格式={output_format}")
+    
+    try:
+        with request_deadline(get_request_timeout(data)):
+            result = generate_poster(output_format=output_format, **map_kwargs)
+        
+        return jsonify({
+            'success': True,
+            'mapType': map_kwargs['map_type'],
+            'regionName': map_kwargs['region_name'],
+            'format': output_format,
+            'imagePath': result,
+            'qualityTier': 'full'  # 大幅面地图总是以完整质量渲染
+        })
+    except (AdmissionRejected, DeadlineExceeded) as e:
+        return overload_response(e)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"生成大幅面地图时出错: {str(e)}")
+        print(f"错误详情: {error_trace}")
+        
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def merge_session_changes(options, changes):
+    """
+    将编辑请求合并到会话参数中
+
+    changes中可以包含任意地图参数，另外支持：
+        addHighlightRegions: 新增或修改颜色的高亮区域列表
+        removeHighlightRegions: 要取消高亮的区域名称列表
+    """
+    options = dict(options)
+    for key, value in changes.items():
+        if key not in ('addHighlightRegions', 'removeHighlightRegions', 'dpi'):
+            options[key] = value
+    
+    added = changes.get('addHighlightRegions') or []
+    removed = set(changes.get('removeHighlightRegions') or [])
+    if added or removed:
+        names = {item.get('name') for item in added}
+        highlight_regions = [item for item in options.get('highlightRegions', [])
+                             if item.get('name') not in removed and item.get('name') not in names]
+        options['highlightRegions'] = highlight_regions + list(added)
+    return options
+
+def session_response(session, rebuilt, changed, started):
+    """编码会话当前的地图并构造响应"""
+    result = session.render()
+    response_data = {
+        'success': True,
+        'sessionId': session.session_id,
+        'rebuilt': rebuilt,
+        'changed': changed,
+        'renderMs': round((time.perf_counter() - started) * 1000),
+        'expiresIn': MAP_SESSION_TTL_SECONDS,
+        'qualityTier': 'full'  # 编辑会话的预览分辨率由客户端指定，不自动降低质量
+    }
+    if session.save_local:
+        response_data['imagePath'] = result
+    else:
+        response_data['imageData'] = result
+    return jsonify(response_data)
+
+@app.route('/api/map-sessions', methods=['POST'])
+def create_map_session():
+    """
+    创建地图编辑会话
+
+    参数与 /api/generate-map 相同，另可指定 dpi（预览分辨率）。
+    服务器保留已构建的地图图形，之后用 PATCH /api/map-sessions/<id> 提交修改。
+    """
+    try:
+        data = get_map_request_data()
+        map_kwargs = parse_map_options(data)
+        dpi = int(data.get('dpi', SESSION_PREVIEW_DPI))
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f"请求参数无效: {str(e)}"
+        }), 400
+    
+    started = time.perf_counter()
+    try:
+        cost = estimate_render_cost(map_kwargs, dpi)
+        with request_deadline(get_request_timeout(data)), get_admission_controller().admit(cost, "创建编辑会话"), \
+                record_render('session'):
+            session = get_session_manager().create(map_kwargs, data, dpi)
+            with session.lock:
+                print(f"创建地图编辑会话: {session.session_id}")
+                return session_response(session, True, [], started)
+    except (AdmissionRejected, DeadlineExceeded) as e:
+        return overload_response(e)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"创建编辑会话时出错: {str(e)}")
+        print(f"错误详情: {error_trace}")
+        
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/map-sessions/<session_id>', methods=['PATCH'])
+def update_map_session(session_id):
+    """提交对编辑会话的修改（只包含变化的参数），返回更新后的地图"""
+    session = get_session_manager().get(session_id)
+    if session is None:
+        return jsonify({
+            'success': False,
+            'error': "编辑会话不存在或已过期"
+        }), 404
+    
+    started = time.perf_counter()
+    with session.lock:
+        try:
+            changes = request.json or {}
+            options = merge_session_changes(session.options, changes)
+            map_kwargs = parse_map_options(options)
+            dpi = int(changes.get('dpi', session.dpi))
+        except Exception as e:
+            return jsonify({
+                'success': False,
+                'error': f"请求参数无效: {str(e)}"
+            }), 400
+        
+        try:
+            # 成本按会话的预览分辨率估算
+            cost = estimate_render_cost(map_kwargs, dpi)
+            with request_deadline(get_request_timeout(changes)), get_admission_controller().admit(cost, "更新编辑会话"), \
+                    record_render('session'):
+                rebuilt, changed = session.update(map_kwargs)
+                session.options = options
+                session.dpi = dpi
+                return session_response(session, rebuilt, changed, started)
+        except (AdmissionRejected, DeadlineExceeded) as e:
+            return overload_response(e)
+        except Exception as e:
+            error_trace = traceback.format_exc()
+            print(f"更新编辑会话时出错: {str(e)}")
+            print(f"错误详情: {error_trace}")
+            
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+
+@app.route('/api/map-sessions/<session_id>', methods=['DELETE'])
+def close_map_session(session_id):
+    """关闭编辑会话"""
+    if not get_session_manager().close(session_id):
+        return jsonify({
+            'success': False,
+            'error': "编辑会话不存在或已过期"
+        }), 404
+    return jsonify({'success': True})
+
 @app.route('/api/regions', methods=['GET'])
 def get_regions():
     """获取区域数据（省、市、县）"""
@@ -139,13 +478,236 @@ def get_regions():
             'error': str(e)
         }), 500
 
+@app.route('/api/regions/search', methods=['GET'])
+def search_region_names():
+    """按名称、名称片段或拼音搜索省、市、县（用于输入自动补全）"""
+    query = request.args.get('q', '')
+    level = request.args.get('level') or None
+    try:
+        limit = int(request.args.get('limit', DEFAULT_SEARCH_LIMIT))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit必须是整数'}), 400
+    if level is not None and level not in LEVEL_ORDER:
+        return jsonify({'success': False, 'error': f"不支持的级别: {level}，可选: {', '.join(LEVEL_ORDER)}"}), 400
+
+    try:
+        return jsonify({
+            'success': True,
+            'data': search_regions(query, limit, level)
+        })
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"搜索区域时出错: {str(e)}")
+        print(f"错误详情: {error_trace}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# 边界几何的浏览器缓存时间（秒）；数据更新后ETag随之改变
+GEOMETRY_CACHE_MAX_AGE = 3600
+GEOMETRY_MIMETYPES = {'geojson': 'application/geo+json', 'topojson': 'application/json'}
+
+@app.route('/api/geometry/<level>', methods=['GET'])
+def get_geometry(level):
+    """
+    导出边界几何（TopoJSON或GeoJSON），供客户端自行绘制
+
+    参数: format（topojson/geojson）、province、city、simplify（none/regional/national/coarse）、
+    quantization（量化网格格数，默认100000）、projection（默认geographic）。
+    结果已预先序列化并压缩，按Accept-Encoding返回brotli或gzip数据，支持ETag条件请求
+    """
+    try:
+        options = normalize_geometry_options(
+            level,
+            output_format=request.args.get('format'),
+            province=request.args.get('province'),
+            city=request.args.get('city'),
+            simplify=request.args.get('simplify'),
+            quantization=request.args.get('quantization'),
+            projection=request.args.get('projection')
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    try:
+        # 客户端已有相同的数据时直接返回304，不需要生成或读取缓存
+        if BROTLI_AVAILABLE and request.accept_encodings['br']:
+            encoding = 'br'
+        else:
+            encoding = 'gzip' if request.accept_encodings['gzip'] else 'identity'
+        etag = f"{geometry_etag(options)}-{encoding}"
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            export = get_geometry_export(options)
+            if encoding == 'identity':
+                # 极少数不支持压缩的客户端
+                data = gzip.decompress(export['gzip'])
+            else:
+                data = export[encoding]
+            response = make_response(data)
+            response.mimetype = GEOMETRY_MIMETYPES[options['format']]
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.cache_control.public = True
+        response.cache_control.max_age = GEOMETRY_CACHE_MAX_AGE
+        return response
+    except LookupError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"导出边界几何时出错: {str(e)}")
+        print(f"错误详情: {error_trace}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def _closing_chunks(chunks, file):
+    """逐批返回chunks，结束（或响应中断）时关闭file"""
+    try:
+        yield from chunks
+    finally:
+        file.close()
+
+@app.route('/api/locate', methods=['POST'])
+def locate():
+    """
+    批量查询经纬度所在的省、市、县
+
+    请求体为JSON {'coordinates': [[经度, 纬度], ...]} 或 {'lon': [...], 'lat': [...]}，
+    也可以上传CSV/Parquet文件（file字段，按批读取）；levels 为查询的级别（默认省、市、县），
+    format 为 ndjson（默认）或 arrow（Arrow IPC流，需要pyarrow）。结果按批流式返回，顺序与输入一致
+    """
+    try:
+        upload = request.files.get('file')
+        if upload is not None:
+            options = request.form
+            # 请求结束时上传的文件会被关闭，而结果是在响应期间按批读取和查询的，因此先转存到独立的临时文件
+            spooled = tempfile.TemporaryFile()
+            shutil.copyfileobj(upload.stream, spooled)
+            spooled.seek(0)
+            chunks = _closing_chunks(read_point_chunks(FileStorage(spooled, filename=upload.filename)), spooled)
+        else:
+            options = request.get_json(silent=True)
+            if not isinstance(options, dict):
+                raise ValueError("请求体必须是JSON对象，或上传CSV/Parquet文件")
+            chunks = coordinate_chunks(options)
+        output_format = (request.args.get('format') or options.get('format') or 'ndjson').lower()
+        if output_format not in LOCATE_FORMATS:
+            raise ValueError(f"不支持的输出格式，可选: {', '.join(LOCATE_FORMATS)}")
+        levels = normalize_levels(options.get('levels'))
+
+        batches = iter_locate_batches(chunks, levels)
+        body = encode_arrow(batches, levels) if output_format == 'arrow' else encode_ndjson(batches)
+        # 先生成第一批，输入有误时仍可以返回400，而不是中断已开始的响应
+        first = next(body, b'')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"查询所在区域时出错: {str(e)}")
+        print(f"错误详情: {error_trace}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+    # 请求结束后才生成的批次也使用本次请求的边界数据版本
+    body = iter_with_boundary_store(body, get_boundary_store())
+    return Response(stream_with_context(itertools.chain([first], body)), mimetype=LOCATE_FORMATS[output_format])
+
+@app.route('/api/projections', methods=['GET'])
+def get_projections():
+    """获取可选的地图投影"""
+    return jsonify({
+        'success': True,
+        'data': [{'name': info['name'], 'value': key} for key, info in PROJECTIONS.items()],
+        'default': DEFAULT_PROJECTION
+    })
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def get_profiles():
+    """列出已保存的性能分析结果（仅限管理员）"""
+    if not is_admin_request():
+        abort(403)
+    return jsonify({
+        'success': True,
+        'data': list_profiles()
+    })
+
+@app.route('/api/admin/metrics', methods=['GET'])
+def get_metrics():
+    """各工作进程的渲染次数、内存变化和负载（仅限管理员）"""
+    if not is_admin_request():
+        abort(403)
+    queue = get_render_queue()
+    return jsonify({
+        'success': True,
+        'data': {
+            'workers': collect_worker_metrics(),
+            'admission': get_admission_controller().stats(),
+            'quality': get_quality_controller().stats(),
+            'renderQueue': dict(queue.stats(), inlineRenders=inline_render_count()) if queue is not None else None,
+            'boundaryData': boundary_data_stats()
+        }
+    })
+
+@app.route('/api/admin/reload-data', methods=['POST'])
+def reload_data():
+    """立即检查并加载更新后的边界数据（仅限管理员）；force=1 时源文件没有变化也重新加载"""
+    if not is_admin_request():
+        abort(403)
+    try:
+        reloaded = reload_boundary_data(force=request.args.get('force') in ('1', 'true'))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify({
+        'success': True,
+        'reloaded': reloaded,
+        'data': boundary_data_stats()
+    })
+
+@app.route('/api/admin/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    """下载性能分析结果文件（仅限管理员）"""
+    if not is_admin_request():
+        abort(403)
+    path = get_profile_path(name)
+    if path is None:
+        abort(404)
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=name)
+
+# 已保存的地图内容不会改变，允许客户端长期缓存
+MAP_CACHE_MAX_AGE = 365 * 24 * 3600
+
 @app.route('/maps/<path:filename>')
 def get_map_image(filename):
-    """获取生成的地图图片"""
-    return send_file(os.path.join('app/static/maps', filename))
+    """获取生成的地图图片（支持ETag条件请求和Range请求）"""
+    found = get_map_storage(MAPS_OUTPUT_FOLDER).resolve(filename)
+    if found is None:
+        abort(404)
+    
+    path, digest, created = found
+    response = send_file(
+        os.path.abspath(path),
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        conditional=True,
+        etag=digest,
+        last_modified=created,
+        max_age=MAP_CACHE_MAX_AGE
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 # 确保地图保存目录存在
-os.makedirs('app/static/maps', exist_ok=True)
+os.makedirs(MAPS_OUTPUT_FOLDER, exist_ok=True)
 
 # Vercel 需要导出 app 对象
 # 在 Vercel 上运行时不需要 app.run()
@@ -0,0 +1,194 @@
+import threading
+
+import numpy as np
+
+from app.controllers.boundary_store import DEFAULT_PROJECTION, get_projected_data, get_source_version
+
+# 自动着色的默认色板（ColorBrewer Set3中较浅的6种颜色）：
+# 按最小度优先的顺序贪心着色，平面地图的邻接图最多需要6种颜色，因此默认色板总能使相邻区域颜色不同
+AUTO_COLOR_PALETTE = ['#8DD3C7', '#FFFFB3', '#BEBADA', '#FB8072', '#80B1D3', '#FDB462']
+# 自定义色板的最少颜色数
+MIN_PALETTE_COLORS = 4
+
+# 各级别的邻接图 {级别: (数据版本, RegionAdjacency)}
+_adjacency = {}
+_adjacency_lock = threading.Lock()
+
+
+class RegionAdjacency:
+    """
+    区域邻接图（CSR格式）
+
+    区域的编号就是它在边界数据中的位置（与属性表的索引、几何数组的位置相同，与投影无关）。
+    区域i的相邻区域为 indices[indptr[i]:indptr[i + 1]]，查询只与相邻区域的数量有关。
+    """
+
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    @property
+    def edge_count(self):
+        """相邻区域对的数量"""
+        return len(self.indices) // 2
+
+    def neighbors(self, position):
+        """一个区域的相邻区域位置"""
+        return self.indices[self.indptr[position]:self.indptr[position + 1]]
+
+    def degree(self, position):
+        """一个区域的相邻区域数量"""
+        return int(self.indptr[position + 1] - self.indptr[position])
+
+    def neighbors_of(self, positions):
+        """
+        一组区域的相邻区域（不包括这组区域本身）
+
+        返回:
+            ndarray: 排序后的区域位置
+        """
+        positions = np.unique(np.asarray(positions, dtype=np.int64))
+        if not len(positions):
+            return positions
+        found = np.concatenate([self.neighbors(position) for position in positions])
+        return np.setdiff1d(found, positions)
+
+
+def build_adjacency(geometry):
+    """
+    按公共边建立邻接图
+
+    把所有环拆分为线段，以两个量化端点（与方向无关）作为线段的键排序，
+    键相同而属于不同区域的线段就是两个区域的公共边。整个过程是向量化的，全国县级数据不到一秒。
+    要求相邻区域的公共边界使用相同的顶点（同一套行政区划数据通常如此）；只在一点相接的区域不算相邻。
+
+    参数:
+        geometry (RaggedGeometry): 区域几何
+
+    返回:
+        RegionAdjacency: 邻接图
+    """
+    count = len(geometry)
+    coords = np.asarray(geometry.coords)
+    ring_offsets = np.asarray(geometry.ring_offsets, dtype=np.int64)
+    polygon_offsets = np.asarray(geometry.polygon_offsets, dtype=np.int64)
+    region_offsets = np.asarray(geometry.region_offsets, dtype=np.int64)
+
+    # 每个顶点所属的区域
+    coord_region_offsets = ring_offsets[polygon_offsets[region_offsets]]
+    regions = np.repeat(np.arange(count), np.diff(coord_region_offsets))
+
+    # 相邻顶点组成线段，去掉跨越两个环的线段和长度为0的线段
+    if len(coords) < 2:
+        return RegionAdjacency(np.zeros(count + 1, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    valid = np.ones(len(coords) - 1, dtype=bool)
+    ring_ends = ring_offsets[1:] - 1
+    valid[ring_ends[(ring_ends >= 0) & (ring_ends < len(valid))]] = False
+    points = (coords[:, 0].astype(np.int64) << 32) | (coords[:, 1].astype(np.int64) & 0xFFFFFFFF)
+    start, end = points[:-1], points[1:]
+    valid &= start != end
+    start, end, segment_regions = start[valid], end[valid], regions[:-1][valid]
+
+    low, high = np.minimum(start, end), np.maximum(start, end)
+    order = np.lexsort((segment_regions, high, low))
+    low, high, segment_regions = low[order], high[order], segment_regions[order]
+
+    # 排序后相邻的两条线段键相同、区域不同，则两个区域相邻
+    shared = (low[1:] == low[:-1]) & (high[1:] == high[:-1]) & (segment_regions[1:] != segment_regions[:-1])
+    pairs = np.column_stack([segment_regions[:-1][shared], segment_regions[1:][shared]])
+    pairs = np.unique(np.concatenate([pairs, pairs[:, ::-1]]), axis=0)
+
+    indptr = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pairs[:, 0], minlength=count), out=indptr[1:])
+    return RegionAdjacency(indptr, pairs[:, 1].astype(np.int64))
+
+
+def get_adjacency(map_type):
+    """
+    获取某一级别的邻接图（每个级别只在首次使用时建立一次，源文件更新后重新建立）
+
+    参数:
+        map_type (str): 地图级别，'省', '市' 或 '县'
+
+    返回:
+        RegionAdjacency: 邻接图
+    """
+    version = get_source_version(map_type)
+    with _adjacency_lock:
+        cached = _adjacency.get(map_type)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    adjacency = build_adjacency(get_projected_data(map_type, DEFAULT_PROJECTION).geometry)
+    print(f"已建立{map_type}级邻接图: {len(adjacency)}个区域, {adjacency.edge_count}对相邻区域")
+    with _adjacency_lock:
+        _adjacency[map_type] = (version, adjacency)
+    return adjacency
+
+
+def _smallest_last_order(adjacency, positions):
+    """
+    最小度优先的消去顺序（只考虑positions之间的邻接）：反复移除剩余度数最小的区域，再逆序着色。
+    每个区域着色时已着色的相邻区域数不超过图的退化度（平面图不超过5）。
+    """
+    members = {int(position): index for index, position in enumerate(positions)}
+    local = [[members[int(neighbor)] for neighbor in adjacency.neighbors(position) if int(neighbor) in members]
+             for position in positions]
+    degrees = [len(neighbors) for neighbors in local]
+    buckets = [set() for _ in range(max(degrees, default=0) + 1)]
+    for index, degree in enumerate(degrees):
+        buckets[degree].add(index)
+
+    removed = [False] * len(positions)
+    order = []
+    lowest = 0
+    for _ in range(len(positions)):
+        lowest = max(lowest - 1, 0)
+        while not buckets[lowest]:
+            lowest += 1
+        index = buckets[lowest].pop()
+        removed[index] = True
+        order.append(index)
+        for neighbor in local[index]:
+            if not removed[neighbor]:
+                buckets[degrees[neighbor]].discard(neighbor)
+                degrees[neighbor] -= 1
+                buckets[degrees[neighbor]].add(neighbor)
+    return order[::-1], local
+
+
+def assign_colors(adjacency, positions, palette=None):
+    """
+    为一组区域分配色板颜色，使相邻区域的颜色不同
+
+    参数:
+        adjacency (RegionAdjacency): 邻接图
+        positions: 区域位置序列（如当前地图的属性表索引）
+        palette (list, optional): 颜色列表，默认为 AUTO_COLOR_PALETTE
+
+    返回:
+        list: 与positions一一对应的颜色
+    """
+    palette = list(palette or AUTO_COLOR_PALETTE)
+    if len(palette) < MIN_PALETTE_COLORS:
+        raise ValueError(f"自动着色的色板至少需要{MIN_PALETTE_COLORS}种颜色")
+    positions = [int(position) for position in positions]
+    order, local = _smallest_last_order(adjacency, positions)
+
+    choice = [None] * len(positions)
+    conflicts = 0
+    for index in order:
+        used = [choice[neighbor] for neighbor in local[index] if choice[neighbor] is not None]
+        free = [color for color in range(len(palette)) if color not in used]
+        if free:
+            choice[index] = free[0]
+        else:
+            # 色板颜色不够时选择相邻区域中用得最少的颜色
+            choice[index] = min(range(len(palette)), key=used.count)
+            conflicts += 1
+    if conflicts:
+        print(f"警告: 色板只有{len(palette)}种颜色，{conflicts}个区域与相邻区域颜色相同")
+    return [palette[color] for color in choice]
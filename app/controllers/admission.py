@@ -0,0 +1,213 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from app.controllers.layout import DEFAULT_OUTPUT_WIDTH, DEFAULT_OUTPUT_HEIGHT
+from app.controllers.points import point_count
+
+# 同时进行的渲染总成本上限（一张全国县级地图约为4）
+ADMISSION_CAPACITY = float(os.environ.get('ADMISSION_CAPACITY', 4))
+# 排队等待的请求数上限，超过时直接拒绝（429）
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 16))
+# 每个请求的默认截止时间（秒），客户端可以通过 X-Request-Timeout 请求头缩短
+REQUEST_DEADLINE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_SECONDS', 60))
+
+# 各级别全国地图的相对渲染成本（区域数量和顶点数）
+LEVEL_COSTS = {'省': 1.0, '市': 2.0, '县': 4.0}
+# 筛选单个区域后的成本比例
+FILTERED_COST_RATIO = 0.35
+# 每百万个点数据的渲染成本
+POINT_COST_PER_MILLION = 1.5
+# 参考输出像素数（默认输出尺寸）
+REFERENCE_PIXELS = DEFAULT_OUTPUT_WIDTH * DEFAULT_OUTPUT_HEIGHT
+
+
+class AdmissionRejected(Exception):
+    """服务器繁忙，请求未被接受"""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """请求已超过截止时间，停止后续渲染"""
+
+
+_local = threading.local()
+
+
+@contextmanager
+def request_deadline(seconds):
+    """
+    为当前线程中的请求设置截止时间，渲染过程中通过 check_deadline 检查
+
+    参数:
+        seconds (float): 从现在起允许的秒数，None表示不限制
+    """
+    previous = getattr(_local, 'deadline', None)
+    _local.deadline = time.monotonic() + seconds if seconds is not None else None
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def remaining_time():
+    """当前请求距截止时间的秒数，没有截止时间时返回None"""
+    deadline = getattr(_local, 'deadline', None)
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline(stage):
+    """
+    在渲染的各阶段之间调用：请求已超时（客户端已经不再等待）时抛出DeadlineExceeded
+
+    参数:
+        stage (str): 即将开始的阶段，用于日志
+    """
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        print(f"请求已超过截止时间，在{stage}阶段前停止渲染")
+        raise DeadlineExceeded(f"请求超时，已在{stage}阶段前停止渲染")
+
+
+def estimate_render_cost(map_kwargs, dpi=None, frames=1, pixel_scale=1.0):
+    """
+    估算一次渲染的相对成本
+
+    参数:
+        map_kwargs (dict): 地图参数（与generate_map相同）
+        dpi (int, optional): 按16×9英寸图形指定的输出分辨率（动画和编辑会话），默认使用参数中的像素尺寸
+        frames (int): 帧数（动画）
+        pixel_scale (float): 输出尺寸的比例（降低质量时小于1）
+
+    返回:
+        float: 相对成本，一张全国省级地图（4800×2700，带标签）约为1.3
+    """
+    cost = LEVEL_COSTS.get(map_kwargs.get('map_type'), 1.0)
+    region_name = map_kwargs.get('region_name')
+    if region_name and region_name != '全国':
+        cost *= FILTERED_COST_RATIO
+    # 标签最多100个，但每个都需要单独排版
+    if map_kwargs.get('show_labels', True):
+        cost *= 1.3
+    if map_kwargs.get('showCoordinates'):
+        cost += 0.2
+    cost += 0.1 * len(map_kwargs.get('overlayLevels') or [])
+    # 点数据：投影和绘制（或汇总）与点数成正比
+    cost += POINT_COST_PER_MILLION * point_count(map_kwargs.get('points')) / 1_000_000
+
+    # 栅格化和编码的成本与像素数成正比，构建图形的成本与分辨率无关
+    if dpi:
+        pixels = 16 * dpi * 9 * dpi
+    else:
+        pixels = ((map_kwargs.get('width') or DEFAULT_OUTPUT_WIDTH)
+                  * (map_kwargs.get('height') or DEFAULT_OUTPUT_HEIGHT))
+    raster = pixels * pixel_scale ** 2 / REFERENCE_PIXELS
+    return cost * (0.5 + 0.5 * raster * max(1, frames))
+
+
+class AdmissionController:
+    """
+    按估算成本控制同时进行的渲染
+
+    正在渲染的总成本超过容量时，新请求按到达顺序排队；排队请求过多时直接拒绝（429），
+    排队超过请求的截止时间时返回503。两种情况都根据近期的渲染速度给出Retry-After。
+    """
+
+    def __init__(self, capacity=ADMISSION_CAPACITY, max_queue=ADMISSION_MAX_QUEUE):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._in_flight = 0.0
+        self._queue = deque()  # 排队请求的 [成本]，按到达顺序
+        self._seconds_per_cost = 1.0  # 每单位成本的渲染秒数（指数移动平均）
+        self.admitted = 0
+        self.rejected = 0
+
+    def retry_after(self):
+        """按当前负载估算客户端应等待的秒数（调用方需持有锁）"""
+        pending = self._in_flight + sum(item[0] for item in self._queue)
+        return max(1, math.ceil(pending / self.capacity * self._seconds_per_cost))
+
+    @contextmanager
+    def admit(self, cost, label=''):
+        """
+        申请渲染资源，资源不足时排队等待
+
+        参数:
+            cost (float): 估算成本，见 estimate_render_cost
+            label (str): 日志中的说明
+
+        抛出:
+            AdmissionRejected: 排队请求过多，或排队超过截止时间
+        """
+        # 成本超过容量的请求在空闲时仍然可以单独执行
+        cost = min(cost, self.capacity)
+        with self._cond:
+            if self._queue or self._in_flight + cost > self.capacity:
+                if len(self._queue) >= self.max_queue:
+                    self.rejected += 1
+                    print(f"渲染队列已满，拒绝请求: {label}")
+                    raise AdmissionRejected("服务器繁忙，请稍后重试", 429, self.retry_after())
+
+                ticket = [cost]
+                self._queue.append(ticket)
+                try:
+                    while self._queue[0] is not ticket or self._in_flight + cost > self.capacity:
+                        timeout = remaining_time()
+                        if timeout is not None and timeout <= 0:
+                            self.rejected += 1
+                            print(f"等待渲染资源超过截止时间: {label}")
+                            raise AdmissionRejected("服务器繁忙，等待超时", 503, self.retry_after())
+                        self._cond.wait(timeout)
+                finally:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()
+
+            self._in_flight += cost
+            self.admitted += 1
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self._in_flight -= cost
+                if cost > 0:
+                    self._seconds_per_cost = 0.8 * self._seconds_per_cost + 0.2 * (elapsed / cost)
+                self._cond.notify_all()
+
+    def stats(self):
+        """当前负载"""
+        with self._cond:
+            return {
+                'capacity': self.capacity,
+                'inFlightCost': round(self._in_flight, 2),
+                'queued': len(self._queue),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'secondsPerCost': round(self._seconds_per_cost, 3),
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """获取进程内共享的准入控制器"""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController()
+    return _controller
@@ -0,0 +1,126 @@
+import io
+import os
+import zipfile
+
+from PIL import features
+
+from app.controllers.map_controller import build_map_figure, build_map_filename, deliver_map_image
+from app.controllers.admission import check_deadline, estimate_render_cost, get_admission_controller
+from app.controllers.telemetry import record_render
+from app.controllers.quality import quality_settings, get_quality_controller, report_quality
+
+# 支持的动画格式及其数据类型
+ANIMATION_FORMATS = {
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    'zip': 'application/zip',
+}
+# 单个动画的最大帧数
+MAX_ANIMATION_FRAMES = int(os.environ.get('MAX_ANIMATION_FRAMES', 120))
+# 动画帧的默认分辨率（16×9英寸 × 100 DPI = 1600×900像素）
+DEFAULT_FRAME_DPI = 100
+
+
+def render_frames(map_figure, frames, dpi=DEFAULT_FRAME_DPI):
+    """
+    逐帧更新高亮颜色和标题并栅格化
+
+    图形只构建一次，每帧只修改区域集合的颜色和标题文本。
+
+    参数:
+        map_figure (MapFigure): 已构建的地图图形
+        frames (list): 每帧包含 highlightRegions（高亮区域列表）和可选的 title（标题）
+        dpi (int): 帧分辨率
+
+    返回:
+        generator: 逐帧产生PIL图像
+    """
+    for index, frame in enumerate(frames):
+        check_deadline(f"渲染第{index + 1}帧")
+        map_figure.set_highlights(frame.get('highlightRegions', []))
+        if frame.get('title'):
+            map_figure.set_title(str(frame['title']))
+        print(f"渲染动画帧 {index + 1}/{len(frames)}")
+        yield map_figure.render_image(dpi)
+
+
+def encode_animation(images, animation_format, frame_duration=500, loop=0):
+    """
+    将帧序列编码为动画或压缩包
+
+    参数:
+        images: PIL图像的可迭代对象
+        animation_format (str): 'gif', 'webp' 或 'zip'（PNG帧的压缩包）
+        frame_duration (int): 每帧显示时长（毫秒）
+        loop (int): 循环次数，0表示无限循环
+
+    返回:
+        bytes: 编码后的数据
+    """
+    buf = io.BytesIO()
+
+    if animation_format == 'zip':
+        # 逐帧写入压缩包，不需要同时保留所有帧
+        with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_STORED) as zf:
+            for index, image in enumerate(images):
+                frame_buf = io.BytesIO()
+                image.save(frame_buf, format='PNG')
+                zf.writestr(f"frame_{index:04d}.png", frame_buf.getvalue())
+        return buf.getvalue()
+
+    images = list(images)
+    if not images:
+        raise ValueError("动画至少需要一帧")
+
+    first, rest = images[0], images[1:]
+    if animation_format == 'gif':
+        first.save(buf, format='GIF', save_all=True, append_images=rest,
+                   duration=frame_duration, loop=loop)
+    else:
+        first.save(buf, format='WEBP', save_all=True, append_images=rest,
+                   duration=frame_duration, loop=loop, quality=85)
+    return buf.getvalue()
+
+
+def generate_animation(frames, animation_format='gif', frame_duration=500, dpi=DEFAULT_FRAME_DPI,
+                       save_local=False, **map_kwargs):
+    """
+    生成动画地图（例如每天只有高亮颜色变化的时间序列地图）
+
+    参数:
+        frames (list): 每帧包含 highlightRegions 和可选的 title
+        animation_format (str): 'gif', 'webp' 或 'zip'
+        frame_duration (int): 每帧显示时长（毫秒）
+        dpi (int): 帧分辨率
+        save_local (bool): 是否保存到本地文件系统
+        **map_kwargs: 传递给 build_map_figure 的地图参数（底图、边界、标签、标题等）
+
+    返回:
+        str: 如果save_local=True，返回保存后的相对路径；否则返回Base64编码的data URI
+    """
+    if animation_format not in ANIMATION_FORMATS:
+        raise ValueError(f"不支持的动画格式: {animation_format}，可选: {', '.join(ANIMATION_FORMATS)}")
+    if animation_format == 'webp' and not features.check('webp'):
+        raise ValueError("当前Pillow不支持WebP格式，请使用gif或zip格式")
+    if not frames:
+        raise ValueError("动画至少需要一帧")
+    if len(frames) > MAX_ANIMATION_FRAMES:
+        raise ValueError(f"动画帧数不能超过{MAX_ANIMATION_FRAMES}")
+
+    # 用第一帧的高亮区域构建图形，后续帧只更新颜色和标题
+    map_kwargs['highlight_regions'] = frames[0].get('highlightRegions', [])
+    # 负载高时降低质量：帧分辨率按比例降低，图形按对应等级构建
+    quality = get_quality_controller().current_tier()
+    report_quality(quality)
+    if quality != 'full':
+        map_kwargs['quality'] = quality
+        dpi = max(1, round(dpi * quality_settings(quality)['scale']))
+    cost = estimate_render_cost(map_kwargs, dpi, len(frames))
+    with get_admission_controller().admit(cost, f"动画 {len(frames)}帧"), record_render('animation'):
+        map_figure = build_map_figure(**map_kwargs)
+        images = render_frames(map_figure, frames, dpi)
+        data = encode_animation(images, animation_format, frame_duration)
+    print(f"动画生成完成: {len(frames)}帧, {len(data) / 1024:.0f} KiB")
+
+    filename = build_map_filename(map_figure, extension=animation_format)
+    return deliver_map_image(data, filename, save_local, ANIMATION_FORMATS[animation_format])
@@ -0,0 +1,450 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+import geopandas as gpd
+import pandas as pd
+import pyproj
+from pyproj import CRS
+
+from app.controllers.shared_geometry import RaggedGeometry, attach_or_publish
+
+# 定义shp文件路径
+SHP_FOLDER = 'shp'
+
+# 可选的地图投影
+PROJECTIONS = {
+    # Lambert正形圆锥投影（中国测绘标准），两个标准纬线覆盖中国南北跨度（海南到黑龙江）
+    'lcc': {
+        'name': 'Lambert正形圆锥投影',
+        'crs': "+proj=lcc +lat_1=25 +lat_2=47 +lon_0=105 +lat_0=0 "
+               "+x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs"
+    },
+    # Albers等积圆锥投影，面积无变形，适合分级统计图
+    'albers': {
+        'name': 'Albers等积圆锥投影',
+        'crs': "+proj=aea +lat_1=25 +lat_2=47 +lon_0=105 +lat_0=0 "
+               "+x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs"
+    },
+    'mercator': {
+        'name': 'Web墨卡托投影',
+        'crs': 'EPSG:3857'
+    },
+    'geographic': {
+        'name': '经纬度坐标（WGS84）',
+        'crs': 'EPSG:4326'
+    },
+}
+DEFAULT_PROJECTION = 'lcc'
+
+# 投影后数据集的缓存数量上限（每个 (级别, 投影) 组合占一项）
+PROJECTED_CACHE_SIZE = int(os.environ.get('PROJECTED_CACHE_SIZE', 6))
+# 检查shp文件是否更新的间隔（秒），0表示不自动检查（可以调用 reload_boundary_data 手动加载）
+DATA_WATCH_SECONDS = float(os.environ.get('DATA_WATCH_SECONDS', 10))
+# 发现文件变化后等待文件稳定（例如仍在复制）的时间（秒）
+DATA_SETTLE_SECONDS = float(os.environ.get('DATA_SETTLE_SECONDS', 2))
+
+# 边界数据的级别（数据版本由所有级别的源文件共同决定）
+DATA_LEVELS = ('省', '市', '县')
+
+# 当前使用的边界数据
+_current_store = None
+_store_lock = threading.Lock()
+# 同一时间只建立一个新版本
+_reload_lock = threading.Lock()
+# 建立失败的源文件版本（文件再次变化前不重试）
+_failed_versions = None
+# 启动了检查线程的进程（fork出的工作进程需要各自启动）
+_watcher_pid = None
+# 当前请求（或任务）固定使用的边界数据，保证一次请求中的所有数据来自同一版本
+_pinned_store = ContextVar('boundary_store', default=None)
+
+
+@lru_cache(maxsize=None)
+def get_projection_crs(projection=DEFAULT_PROJECTION):
+    """
+    获取投影对应的坐标系（每种投影只创建一次）
+
+    参数:
+        projection (str): 投影名称，可选 'lcc', 'albers', 'mercator', 'geographic'
+
+    返回:
+        pyproj.CRS: 坐标系
+    """
+    if projection not in PROJECTIONS:
+        raise ValueError(f"不支持的投影: {projection}，可选: {', '.join(PROJECTIONS)}")
+    return CRS.from_user_input(PROJECTIONS[projection]['crs'])
+
+
+def read_shapefile(shp_path):
+    """按 UTF-8、GBK、Latin-1 的顺序尝试读取shp文件"""
+    try:
+        return gpd.read_file(shp_path, encoding='utf-8')
+    except Exception as e:
+        print(f"读取shp文件时出错: {str(e)}")
+        # 尝试使用不同的编码
+        try:
+            return gpd.read_file(shp_path, encoding='gbk')
+        except Exception as e2:
+            print(f"尝试使用GBK编码读取文件时出错: {str(e2)}")
+            try:
+                return gpd.read_file(shp_path, encoding='latin1')
+            except Exception as e3:
+                raise ValueError(f"无法读取shp文件: {str(e3)}")
+
+
+class ProjectedDataset:
+    """
+    投影后的边界数据：属性表 + 扁平几何数组
+
+    属性表（pandas DataFrame）的索引就是区域在几何数组中的位置，筛选属性表后按索引取几何。
+    几何数组通常是共享内存中的只读映射，调用方不能修改属性表和几何数组。
+    """
+
+    def __init__(self, map_type, projection, attributes, geometry):
+        self.map_type = map_type
+        self.projection = projection
+        self.attributes = attributes
+        self.geometry = geometry
+        self.crs = get_projection_crs(projection)
+
+    def __len__(self):
+        return len(self.attributes)
+
+
+def get_shapefile_path(map_type):
+    """某一级别的shp文件路径（文件不存在时抛出FileNotFoundError）"""
+    shp_path = os.path.join(SHP_FOLDER, f"{map_type}.shp")
+    if not os.path.exists(shp_path):
+        raise FileNotFoundError(f"找不到{shp_path}文件")
+    return shp_path
+
+
+def scan_source_version(map_type):
+    """根据shp及其附属文件的大小和修改时间生成数据版本号（每次调用都检查文件）"""
+    digest = hashlib.sha1()
+    stem = os.path.splitext(get_shapefile_path(map_type))[0]
+    for extension in ('.shp', '.shx', '.dbf', '.prj', '.cpg'):
+        path = stem + extension
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{extension}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:16]
+
+
+def scan_data_versions():
+    """所有级别源文件的当前版本 {级别: 版本号}，文件缺失的级别为None"""
+    versions = {}
+    for level in DATA_LEVELS:
+        try:
+            versions[level] = scan_source_version(level)
+        except FileNotFoundError:
+            versions[level] = None
+    return versions
+
+
+def load_boundary_data(map_type):
+    """
+    读取某一级别的原始边界数据（地理坐标）
+
+    只在生成投影数据时调用；结果不常驻内存，渲染时使用 get_projected_data 返回的扁平数组。
+
+    参数:
+        map_type (str): 地图级别，'省', '市' 或 '县'
+
+    返回:
+        GeoDataFrame: 原始边界数据
+    """
+    gdf = read_shapefile(get_shapefile_path(map_type))
+    print(f"已加载{map_type}级边界数据: {len(gdf)}条，坐标系统: {gdf.crs}")
+    return gdf
+
+
+def _build_projected_arrays(map_type, projection):
+    """读取并投影边界数据，转换为扁平几何数组和属性表"""
+    gdf = load_boundary_data(map_type).to_crs(get_projection_crs(projection))
+    print(f"[OK] {map_type}级数据已转换为{PROJECTIONS[projection]['name']}")
+    geometry = RaggedGeometry.from_geometries(gdf.geometry.values)
+    attributes = pd.DataFrame(gdf.drop(columns=gdf.geometry.name)).reset_index(drop=True)
+    return geometry, attributes
+
+
+class BoundaryStore:
+    """
+    某一版本源文件对应的全部边界数据
+
+    每个版本是一个独立的对象：源文件更新后在后台建立新对象并整体替换，
+    旧对象由仍在使用它的请求继续使用，不会出现同一请求中混用新旧数据的情况。
+    投影后的数据集按 (级别, 投影) 缓存在本对象的有界LRU中，随对象一起释放。
+    """
+
+    def __init__(self, versions):
+        self.versions = dict(versions)
+        # 数据版本号，所有依赖边界数据的缓存键（地图图片、区域列表、索引等）都包含它
+        self.version = '-'.join(self.versions.get(level) or 'missing' for level in DATA_LEVELS)
+        self.created_at = time.time()
+        self._projected_data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def source_version(self, map_type):
+        """某一级别的源文件版本（该级别的文件缺失时抛出FileNotFoundError）"""
+        version = self.versions.get(map_type)
+        if version is None:
+            raise FileNotFoundError(f"找不到{os.path.join(SHP_FOLDER, f'{map_type}.shp')}文件")
+        return version
+
+    def loaded_keys(self):
+        """已加载的 (级别, 投影) 组合"""
+        with self._lock:
+            return list(self._projected_data)
+
+    def _build(self, map_type, projection):
+        """读取并投影源文件，确认文件与本版本一致且读取期间没有变化（否则数据与版本号不符）"""
+        if scan_source_version(map_type) != self.versions[map_type]:
+            raise DataVersionChanged(f"{map_type}级边界数据正在更新，请稍后重试")
+        arrays = _build_projected_arrays(map_type, projection)
+        if scan_source_version(map_type) != self.versions[map_type]:
+            raise DataVersionChanged(f"{map_type}级边界数据正在更新，请稍后重试")
+        return arrays
+
+    def get_projected_data(self, map_type, projection=DEFAULT_PROJECTION):
+        """获取投影后的边界数据，参数和返回值见模块级的 get_projected_data"""
+        key = (map_type, projection)
+        with self._lock:
+            dataset = self._projected_data.get(key)
+            if dataset is not None:
+                self._projected_data.move_to_end(key)
+                return dataset
+
+        get_projection_crs(projection)
+        version = self.source_version(map_type)
+        try:
+            geometry, attributes = attach_or_publish(
+                f"{map_type}-{projection}", version, lambda: self._build(map_type, projection))
+        except DataVersionChanged:
+            # 文件在本版本建立后才发生变化：尽快加载新版本
+            request_data_reload()
+            raise
+        dataset = ProjectedDataset(map_type, projection, attributes, geometry)
+
+        with self._lock:
+            self._projected_data[key] = dataset
+            self._projected_data.move_to_end(key)
+            while len(self._projected_data) > PROJECTED_CACHE_SIZE:
+                self._projected_data.popitem(last=False)
+        return dataset
+
+
+class DataVersionChanged(RuntimeError):
+    """读取源文件期间文件发生了变化"""
+
+
+def _current():
+    """当前版本的边界数据（首次调用时建立，并启动检查线程）"""
+    global _current_store
+    if _current_store is None:
+        with _store_lock:
+            if _current_store is None:
+                _current_store = BoundaryStore(scan_data_versions())
+    _ensure_watcher()
+    return _current_store
+
+
+def get_boundary_store():
+    """
+    获取边界数据：当前请求已固定版本时返回该版本，否则返回最新版本
+
+    返回:
+        BoundaryStore: 边界数据
+    """
+    return _pinned_store.get() or _current()
+
+
+def pin_boundary_store(store=None):
+    """
+    在当前上下文中固定使用某一版本的边界数据（默认为最新版本），之后的调用都使用该版本
+
+    返回:
+        Token: 传给 unpin_boundary_store 以恢复
+    """
+    return _pinned_store.set(store or _current())
+
+
+def unpin_boundary_store(token):
+    """取消 pin_boundary_store 的固定"""
+    try:
+        _pinned_store.reset(token)
+    except ValueError:
+        # 在其他上下文中恢复（例如请求结束时的回调）
+        _pinned_store.set(None)
+
+
+@contextmanager
+def use_boundary_store(store=None):
+    """在with块中固定使用某一版本的边界数据（默认为最新版本）"""
+    token = pin_boundary_store(store)
+    try:
+        yield _pinned_store.get()
+    finally:
+        unpin_boundary_store(token)
+
+
+def iter_with_boundary_store(iterable, store):
+    """逐项迭代，生成每一项时固定使用store（用于请求结束后才生成的流式响应）"""
+    iterator = iter(iterable)
+    while True:
+        with use_boundary_store(store):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def get_source_version(map_type):
+    """当前使用的边界数据中某一级别的源文件版本（文件缺失时抛出FileNotFoundError）"""
+    return get_boundary_store().source_version(map_type)
+
+
+def get_data_version():
+    """当前使用的边界数据的版本号（所有级别）"""
+    return get_boundary_store().version
+
+
+def get_projected_data(map_type, projection=DEFAULT_PROJECTION):
+    """
+    获取投影后的边界数据
+
+    投影结果以扁平数组的形式发布到共享内存，同一台机器上的工作进程只投影一次并共享同一份顶点数据；
+    进程内按 (级别, 投影) 缓存在当前版本的有界LRU中。返回的数据是共享的，调用方不能修改它。
+
+    参数:
+        map_type (str): 地图级别，'省', '市' 或 '县'
+        projection (str): 投影名称
+
+    返回:
+        ProjectedDataset: 投影后的边界数据
+    """
+    return get_boundary_store().get_projected_data(map_type, projection)
+
+
+def reload_boundary_data(force=False):
+    """
+    源文件更新后建立新版本的边界数据并替换当前版本
+
+    新版本预先加载当前版本已加载的所有 (级别, 投影) 组合，加载完成后才替换，
+    替换前的请求继续使用旧版本，替换后的请求使用新版本，不需要重启服务。
+    读取失败（例如文件不完整）时保留当前版本。
+
+    参数:
+        force (bool): 源文件没有变化时也重新建立
+
+    返回:
+        bool: 是否替换了新版本
+    """
+    global _current_store, _failed_versions
+    with _reload_lock:
+        old_store = _current()
+        versions = scan_data_versions()
+        if versions == old_store.versions and not force:
+            return False
+
+        started = time.time()
+        store = BoundaryStore(versions)
+        keys = old_store.loaded_keys() or [(level, DEFAULT_PROJECTION) for level in DATA_LEVELS]
+        try:
+            for map_type, projection in keys:
+                if versions.get(map_type) is not None:
+                    store.get_projected_data(map_type, projection)
+        except Exception as e:
+            _failed_versions = versions
+            print(f"加载新版本边界数据失败，继续使用版本 {old_store.version}: {str(e)}")
+            return False
+        if scan_data_versions() != versions:
+            print("加载新版本边界数据期间源文件再次发生变化，稍后重试")
+            return False
+
+        with _store_lock:
+            _current_store = store
+        _failed_versions = None
+        print(f"边界数据已更新: {old_store.version} -> {store.version}（{time.time() - started:.1f}秒）")
+        return True
+
+
+def request_data_reload():
+    """在后台加载新版本（已有加载任务或这些文件已加载失败时不重复加载）"""
+    if _reload_lock.locked() or scan_data_versions() == _failed_versions:
+        return
+    threading.Thread(target=_reload_quietly, name='boundary-reload', daemon=True).start()
+
+
+def _reload_quietly():
+    try:
+        reload_boundary_data()
+    except Exception as e:
+        print(f"加载新版本边界数据时出错: {str(e)}")
+
+
+def _watch():
+    """定期检查源文件，文件变化且稳定后加载新版本"""
+    while True:
+        time.sleep(DATA_WATCH_SECONDS)
+        try:
+            versions = scan_data_versions()
+            if versions == _current_store.versions or versions == _failed_versions:
+                continue
+            time.sleep(DATA_SETTLE_SECONDS)
+            if scan_data_versions() != versions:
+                continue  # 仍在写入，下次再检查
+            reload_boundary_data()
+        except Exception as e:
+            print(f"检查边界数据更新时出错: {str(e)}")
+
+
+def _ensure_watcher():
+    global _watcher_pid
+    if DATA_WATCH_SECONDS <= 0 or _watcher_pid == os.getpid():
+        return
+    with _store_lock:
+        if _watcher_pid == os.getpid():
+            return
+        _watcher_pid = os.getpid()
+    threading.Thread(target=_watch, name='boundary-watcher', daemon=True).start()
+
+
+def boundary_data_stats():
+    """当前边界数据的版本和已加载的数据集（用于监控）"""
+    store = _current()
+    return {
+        'version': store.version,
+        'loadedAt': store.created_at,
+        'datasets': [f"{map_type}-{projection}" for map_type, projection in store.loaded_keys()],
+        'watchSeconds': DATA_WATCH_SECONDS,
+    }
+
+
+def get_region_attributes(map_type):
+    """获取某一级别的区域属性表（省、市、县名称和代码等）"""
+    return get_projected_data(map_type, DEFAULT_PROJECTION).attributes
+
+
+def get_scale_factor(projection, x, y):
+    """
+    计算投影坐标 (x, y) 处每米实际距离对应的投影坐标长度，用于比例尺
+
+    返回:
+        float 或 None: 比例因子；经纬度坐标（单位不是米）时返回None
+    """
+    crs = get_projection_crs(projection)
+    if crs.is_geographic:
+        return None
+    proj = pyproj.Proj(crs)
+    lon, lat = proj(x, y, inverse=True)
+    factors = proj.get_factors(lon, lat)
+    # 沿纬线方向的比例因子，比例尺是水平绘制的
+    return float(factors.parallel_scale)
@@ -0,0 +1,240 @@
+import numpy as np
+import pandas as pd
+import matplotlib
+from matplotlib.colors import to_hex
+from matplotlib.patches import Patch
+
+# 分级方案
+CLASSIFICATION_SCHEMES = ('quantile', 'equal_interval', 'natural_breaks')
+DEFAULT_SCHEME = 'quantile'
+DEFAULT_CLASSES = 5
+DEFAULT_CMAP = 'YlOrRd'
+MAX_CLASSES = 9
+# 自然断点法（Fisher-Jenks）的最大样本数，超过时先按分位数抽样
+NATURAL_BREAKS_MAX_SAMPLES = 1000
+
+# 各级别地图用于关联数据的代码字段和名称字段
+JOIN_FIELDS = {
+    '省': {'code': '省代码', 'name': '省'},
+    '市': {'code': '市代码', 'name': '市'},
+    '县': {'code': 'PAC', 'name': 'NAME'},
+}
+
+
+def load_value_table(records=None, file=None):
+    """
+    读取分级统计数据表
+
+    参数:
+        records: JSON数据，可以是 [{'code'或'name': ..., 'value': ...}, ...] 或 {区域: 数值}
+        file: 上传的CSV或Parquet文件（werkzeug FileStorage），需包含 code/name 列和 value 列
+
+    返回:
+        DataFrame: 包含 'code' 或 'name' 列以及 'value' 列
+    """
+    if file is not None:
+        filename = (file.filename or '').lower()
+        if filename.endswith('.parquet'):
+            try:
+                table = pd.read_parquet(file.stream)
+            except ImportError:
+                raise ValueError("读取Parquet文件需要安装 pyarrow")
+        elif filename.endswith('.csv') or filename.endswith('.txt'):
+            # 代码字段按字符串读取，避免前导零等问题
+            table = pd.read_csv(file.stream, dtype={'code': str, 'name': str})
+        else:
+            raise ValueError("只支持CSV或Parquet格式的数据文件")
+    elif isinstance(records, dict):
+        table = pd.DataFrame({'name': list(records.keys()), 'value': list(records.values())})
+    elif isinstance(records, list):
+        table = pd.DataFrame.from_records(records)
+    elif isinstance(records, pd.DataFrame):
+        table = records
+    else:
+        raise ValueError("分级统计数据必须是列表、字典或上传的文件")
+
+    table.columns = [str(c).strip().lower() for c in table.columns]
+    if 'value' not in table.columns or not ({'code', 'name'} & set(table.columns)):
+        raise ValueError("分级统计数据需要包含 code 或 name 列，以及 value 列")
+
+    table = table.copy()
+    table['value'] = pd.to_numeric(table['value'], errors='coerce')
+    return table
+
+
+def join_values(gdf, table, map_type):
+    """
+    将数据表与边界数据做一次向量化关联
+
+    参数:
+        gdf: 边界数据
+        table: load_value_table返回的数据表
+        map_type (str): 地图级别
+
+    返回:
+        ndarray: 与gdf行顺序一致的数值数组，无数据的区域为nan
+    """
+    fields = JOIN_FIELDS[map_type]
+    key = 'code' if 'code' in table.columns else 'name'
+    gdf_field = fields[key]
+    if gdf_field not in gdf.columns:
+        raise ValueError(f"{map_type}级地图缺少关联字段: {gdf_field}")
+
+    left = gdf[gdf_field].astype(str).str.strip()
+    right = table[[key, 'value']].dropna(subset=[key])
+    right = right.assign(**{key: right[key].astype(str).str.strip()})
+    # 同一区域出现多次时取最后一条
+    right = right.drop_duplicates(subset=key, keep='last').set_index(key)['value']
+
+    values = left.map(right).to_numpy(dtype=float, copy=True)
+    if key == 'name' and map_type == '市':
+        # 市级名称允许省略"市"后缀
+        missing = np.isnan(values)
+        if missing.any():
+            values[missing] = left[missing].str.removesuffix('市').map(right).to_numpy(dtype=float)
+    return values
+
+
+def _natural_breaks(values, k):
+    """Fisher-Jenks自然断点（动态规划，内层循环向量化）"""
+    x = np.sort(values)
+    if len(x) > NATURAL_BREAKS_MAX_SAMPLES:
+        x = np.quantile(x, np.linspace(0, 1, NATURAL_BREAKS_MAX_SAMPLES))
+    n = len(x)
+    cs = np.concatenate([[0.0], np.cumsum(x)])
+    cs2 = np.concatenate([[0.0], np.cumsum(x * x)])
+
+    # cost[c, i]: 前i个值分为c类的最小组内平方和
+    cost = np.full((k + 1, n + 1), np.inf)
+    split = np.zeros((k + 1, n + 1), dtype=int)
+    cost[0, 0] = 0.0
+    for c in range(1, k + 1):
+        for i in range(c, n + 1):
+            j = np.arange(c - 1, i)
+            m = i - j
+            s = cs[i] - cs[j]
+            ssd = (cs2[i] - cs2[j]) - s * s / m
+            total = cost[c - 1, j] + ssd
+            best = np.argmin(total)
+            cost[c, i] = total[best]
+            split[c, i] = j[best]
+
+    # 回溯得到每一类的上界
+    breaks = []
+    i = n
+    for c in range(k, 0, -1):
+        breaks.append(x[i - 1])
+        i = split[c, i]
+    return np.array(breaks[::-1])
+
+
+def classify(values, scheme=DEFAULT_SCHEME, k=DEFAULT_CLASSES):
+    """
+    计算分级断点
+
+    参数:
+        values (ndarray): 数值（nan会被忽略）
+        scheme (str): 'quantile'(分位数), 'equal_interval'(等间距), 'natural_breaks'(自然断点)
+        k (int): 分级数量
+
+    返回:
+        ndarray: 每一类的上界，长度不超过k，升序
+    """
+    if scheme not in CLASSIFICATION_SCHEMES:
+        raise ValueError(f"不支持的分级方案: {scheme}，可选: {', '.join(CLASSIFICATION_SCHEMES)}")
+
+    valid = values[np.isfinite(values)]
+    if len(valid) == 0:
+        return np.array([])
+    k = max(1, min(int(k), MAX_CLASSES, len(np.unique(valid))))
+
+    if scheme == 'quantile':
+        breaks = np.quantile(valid, np.linspace(0, 1, k + 1)[1:])
+    elif scheme == 'equal_interval':
+        breaks = np.linspace(valid.min(), valid.max(), k + 1)[1:]
+    else:
+        breaks = _natural_breaks(valid, k)
+    return np.unique(breaks)
+
+
+def _format_value(value):
+    """格式化图例中的数值"""
+    if abs(value) >= 100 or float(value).is_integer():
+        return f"{value:,.0f}"
+    return f"{value:,.2f}"
+
+
+def prepare_choropleth(gdf, map_type, options, missing_color='#EAEAEA'):
+    """
+    计算分级统计图中每个区域的颜色和图例
+
+    参数:
+        gdf: 边界数据（已筛选、已投影）
+        map_type (str): 地图级别
+        options (dict): 分级统计选项
+            - data / table: 数据（JSON记录或已读取的DataFrame）
+            - scheme (str): 分级方案，默认 'quantile'
+            - k (int): 分级数量，默认5
+            - cmap (str): matplotlib色带名称，默认 'YlOrRd'
+            - legendTitle (str): 图例标题
+        missing_color (str): 无数据区域的颜色
+
+    返回:
+        tuple: (与gdf行顺序一致的颜色列表, 图例项列表 [(颜色, 文本), ...])
+    """
+    table = options.get('table')
+    if table is None:
+        table = load_value_table(options.get('data'))
+
+    values = join_values(gdf, table, map_type)
+    print(f"分级统计数据关联完成: {int(np.isfinite(values).sum())}/{len(gdf)} 个区域有数据")
+    return color_values(values, options, missing_color)
+
+
+def color_values(values, options, missing_color='#EAEAEA'):
+    """
+    按分级方案把每个区域的数值映射为颜色（分级统计图和点数据按区域汇总共用）
+
+    参数:
+        values (ndarray): 每个区域的数值，无数据为nan
+        options (dict): 分级选项 scheme、k、cmap（见 prepare_choropleth）
+        missing_color (str): 无数据区域的颜色
+
+    返回:
+        tuple: (颜色列表, 图例项列表 [(颜色, 文本), ...])
+    """
+    matched = int(np.isfinite(values).sum())
+    breaks = classify(values, options.get('scheme', DEFAULT_SCHEME), options.get('k', DEFAULT_CLASSES))
+    cmap = matplotlib.colormaps.get(options.get('cmap') or DEFAULT_CMAP)
+    if cmap is None:
+        raise ValueError(f"不支持的色带: {options.get('cmap')}")
+    palette = [to_hex(cmap(v)) for v in np.linspace(0.15, 0.95, max(len(breaks), 1))]
+
+    # 一次性把数值映射到分级
+    finite = np.isfinite(values)
+    classes = np.searchsorted(breaks, values[finite], side='left')
+    classes = np.minimum(classes, len(breaks) - 1)
+    colors = np.full(len(values), missing_color, dtype=object)
+    colors[finite] = np.asarray(palette, dtype=object)[classes]
+
+    legend = []
+    lower = np.nanmin(values) if matched else None
+    for color, upper in zip(palette, breaks):
+        legend.append((color, f"{_format_value(lower)} – {_format_value(upper)}"))
+        lower = upper
+    if matched < len(values):
+        legend.append((missing_color, '无数据'))
+    return colors.tolist(), legend
+
+
+def draw_choropleth_legend(ax, legend, title='', font=None, location='lower left'):
+    """绘制分级统计图图例"""
+    handles = [Patch(facecolor=color, edgecolor='#666666', linewidth=0.5, label=label)
+               for color, label in legend]
+    kwargs = {'prop': font} if font is not None else {}
+    legend_artist = ax.legend(handles=handles, title=title or None, loc=location,
+                              frameon=True, framealpha=0.9, **kwargs)
+    if font is not None and title:
+        legend_artist.get_title().set_fontproperties(font)
+    legend_artist.set_zorder(1100)
+    return legend_artist
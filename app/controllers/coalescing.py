@@ -0,0 +1,181 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows下没有fcntl，只合并同一进程内的请求
+    fcntl = None
+
+from app.controllers.admission import AdmissionRejected, DeadlineExceeded, remaining_time
+
+# 跨进程合并使用的锁文件目录（同一台机器上的所有工作进程需要使用同一目录）
+RENDER_LOCK_DIR = os.environ.get('RENDER_LOCK_DIR',
+                                 os.path.join(tempfile.gettempdir(), 'china-map-generator-locks'))
+# 锁文件数量：请求按参数散列到固定数量的锁文件上，锁文件不会无限增加
+RENDER_LOCK_STRIPES = 1024
+# 等待其他进程释放锁时的轮询间隔（秒）
+_LOCK_POLL_INTERVAL = 0.05
+# 不缓存结果时，跨进程交接的渲染结果保留的时间（秒），只供渲染期间开始等待的请求读取
+HANDOFF_TTL_SECONDS = 60
+
+
+class _Call:
+    """一次正在进行的渲染"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    合并同一进程内参数相同的并发请求：第一个请求执行渲染，其余请求等待并共享同一结果
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """
+        执行func，或等待正在进行的相同调用
+
+        执行者因繁忙或超时失败时（只与执行者自己的请求有关），等待者重新尝试执行；其他错误共享给等待者。
+
+        参数:
+            key (str): 请求参数的规范化键
+            func: 无参数的渲染函数
+
+        返回:
+            func的返回值
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = _Call()
+                    self._calls[key] = call
+                else:
+                    self.coalesced += 1
+
+            if leader:
+                try:
+                    call.result = func()
+                    return call.result
+                except BaseException as e:
+                    call.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call.done.set()
+
+            print(f"相同的地图正在渲染，等待结果: {key}")
+            if not call.done.wait(remaining_time()):
+                raise DeadlineExceeded("请求超时，等待相同地图的渲染结果时停止")
+            if call.error is None:
+                return call.result
+            if not isinstance(call.error, (AdmissionRejected, DeadlineExceeded)):
+                raise call.error
+
+
+@contextmanager
+def process_lock(key):
+    """
+    同一台机器上的进程间互斥锁（按key散列到锁文件，使用flock）
+
+    没有fcntl时不加锁。等待超过当前请求的截止时间时抛出DeadlineExceeded。
+    """
+    if fcntl is None:
+        yield
+        return
+
+    os.makedirs(RENDER_LOCK_DIR, exist_ok=True)
+    stripe = int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16) % RENDER_LOCK_STRIPES
+    with open(os.path.join(RENDER_LOCK_DIR, f"{stripe:04d}.lock"), 'a') as lock_file:
+        waited = False
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if not waited:
+                    print(f"其他进程正在渲染相同的地图，等待: {key}")
+                    waited = True
+                remaining = remaining_time()
+                if remaining is not None and remaining <= 0:
+                    raise DeadlineExceeded("请求超时，等待其他进程的渲染结果时停止")
+                time.sleep(_LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _handoff_path(key):
+    return os.path.join(RENDER_LOCK_DIR, 'results', hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+def write_handoff(key, data, filename):
+    """
+    保存渲染结果供等待同一个锁的其他进程读取（未启用地图缓存时使用，需在持有 process_lock 时调用）
+
+    参数:
+        key (str): 请求参数的规范化键
+        data (bytes): 图片数据
+        filename (str): 文件名
+    """
+    path = _handoff_path(key)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(filename.encode('utf-8') + b'\n' + data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # 清理过期的结果
+    expired = time.time() - HANDOFF_TTL_SECONDS
+    for name in os.listdir(directory):
+        try:
+            if os.path.getmtime(os.path.join(directory, name)) < expired:
+                os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def read_handoff(key, since):
+    """
+    读取其他进程在 since 之后完成的渲染结果（即本请求等待期间完成的相同渲染）
+
+    返回:
+        tuple 或 None: (图片数据, 文件名)
+    """
+    path = _handoff_path(key)
+    try:
+        if os.path.getmtime(path) < since:
+            return None
+        with open(path, 'rb') as f:
+            filename, data = f.read().split(b'\n', 1)
+    except (OSError, ValueError):
+        return None
+    return data, filename.decode('utf-8')
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight():
+    """获取进程内共享的请求合并器"""
+    return _single_flight
@@ -0,0 +1,343 @@
+import gzip
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from app.controllers.boundary_store import PROJECTIONS, get_projected_data, get_data_version
+from app.controllers.outlines import SIMPLIFY_LEVELS, get_simplified_geometry
+
+try:
+    import brotli
+except ImportError:  # 未安装brotli时只提供gzip压缩
+    brotli = None
+
+BROTLI_AVAILABLE = brotli is not None
+
+# 支持的级别（URL中可以使用中文或英文）
+LEVEL_ALIASES = {'省': '省', '市': '市', '县': '县', 'province': '省', 'city': '市', 'county': '县'}
+# 支持的输出格式
+GEOMETRY_FORMATS = ('topojson', 'geojson')
+# 默认参数：经纬度坐标，区域级化简，10^5 网格量化（全国范围约0.6公里）
+DEFAULT_GEOMETRY_FORMAT = 'topojson'
+DEFAULT_GEOMETRY_PROJECTION = 'geographic'
+DEFAULT_SIMPLIFY = 'regional'
+DEFAULT_QUANTIZATION = 100000
+MAX_QUANTIZATION = 10 ** 8
+# 进程内缓存的已序列化、已压缩的结果数量
+GEOMETRY_CACHE_SIZE = int(os.environ.get('GEOMETRY_CACHE_SIZE', 32))
+
+_exports = OrderedDict()
+_exports_lock = threading.Lock()
+
+
+def resolve_level(level):
+    """将URL中的级别转换为 '省'、'市'、'县'"""
+    if level not in LEVEL_ALIASES:
+        raise ValueError(f"不支持的级别: {level}，可选: {', '.join(LEVEL_ALIASES)}")
+    return LEVEL_ALIASES[level]
+
+
+def normalize_geometry_options(level, output_format=None, province=None, city=None,
+                               simplify=None, quantization=None, projection=None):
+    """
+    检查并补全导出参数
+
+    参数:
+        level (str): 级别，'省'/'市'/'县' 或 'province'/'city'/'county'
+        output_format (str): 'topojson' 或 'geojson'
+        province (str, optional): 只导出该省的区域
+        city (str, optional): 只导出该市的区域
+        simplify (str): 化简级别，'none' 或 SIMPLIFY_LEVELS 中的级别
+        quantization (int): 量化网格的格数（每个方向），0表示不量化（仅GeoJSON）
+        projection (str): 坐标系，默认经纬度
+
+    返回:
+        dict: 规范化后的参数
+    """
+    output_format = output_format or DEFAULT_GEOMETRY_FORMAT
+    if output_format not in GEOMETRY_FORMATS:
+        raise ValueError(f"不支持的格式: {output_format}，可选: {', '.join(GEOMETRY_FORMATS)}")
+    simplify = simplify or DEFAULT_SIMPLIFY
+    if simplify != 'none' and simplify not in SIMPLIFY_LEVELS:
+        raise ValueError(f"不支持的化简级别: {simplify}，可选: none, {', '.join(SIMPLIFY_LEVELS)}")
+    projection = projection or DEFAULT_GEOMETRY_PROJECTION
+    if projection not in PROJECTIONS:
+        raise ValueError(f"不支持的投影: {projection}，可选: {', '.join(PROJECTIONS)}")
+    try:
+        quantization = DEFAULT_QUANTIZATION if quantization in (None, '') else int(quantization)
+    except (TypeError, ValueError):
+        raise ValueError("quantization必须是整数")
+    if quantization == 0 and output_format == 'topojson':
+        raise ValueError("TopoJSON需要量化（quantization不能为0）")
+    if quantization != 0 and not 2 <= quantization <= MAX_QUANTIZATION:
+        raise ValueError(f"quantization必须为0或2到{MAX_QUANTIZATION}之间的整数")
+    return {
+        'level': resolve_level(level),
+        'format': output_format,
+        'province': (province or '').strip() or None,
+        'city': (city or '').strip() or None,
+        'simplify': simplify,
+        'quantization': quantization,
+        'projection': projection,
+    }
+
+
+def geometry_etag(options):
+    """
+    导出结果的ETag：由参数和数据版本决定，不需要生成结果就可以回应条件请求
+    """
+    canonical = json.dumps(options, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{canonical}|{get_data_version()}".encode('utf-8')).hexdigest()[:32]
+
+
+def _select_regions(dataset, province, city):
+    """按省、市筛选区域，返回属性表"""
+    attributes = dataset.attributes
+    for field, value in (('省', province), ('市', city)):
+        if value is None:
+            continue
+        if field not in attributes.columns:
+            raise ValueError(f"{dataset.map_type}级数据不能按{field}筛选")
+        attributes = attributes[attributes[field] == value]
+    if attributes.empty:
+        raise LookupError("没有符合条件的区域")
+    return attributes
+
+
+def _properties(attributes):
+    """属性表转换为每个区域的属性字典（缺失值为null）"""
+    records = []
+    columns = list(attributes.columns)
+    for row in attributes.itertuples(index=False, name=None):
+        record = {}
+        for column, value in zip(columns, row):
+            if not isinstance(value, str) and pd.api.types.is_scalar(value) and pd.isna(value):
+                value = None
+            elif isinstance(value, np.generic):
+                value = value.item()
+            record[column] = value
+        records.append(record)
+    return records
+
+
+def _region_rings(geometry, position, to_grid):
+    """
+    一个区域的全部环（按多边形分组），坐标已转换到输出网格
+
+    返回:
+        list: 每个多边形的环列表，环为 (N, 2) 数组（首尾相同）；退化的环被丢弃
+    """
+    polygons = []
+    polygon_start, polygon_end = geometry.region_offsets[position], geometry.region_offsets[position + 1]
+    for polygon in range(polygon_start, polygon_end):
+        rings = []
+        for ring in range(geometry.polygon_offsets[polygon], geometry.polygon_offsets[polygon + 1]):
+            start, end = geometry.ring_offsets[ring], geometry.ring_offsets[ring + 1]
+            coords = to_grid(geometry.dequantize(geometry.coords[start:end]))
+            # 量化后相邻的重复点合并（公共边在两侧得到相同的结果）
+            keep = np.ones(len(coords), dtype=bool)
+            keep[1:] = np.any(coords[1:] != coords[:-1], axis=1)
+            coords = coords[keep]
+            if len(coords) >= 4:
+                rings.append(coords)
+        if rings:
+            polygons.append(rings)
+    return polygons
+
+
+def _grid(bounds, quantization):
+    """
+    量化网格：返回 (坐标 -> 网格坐标 的函数, 网格坐标 -> 坐标 的函数, scale, translate)
+
+    quantization为0时不量化，网格坐标就是原始坐标
+    """
+    if not quantization:
+        return (lambda coords: coords), (lambda coords: coords), None, None
+    xmin, ymin, xmax, ymax = bounds
+    scale = np.array([(xmax - xmin) / (quantization - 1) or 1.0, (ymax - ymin) / (quantization - 1) or 1.0])
+    translate = np.array([xmin, ymin])
+    to_grid = lambda coords: np.round((coords - translate) / scale).astype(np.int64)
+    from_grid = lambda grid: grid * scale + translate
+    return to_grid, from_grid, scale, translate
+
+
+def _coordinate_digits(scale):
+    """网格大小对应的小数位数（GeoJSON输出时按网格精度取整，减小体积）"""
+    return max(0, int(math.ceil(-math.log10(float(min(scale)))))) if scale is not None else None
+
+
+def build_geojson(regions, properties, from_grid, digits, bbox):
+    """生成GeoJSON FeatureCollection（每个区域一个MultiPolygon要素）"""
+    def coordinates(ring):
+        values = from_grid(ring)
+        if digits is not None:
+            values = np.round(values, digits)
+        return values.tolist()
+
+    features = []
+    for polygons, props in zip(regions, properties):
+        features.append({
+            'type': 'Feature',
+            'properties': props,
+            'geometry': {
+                'type': 'MultiPolygon',
+                'coordinates': [[coordinates(ring) for ring in rings] for rings in polygons]
+            } if polygons else None
+        })
+    return {'type': 'FeatureCollection', 'bbox': bbox, 'features': features}
+
+
+def _find_junctions(rings):
+    """
+    找出拓扑节点：同一个点在不同的环中有不同的相邻点时，它是公共边的端点
+
+    返回:
+        set: 节点坐标 (x, y)
+    """
+    points, neighbors = [], []
+    for ring in rings:
+        open_ring = ring[:-1]
+        previous = np.roll(open_ring, 1, axis=0)
+        following = np.roll(open_ring, -1, axis=0)
+        points.append(open_ring)
+        # 相邻点对不区分方向（两侧的环方向相反）
+        pair = np.concatenate([previous, following], axis=1)
+        swap = (previous[:, 0] > following[:, 0]) | ((previous[:, 0] == following[:, 0]) & (previous[:, 1] > following[:, 1]))
+        pair[swap] = np.concatenate([following[swap], previous[swap]], axis=1)
+        neighbors.append(pair)
+    if not points:
+        return set()
+
+    table = np.unique(np.concatenate([np.concatenate(points), np.concatenate(neighbors)], axis=1), axis=0)
+    # 去重后同一个点出现多次，说明它有不止一组相邻点
+    coords = table[:, :2]
+    repeated = np.all(coords[1:] == coords[:-1], axis=1)
+    junctions = coords[1:][repeated]
+    return set(map(tuple, junctions.tolist()))
+
+
+def _cut_ring(ring, junctions):
+    """在节点处把环切分为弧段；没有节点的环从最小的点开始，作为一条闭合弧"""
+    open_ring = ring[:-1]
+    cuts = [index for index, point in enumerate(map(tuple, open_ring.tolist())) if point in junctions]
+    if not cuts:
+        start = int(np.lexsort((open_ring[:, 1], open_ring[:, 0]))[0])
+        rotated = np.roll(open_ring, -start, axis=0)
+        return [np.vstack([rotated, rotated[:1]])]
+
+    rotated = np.roll(open_ring, -cuts[0], axis=0)
+    closed = np.vstack([rotated, rotated[:1]])
+    offsets = [cut - cuts[0] for cut in cuts] + [len(open_ring)]
+    return [closed[offsets[i]:offsets[i + 1] + 1] for i in range(len(offsets) - 1)]
+
+
+def build_topojson(regions, properties, object_name, scale, translate, bbox):
+    """
+    生成TopoJSON：相邻区域的公共边只保存一次，弧段坐标为增量编码的量化整数
+    """
+    all_rings = [ring for polygons in regions for rings in polygons for ring in rings]
+    junctions = _find_junctions(all_rings)
+
+    arcs = []
+    arc_index = {}  # 弧段坐标的字节表示 -> 索引
+
+    def arc_reference(arc):
+        key = arc.tobytes()
+        if key in arc_index:
+            return arc_index[key]
+        reverse_key = arc[::-1].tobytes()
+        if reverse_key in arc_index:
+            return ~arc_index[reverse_key]
+        arc_index[key] = len(arcs)
+        arcs.append(arc)
+        return arc_index[key]
+
+    geometries = []
+    for polygons, props in zip(regions, properties):
+        if not polygons:
+            geometries.append({'type': None, 'properties': props})
+            continue
+        geometries.append({
+            'type': 'MultiPolygon',
+            'arcs': [[[arc_reference(arc) for arc in _cut_ring(ring, junctions)] for ring in rings]
+                     for rings in polygons],
+            'properties': props
+        })
+
+    encoded_arcs = []
+    for arc in arcs:
+        deltas = np.diff(arc, axis=0, prepend=np.zeros((1, 2), dtype=arc.dtype))
+        encoded_arcs.append(deltas.tolist())
+
+    return {
+        'type': 'Topology',
+        'bbox': bbox,
+        'transform': {'scale': scale.tolist(), 'translate': translate.tolist()},
+        'objects': {object_name: {'type': 'GeometryCollection', 'geometries': geometries}},
+        'arcs': encoded_arcs,
+    }
+
+
+def _build_export(options):
+    """按参数生成并序列化导出结果"""
+    dataset = get_projected_data(options['level'], options['projection'])
+    attributes = _select_regions(dataset, options['province'], options['city'])
+    positions = attributes.index.to_numpy()
+
+    geometry = dataset.geometry
+    if options['simplify'] != 'none':
+        # 整体化简全部区域，筛选后的区域与相邻区域之间仍然没有缝隙
+        geometry = get_simplified_geometry(dataset, options['simplify'], wait=True) or dataset.geometry
+
+    bounds = geometry.total_bounds(positions)
+    to_grid, from_grid, scale, translate = _grid(bounds, options['quantization'])
+    regions = [_region_rings(geometry, position, to_grid) for position in positions]
+    properties = _properties(attributes)
+    bbox = [float(value) for value in bounds]
+
+    if options['format'] == 'topojson':
+        document = build_topojson(regions, properties, options['level'], scale, translate, bbox)
+    else:
+        document = build_geojson(regions, properties, from_grid, _coordinate_digits(scale), bbox)
+    return json.dumps(document, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def get_geometry_export(options):
+    """
+    获取已序列化并压缩的导出结果（按参数缓存，数据更新后失效）
+
+    参数:
+        options (dict): normalize_geometry_options 返回的参数
+
+    返回:
+        dict: etag、gzip（gzip压缩的数据）、br（brotli压缩的数据，未安装brotli时为None）、size（原始字节数）
+    """
+    etag = geometry_etag(options)
+    with _exports_lock:
+        cached = _exports.get(etag)
+        if cached is not None:
+            _exports.move_to_end(etag)
+            return cached
+
+    payload = _build_export(options)
+    export = {
+        'etag': etag,
+        'size': len(payload),
+        'gzip': gzip.compress(payload, compresslevel=9, mtime=0),
+        'br': brotli.compress(payload, quality=11) if brotli is not None else None,
+    }
+    print(f"已生成{options['level']}级{options['format']}: {len(payload) / 1024:.0f} KiB, "
+          f"gzip {len(export['gzip']) / 1024:.0f} KiB")
+
+    with _exports_lock:
+        _exports[etag] = export
+        _exports.move_to_end(etag)
+        while len(_exports) > GEOMETRY_CACHE_SIZE:
+            _exports.popitem(last=False)
+    return export
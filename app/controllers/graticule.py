@@ -0,0 +1,186 @@
+import threading
+from functools import lru_cache
+
+import numpy as np
+import pyproj
+from pyproj import CRS
+from matplotlib.collections import LineCollection
+
+# 经纬网使用的地理坐标系
+GEOGRAPHIC_CRS = CRS.from_epsg(4326)
+# 经纬线的候选间隔（度），按地图范围自动选择
+GRATICULE_STEPS = [0.1, 0.2, 0.25, 0.5, 1, 2, 2.5, 5, 10, 15, 20, 30]
+# 目标经纬线数量
+GRATICULE_TARGET_LINES = 6
+# 每条经纬线的采样点数（圆锥投影下经纬线是曲线）
+GRATICULE_SAMPLES = 128
+
+# pyproj的Transformer不是线程安全的，每个线程各自缓存
+_thread_local = threading.local()
+
+
+def get_transformer(src_crs, dst_crs):
+    """
+    获取坐标转换器（按线程和坐标系对缓存，避免每次渲染都重新创建）
+
+    参数:
+        src_crs: 源坐标系（pyproj.CRS 或可被 CRS.from_user_input 解析的值）
+        dst_crs: 目标坐标系
+
+    返回:
+        pyproj.Transformer: always_xy=True 的转换器
+    """
+    transformers = getattr(_thread_local, 'transformers', None)
+    if transformers is None:
+        transformers = _thread_local.transformers = {}
+    key = (src_crs, dst_crs)
+    transformer = transformers.get(key)
+    if transformer is None:
+        transformer = pyproj.Transformer.from_crs(src_crs, dst_crs, always_xy=True)
+        transformers[key] = transformer
+    return transformer
+
+
+def _nice_step(span):
+    """选择使经纬线数量接近GRATICULE_TARGET_LINES的间隔"""
+    for step in GRATICULE_STEPS:
+        if span / step <= GRATICULE_TARGET_LINES:
+            return step
+    return GRATICULE_STEPS[-1]
+
+
+def _format_degree(value, positive, negative):
+    """格式化经纬度标签，如 120°E、22.5°N"""
+    suffix = positive if value >= 0 else negative
+    return f"{abs(round(value, 4)):g}°{suffix}"
+
+
+def _edge_crossings(lines, axis, value):
+    """
+    计算每条折线与直线 {axis} = value 的第一个交点
+
+    参数:
+        lines (ndarray): 形状为 (线数, 采样点数, 2) 的坐标数组
+        axis (int): 0 表示与 x = value 相交，1 表示与 y = value 相交
+        value (float): 边界坐标
+
+    返回:
+        ndarray: 每条线交点处另一个坐标轴的值，不相交时为 nan
+    """
+    other = 1 - axis
+    d = lines[:, :, axis] - value
+    crosses = (d[:, :-1] * d[:, 1:]) <= 0
+    has_cross = crosses.any(axis=1)
+    first = np.argmax(crosses, axis=1)
+
+    rows = np.arange(len(lines))
+    d0 = d[rows, first]
+    d1 = d[rows, first + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(d0 != d1, d0 / (d0 - d1), 0.0)
+    p0 = lines[rows, first, other]
+    p1 = lines[rows, first + 1, other]
+    return np.where(has_cross, p0 + t * (p1 - p0), np.nan)
+
+
+@lru_cache(maxsize=64)
+def build_graticule(crs, extent):
+    """
+    计算指定投影和视图范围下的经纬网（结果按坐标系和范围缓存）
+
+    所有经线和纬线的采样点一次性完成坐标转换，在圆锥投影下得到真实的弧线。
+
+    参数:
+        crs (pyproj.CRS): 地图使用的坐标系
+        extent (tuple): 视图范围 (x_min, x_max, y_min, y_max)，投影坐标
+
+    返回:
+        dict: segments（所有经纬线坐标）、x_ticks/x_labels（经线与下边界交点）、
+              y_ticks/y_labels（纬线与左边界交点）
+    """
+    x_min, x_max, y_min, y_max = extent
+    to_geographic = get_transformer(crs, GEOGRAPHIC_CRS)
+    to_projected = get_transformer(GEOGRAPHIC_CRS, crs)
+
+    # 沿视图边界采样并转换为经纬度，得到视图覆盖的经纬度范围
+    edge = np.linspace(0.0, 1.0, 64)
+    xs = np.concatenate([x_min + edge * (x_max - x_min), np.full_like(edge, x_max),
+                         x_max - edge * (x_max - x_min), np.full_like(edge, x_min)])
+    ys = np.concatenate([np.full_like(edge, y_min), y_min + edge * (y_max - y_min),
+                         np.full_like(edge, y_max), y_max - edge * (y_max - y_min)])
+    lons, lats = to_geographic.transform(xs, ys)
+    lon_min, lon_max = np.nanmin(lons), np.nanmax(lons)
+    lat_min, lat_max = np.nanmax([np.nanmin(lats), -89.0]), np.nanmin([np.nanmax(lats), 89.0])
+
+    lon_step = _nice_step(lon_max - lon_min)
+    lat_step = _nice_step(lat_max - lat_min)
+    lon_values = np.arange(np.ceil(lon_min / lon_step) * lon_step, lon_max + 1e-9, lon_step)
+    lat_values = np.arange(np.ceil(lat_min / lat_step) * lat_step, lat_max + 1e-9, lat_step)
+
+    # 经线：固定经度、纬度从南到北采样；纬线：固定纬度、经度从西到东采样
+    samples = np.linspace(0.0, 1.0, GRATICULE_SAMPLES)
+    meridian_lon = np.repeat(lon_values[:, None], GRATICULE_SAMPLES, axis=1)
+    meridian_lat = np.broadcast_to(lat_min + samples * (lat_max - lat_min), meridian_lon.shape)
+    parallel_lat = np.repeat(lat_values[:, None], GRATICULE_SAMPLES, axis=1)
+    parallel_lon = np.broadcast_to(lon_min + samples * (lon_max - lon_min), parallel_lat.shape)
+
+    all_lon = np.concatenate([meridian_lon.ravel(), parallel_lon.ravel()])
+    all_lat = np.concatenate([meridian_lat.ravel(), parallel_lat.ravel()])
+    px, py = to_projected.transform(all_lon, all_lat)
+    points = np.stack([px, py], axis=-1)
+
+    n_meridian_points = meridian_lon.size
+    meridians = points[:n_meridian_points].reshape(len(lon_values), GRATICULE_SAMPLES, 2)
+    parallels = points[n_meridian_points:].reshape(len(lat_values), GRATICULE_SAMPLES, 2)
+
+    # 刻度位置取经纬线与视图边界的交点
+    x_ticks = _edge_crossings(meridians, 1, y_min) if len(meridians) else np.array([])
+    y_ticks = _edge_crossings(parallels, 0, x_min) if len(parallels) else np.array([])
+    x_mask = np.isfinite(x_ticks)
+    y_mask = np.isfinite(y_ticks)
+
+    return {
+        'segments': np.concatenate([meridians, parallels]),
+        'x_ticks': x_ticks[x_mask],
+        'x_labels': [_format_degree(v, 'E', 'W') for v in lon_values[x_mask]],
+        'y_ticks': y_ticks[y_mask],
+        'y_labels': [_format_degree(v, 'N', 'S') for v in lat_values[y_mask]],
+    }
+
+
+def draw_graticule(ax, crs, font_size, extent=None):
+    """
+    在地图上绘制经纬网，并在下边界和左边界标注经纬度
+
+    所有经纬线作为一个LineCollection绘制，不改变当前的视图范围。
+
+    参数:
+        ax: matplotlib Axes
+        crs: 地图使用的坐标系
+        font_size (int): 经纬度标签字体大小
+        extent (tuple, optional): 视图范围，默认使用ax当前范围
+    """
+    if extent is None:
+        x_min, x_max = ax.get_xlim()
+        y_min, y_max = ax.get_ylim()
+        extent = (x_min, x_max, y_min, y_max)
+
+    # 范围取整后作为缓存键，避免浮点误差导致缓存失效
+    extent = tuple(round(float(v), 3) for v in extent)
+    graticule = build_graticule(CRS.from_user_input(crs), extent)
+
+    lines = LineCollection(graticule['segments'], colors='gray', linewidths=0.6,
+                           linestyles='--', alpha=0.5, zorder=500)
+    ax.add_collection(lines, autolim=False)
+
+    ax.set_xticks(graticule['x_ticks'])
+    ax.set_xticklabels(graticule['x_labels'], fontsize=font_size)
+    ax.set_yticks(graticule['y_ticks'])
+    ax.set_yticklabels(graticule['y_labels'], fontsize=font_size)
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+
+    # 删除经纬度标签文本
+    ax.set_xlabel('')
+    ax.set_ylabel('')
+    return lines
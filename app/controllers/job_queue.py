@@ -0,0 +1,586 @@
+import base64
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import redis
+except ImportError:  # 只在使用Redis队列时需要
+    redis = None
+
+from app.controllers.admission import DeadlineExceeded, remaining_time
+from app.controllers.render_cache import TABLE_OPTIONS
+
+# 渲染队列：为空时在Web进程内直接渲染；设置后由 render_worker.py 启动的渲染进程从队列中取任务
+#   sqlite              使用默认路径的SQLite队列（同一台机器上的多个进程）
+#   sqlite:///路径      使用指定路径的SQLite队列
+#   redis://主机:端口/库  使用Redis队列（多台机器）
+RENDER_QUEUE = os.environ.get('RENDER_QUEUE', '')
+# SQLite队列的默认路径
+RENDER_QUEUE_PATH = os.path.join(tempfile.gettempdir(), 'china-map-generator-queue.sqlite3')
+# 渲染进程发送心跳的间隔（秒）
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', 5))
+# 超过该时间没有心跳的任务视为渲染进程已崩溃，重新放回队列（秒）
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', 30))
+# 每个任务最多尝试的次数（包括渲染进程崩溃后的重试）
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+# 完成或失败的任务结果保留时间（秒），期间相同参数的请求直接使用结果
+JOB_RESULT_TTL_SECONDS = float(os.environ.get('JOB_RESULT_TTL_SECONDS', 600))
+# 随任务一起提交的上传数据表的大小上限（字节），更大的表在Web进程内渲染
+RENDER_QUEUE_MAX_TABLE_BYTES = int(os.environ.get('RENDER_QUEUE_MAX_TABLE_BYTES', 32 * 1024 * 1024))
+# 等待结果时的轮询间隔（秒）
+_WAIT_POLL_INTERVAL = 0.1
+
+# 任务状态
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+# 失败类型：参数错误（400）、超过截止时间、其他错误
+ERROR_INVALID, ERROR_DEADLINE, ERROR_RENDER = 'invalid', 'deadline', 'error'
+
+
+class JobFailed(Exception):
+    """任务在渲染进程中失败"""
+
+    def __init__(self, message, error_type=ERROR_RENDER):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+def default_worker_id():
+    """渲染进程的标识（主机名:进程号）"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _encode_table(table):
+    """数据表转换为可以JSON序列化的形式（数值列保存原始字节，保证渲染进程得到完全相同的数值）"""
+    columns = []
+    for name, values in table.items():
+        column = {'name': str(name), 'dtype': str(values.dtype)}
+        if isinstance(values.dtype, np.dtype) and values.dtype.kind in 'iuf':
+            array = np.ascontiguousarray(values.to_numpy())
+            column['dtype'] = array.dtype.str
+            column['data'] = base64.b64encode(array.tobytes()).decode('ascii')
+        else:
+            column['values'] = values.astype(object).where(values.notna(), None).tolist()
+        columns.append(column)
+    return {'columns': columns}
+
+
+def _decode_table(encoded):
+    """由 _encode_table 的结果重建数据表"""
+    data = {}
+    for column in encoded['columns']:
+        if 'data' in column:
+            data[column['name']] = np.frombuffer(base64.b64decode(column['data']), dtype=np.dtype(column['dtype']))
+        else:
+            try:
+                data[column['name']] = pd.Series(column['values'], dtype=column['dtype'])
+            except (TypeError, ValueError):
+                data[column['name']] = pd.Series(column['values'], dtype=object)
+    return pd.DataFrame(data)
+
+
+def encode_map_kwargs(map_kwargs):
+    """
+    把地图参数转换为可以提交到队列的形式
+
+    上传的数据表（分级统计数据、点数据文件）随任务一起提交；超过 RENDER_QUEUE_MAX_TABLE_BYTES 时返回None，
+    由调用方在Web进程内渲染
+
+    返回:
+        dict 或 None
+    """
+    encoded = dict(map_kwargs)
+    for name in TABLE_OPTIONS:
+        options = map_kwargs.get(name)
+        if not isinstance(options, dict) or not isinstance(options.get('table'), pd.DataFrame):
+            continue
+        table = options['table']
+        if table.memory_usage(index=False, deep=True).sum() > RENDER_QUEUE_MAX_TABLE_BYTES:
+            return None
+        encoded[name] = dict(options, table=_encode_table(table))
+    return encoded
+
+
+def decode_map_kwargs(map_kwargs):
+    """还原 encode_map_kwargs 转换的地图参数（在渲染进程中调用）"""
+    decoded = dict(map_kwargs)
+    for name in TABLE_OPTIONS:
+        options = map_kwargs.get(name)
+        if isinstance(options, dict) and isinstance(options.get('table'), dict):
+            decoded[name] = dict(options, table=_decode_table(options['table']))
+    return decoded
+
+
+# 设置了渲染队列但在本进程内渲染的任务数（数据表过大）
+_inline_renders = 0
+_inline_lock = threading.Lock()
+
+
+def record_inline_render():
+    """记录一次没有经过队列、在Web进程内完成的渲染"""
+    global _inline_renders
+    with _inline_lock:
+        _inline_renders += 1
+
+
+def inline_render_count():
+    """本进程中没有经过队列的渲染次数"""
+    return _inline_renders
+
+
+class SQLiteJobQueue:
+    """
+    基于SQLite的任务队列和结果存储
+
+    任务以请求参数的散列为id，相同参数的请求共享同一个任务。渲染进程在事务中领取最早的待处理任务，
+    渲染期间定期更新心跳；心跳超时的任务重新放回队列，超过最多尝试次数后标记为失败。
+    结果（图片数据）保存在同一张表中，保留 JOB_RESULT_TTL_SECONDS 秒。
+    适用于同一台机器（或可靠的共享文件系统）上的多个进程。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            worker TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created REAL NOT NULL,
+            updated REAL NOT NULL,
+            heartbeat REAL,
+            deadline REAL,
+            result BLOB,
+            filename TEXT,
+            error TEXT,
+            error_type TEXT)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created)')
+
+    def _connect(self):
+        """每个线程使用独立的SQLite连接（手动管理事务）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def describe(self):
+        return f"sqlite:///{self.path}"
+
+    def submit(self, job_id, payload, deadline=None, fresh=False):
+        """
+        提交任务；相同id的任务正在等待或渲染时不重复提交
+
+        参数:
+            job_id (str): 任务id（请求参数的散列）
+            payload (dict): 任务参数（可以序列化为JSON）
+            deadline (float, optional): 截止时间（Unix时间），超过后渲染进程不再处理
+            fresh (bool): 已有完成的结果时也重新渲染
+
+        返回:
+            bool: 是否新加入队列
+        """
+        now = time.time()
+        data = json.dumps(payload, ensure_ascii=False)
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row and (row[0] in (PENDING, RUNNING) or (row[0] == DONE and not fresh)):
+                if row[0] in (PENDING, RUNNING):
+                    # 截止时间取各个等待请求中最晚的一个（NULL表示不限制）
+                    conn.execute('''UPDATE jobs SET deadline = CASE WHEN deadline IS NULL OR ? IS NULL THEN NULL
+                                    ELSE MAX(deadline, ?) END WHERE id = ?''', (deadline, deadline, job_id))
+                conn.execute('COMMIT')
+                return False
+            conn.execute('''INSERT OR REPLACE INTO jobs (id, payload, status, attempts, created, updated, deadline)
+                            VALUES (?, ?, ?, 0, ?, ?, ?)''', (job_id, data, PENDING, now, now, deadline))
+            conn.execute('COMMIT')
+            return True
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def claim(self, worker_id, timeout=1.0):
+        """
+        领取最早的待处理任务
+
+        返回:
+            tuple 或 None: (任务id, 任务参数, 截止时间)；timeout秒内没有任务时返回None
+        """
+        give_up = time.monotonic() + timeout
+        conn = self._connect()
+        while True:
+            now = time.time()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT id, payload, deadline FROM jobs WHERE status = ? ORDER BY created LIMIT 1',
+                                   (PENDING,)).fetchone()
+                if row:
+                    conn.execute('''UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1,
+                                    heartbeat = ?, updated = ? WHERE id = ?''', (RUNNING, worker_id, now, now, row[0]))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            if row:
+                return row[0], json.loads(row[1]), row[2]
+            if time.monotonic() >= give_up:
+                return None
+            time.sleep(min(_WAIT_POLL_INTERVAL * 2, max(0, give_up - time.monotonic())))
+
+    def heartbeat(self, job_id, worker_id):
+        """更新心跳；任务已被重新分配时返回False"""
+        cursor = self._connect().execute('UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND status = ?',
+                                         (time.time(), job_id, worker_id, RUNNING))
+        return cursor.rowcount > 0
+
+    def complete(self, job_id, worker_id, data, filename):
+        """保存渲染结果（任务已被其他进程完成时忽略）"""
+        now = time.time()
+        self._connect().execute('''UPDATE jobs SET status = ?, worker = ?, result = ?, filename = ?,
+                                   error = NULL, error_type = NULL, updated = ? WHERE id = ? AND status != ?''',
+                                (DONE, worker_id, data, filename, now, job_id, DONE))
+
+    def fail(self, job_id, worker_id, error, error_type=ERROR_RENDER):
+        """记录任务失败"""
+        self._connect().execute('''UPDATE jobs SET status = ?, worker = ?, error = ?, error_type = ?, updated = ?
+                                   WHERE id = ? AND status != ?''',
+                                (FAILED, worker_id, error, error_type, time.time(), job_id, DONE))
+
+    def result(self, job_id):
+        """
+        查询任务结果
+
+        返回:
+            tuple 或 None: 完成时返回 (图片数据, 文件名)；未完成时返回None
+
+        抛出:
+            JobFailed: 任务失败或已不存在
+        """
+        row = self._connect().execute('SELECT status, result, filename, error, error_type FROM jobs WHERE id = ?',
+                                      (job_id,)).fetchone()
+        if row is None:
+            raise JobFailed('渲染任务已被清理')
+        status, data, filename, error, error_type = row
+        if status == DONE:
+            return bytes(data), filename
+        if status == FAILED:
+            raise JobFailed(error or '渲染失败', error_type or ERROR_RENDER)
+        return None
+
+    def requeue_stale(self):
+        """
+        把心跳超时的任务放回队列（超过最多尝试次数时标记为失败），并清理过期的结果
+
+        返回:
+            int: 重新放回队列的任务数
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('''UPDATE jobs SET status = ?, error = ?, error_type = ?, updated = ?
+                            WHERE status = ? AND heartbeat < ? AND attempts >= ?''',
+                         (FAILED, '渲染进程多次中断，任务失败', ERROR_RENDER, now,
+                          RUNNING, now - JOB_STALE_SECONDS, JOB_MAX_ATTEMPTS))
+            requeued = conn.execute('''UPDATE jobs SET status = ?, worker = NULL, updated = ?
+                                       WHERE status = ? AND heartbeat < ?''',
+                                    (PENDING, now, RUNNING, now - JOB_STALE_SECONDS)).rowcount
+            conn.execute('DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?',
+                         (DONE, FAILED, now - JOB_RESULT_TTL_SECONDS))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if requeued:
+            print(f"{requeued} 个渲染任务的心跳超时，已重新放回队列")
+        return requeued
+
+    def stats(self):
+        """各状态的任务数和活跃的渲染进程数"""
+        conn = self._connect()
+        counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        workers = conn.execute('SELECT COUNT(DISTINCT worker) FROM jobs WHERE status = ? AND heartbeat >= ?',
+                               (RUNNING, time.time() - JOB_STALE_SECONDS)).fetchone()[0]
+        return {
+            'backend': 'sqlite',
+            'pending': counts.get(PENDING, 0),
+            'running': counts.get(RUNNING, 0),
+            'done': counts.get(DONE, 0),
+            'failed': counts.get(FAILED, 0),
+            'busyWorkers': workers,
+        }
+
+
+class RedisJobQueue:
+    """
+    基于Redis的任务队列和结果存储，适用于多台机器
+
+    键结构（前缀为 mapjobs:）:
+        job:{id}   任务的哈希表（状态、参数、心跳、结果等），完成或失败后设置过期时间
+        pending    待处理任务id的列表（LPUSH提交，BRPOP领取）
+        running    正在渲染的任务id的有序集合，分数为最近一次心跳时间
+    """
+
+    PREFIX = 'mapjobs:'
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError('使用Redis队列需要安装redis（pip install redis）')
+        self.url = url
+        self.client = redis.Redis.from_url(url)
+        self.pending_key = self.PREFIX + 'pending'
+        self.running_key = self.PREFIX + 'running'
+
+    def _job_key(self, job_id):
+        return f"{self.PREFIX}job:{job_id}"
+
+    def describe(self):
+        return self.url
+
+    def submit(self, job_id, payload, deadline=None, fresh=False):
+        """提交任务，参数和返回值与 SQLiteJobQueue.submit 相同"""
+        key = self._job_key(job_id)
+        now = time.time()
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    status = pipe.hget(key, 'status')
+                    status = status.decode() if status else None
+                    if status in (PENDING, RUNNING) or (status == DONE and not fresh):
+                        if status in (PENDING, RUNNING):
+                            current = float(pipe.hget(key, 'deadline') or 0)
+                            pipe.multi()
+                            pipe.hset(key, 'deadline', max(current, deadline or float('inf')))
+                            pipe.execute()
+                        else:
+                            pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.delete(key)
+                    pipe.hset(key, mapping={
+                        'payload': json.dumps(payload, ensure_ascii=False), 'status': PENDING,
+                        'attempts': 0, 'created': now, 'updated': now, 'deadline': deadline or float('inf'),
+                    })
+                    pipe.lpush(self.pending_key, job_id)
+                    pipe.execute()
+                    return True
+                except redis.WatchError:
+                    continue
+
+    def claim(self, worker_id, timeout=1.0):
+        """领取最早的待处理任务，参数和返回值与 SQLiteJobQueue.claim 相同"""
+        give_up = time.monotonic() + timeout
+        while True:
+            wait = max(1, int(give_up - time.monotonic()))
+            item = self.client.brpop(self.pending_key, timeout=wait)
+            if item is None:
+                return None
+            job_id = item[1].decode()
+            key = self._job_key(job_id)
+            now = time.time()
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    # 列表中可能有已被完成或重复放回的任务
+                    if (pipe.hget(key, 'status') or b'').decode() != PENDING:
+                        pipe.unwatch()
+                        continue
+                    payload, deadline = pipe.hmget(key, 'payload', 'deadline')
+                    pipe.multi()
+                    pipe.hset(key, mapping={'status': RUNNING, 'worker': worker_id, 'heartbeat': now, 'updated': now})
+                    pipe.hincrby(key, 'attempts', 1)
+                    pipe.zadd(self.running_key, {job_id: now})
+                    pipe.execute()
+                except redis.WatchError:
+                    continue
+            deadline = float(deadline) if deadline else None
+            return job_id, json.loads(payload), deadline if deadline != float('inf') else None
+
+    def heartbeat(self, job_id, worker_id):
+        """更新心跳；任务已被重新分配时返回False"""
+        key = self._job_key(job_id)
+        status, worker = self.client.hmget(key, 'status', 'worker')
+        if status != RUNNING.encode() or worker != worker_id.encode():
+            return False
+        now = time.time()
+        with self.client.pipeline() as pipe:
+            pipe.hset(key, 'heartbeat', now)
+            pipe.zadd(self.running_key, {job_id: now})
+            pipe.execute()
+        return True
+
+    def _finish(self, job_id, mapping):
+        key = self._job_key(job_id)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if (pipe.hget(key, 'status') or b'').decode() == DONE:
+                    pipe.unwatch()
+                    return
+                pipe.multi()
+                pipe.hset(key, mapping=dict(mapping, updated=time.time()))
+                pipe.hdel(key, 'payload')
+                pipe.expire(key, int(JOB_RESULT_TTL_SECONDS))
+                pipe.zrem(self.running_key, job_id)
+                pipe.execute()
+            except redis.WatchError:
+                pass
+
+    def complete(self, job_id, worker_id, data, filename):
+        """保存渲染结果（任务已被其他进程完成时忽略）"""
+        self._finish(job_id, {'status': DONE, 'worker': worker_id, 'result': data, 'filename': filename})
+
+    def fail(self, job_id, worker_id, error, error_type=ERROR_RENDER):
+        """记录任务失败"""
+        self._finish(job_id, {'status': FAILED, 'worker': worker_id, 'error': error, 'error_type': error_type})
+
+    def result(self, job_id):
+        """查询任务结果，返回值与 SQLiteJobQueue.result 相同"""
+        status, data, filename, error, error_type = self.client.hmget(
+            self._job_key(job_id), 'status', 'result', 'filename', 'error', 'error_type')
+        if status is None:
+            raise JobFailed('渲染任务已被清理')
+        status = status.decode()
+        if status == DONE:
+            return data, filename.decode()
+        if status == FAILED:
+            raise JobFailed(error.decode() if error else '渲染失败',
+                            error_type.decode() if error_type else ERROR_RENDER)
+        return None
+
+    def requeue_stale(self):
+        """把心跳超时的任务放回队列（超过最多尝试次数时标记为失败）；结果由Redis按过期时间清理"""
+        now = time.time()
+        requeued = 0
+        for raw_id in self.client.zrangebyscore(self.running_key, '-inf', now - JOB_STALE_SECONDS):
+            job_id = raw_id.decode()
+            key = self._job_key(job_id)
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    status, heartbeat, attempts = pipe.hmget(key, 'status', 'heartbeat', 'attempts')
+                    if status != RUNNING.encode() or float(heartbeat or 0) >= now - JOB_STALE_SECONDS:
+                        pipe.unwatch()
+                        if status != RUNNING.encode():
+                            self.client.zrem(self.running_key, job_id)
+                        continue
+                    pipe.multi()
+                    if int(attempts or 0) >= JOB_MAX_ATTEMPTS:
+                        pipe.hset(key, mapping={'status': FAILED, 'error': '渲染进程多次中断，任务失败',
+                                                'error_type': ERROR_RENDER, 'updated': now})
+                        pipe.expire(key, int(JOB_RESULT_TTL_SECONDS))
+                    else:
+                        pipe.hset(key, mapping={'status': PENDING, 'worker': '', 'updated': now})
+                        pipe.rpush(self.pending_key, job_id)  # 放在队首，优先处理
+                        requeued += 1
+                    pipe.zrem(self.running_key, job_id)
+                    pipe.execute()
+                except redis.WatchError:
+                    continue
+        if requeued:
+            print(f"{requeued} 个渲染任务的心跳超时，已重新放回队列")
+        return requeued
+
+    def stats(self):
+        """待处理和正在渲染的任务数"""
+        return {
+            'backend': 'redis',
+            'pending': self.client.llen(self.pending_key),
+            'running': self.client.zcard(self.running_key),
+            'busyWorkers': self.client.zcount(self.running_key, time.time() - JOB_STALE_SECONDS, '+inf'),
+        }
+
+
+def open_job_queue(url):
+    """
+    按地址创建任务队列
+
+    参数:
+        url (str): 'sqlite'、'sqlite:///路径' 或 'redis://...'
+
+    返回:
+        SQLiteJobQueue 或 RedisJobQueue
+    """
+    if url == 'sqlite':
+        return SQLiteJobQueue(RENDER_QUEUE_PATH)
+    if url.startswith('sqlite:///'):
+        return SQLiteJobQueue(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisJobQueue(url)
+    raise ValueError(f"不支持的渲染队列地址: {url}")
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_render_queue():
+    """获取进程内共享的渲染队列；没有设置 RENDER_QUEUE 时返回None（在Web进程内渲染）"""
+    global _queue
+    if not RENDER_QUEUE:
+        return None
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = open_job_queue(RENDER_QUEUE)
+                print(f"地图渲染使用任务队列: {_queue.describe()}")
+    return _queue
+
+
+def render_via_queue(queue, job_id, payload, fresh=False):
+    """
+    把渲染任务提交到队列并等待结果（在Web进程中调用）
+
+    等待超过当前请求的截止时间时抛出DeadlineExceeded；任务失败时按失败类型抛出
+    ValueError（参数错误）、DeadlineExceeded 或 RuntimeError。
+
+    参数:
+        queue: 渲染队列
+        job_id (str): 任务id（请求参数的散列）
+        payload (dict): 任务参数
+        fresh (bool): 不使用队列中已完成的结果
+
+    返回:
+        tuple: (图片数据, 文件名)
+    """
+    remaining = remaining_time()
+    deadline = time.time() + remaining if remaining is not None else None
+    if queue.submit(job_id, payload, deadline=deadline, fresh=fresh):
+        print(f"渲染任务已加入队列: {job_id[:12]}")
+
+    last_check = time.monotonic()
+    while True:
+        try:
+            result = queue.result(job_id)
+        except JobFailed as e:
+            if e.error_type == ERROR_INVALID:
+                raise ValueError(str(e))
+            if e.error_type == ERROR_DEADLINE:
+                raise DeadlineExceeded(str(e))
+            raise RuntimeError(f"渲染失败: {e}")
+        if result is not None:
+            return result
+
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded("请求超时，等待渲染进程的结果时停止")
+        # 所有渲染进程都崩溃时，由等待中的Web进程负责把任务放回队列
+        if time.monotonic() - last_check >= JOB_STALE_SECONDS:
+            queue.requeue_stale()
+            last_check = time.monotonic()
+        time.sleep(_WAIT_POLL_INTERVAL)
@@ -0,0 +1,92 @@
+import os
+
+# 输出图片的默认尺寸（像素），即原来的16×9英寸、300 DPI
+DEFAULT_OUTPUT_WIDTH = 4800
+DEFAULT_OUTPUT_HEIGHT = 2700
+# 单张图片的像素数上限
+MAX_OUTPUT_PIXELS = int(os.environ.get('MAX_OUTPUT_PIXELS', 40_000_000))
+# 单边像素范围
+MIN_OUTPUT_SIDE = 100
+MAX_OUTPUT_SIDE = 12000
+
+# 图形的逻辑宽度（英寸）：字号和线宽以磅为单位，按输出宽度换算DPI，
+# 因此同一比例的图片无论输出多大，版式都相同，只是整体缩放
+FIGURE_WIDTH_INCHES = 16
+
+# 版式中的固定尺寸（磅，1英寸 = 72磅）
+_PAGE_PAD = 18          # 图片四周的留白
+_TITLE_PAD = 6          # 标题与地图之间的距离（与matplotlib的默认值相同）
+_TICK_PAD = 7           # 刻度线长度 + 刻度标签与刻度线的距离
+_LINE_HEIGHT = 1.25     # 文字行高（字号的倍数）
+_DEGREE_LABEL_WIDTH = 3.6  # 纬度标签（如"40°N"）的宽度（字号的倍数）
+
+
+def resolve_output_size(width=None, height=None, max_side=MAX_OUTPUT_SIDE, max_pixels=MAX_OUTPUT_PIXELS):
+    """
+    检查并补全输出尺寸：只指定一边时按16:9补全另一边
+
+    参数:
+        width (int, optional): 宽度（像素）
+        height (int, optional): 高度（像素）
+        max_side (int): 单边像素上限（大幅面输出使用更大的上限）
+        max_pixels (int): 像素数上限
+
+    返回:
+        tuple: (宽度, 高度)
+    """
+    if not width and not height:
+        return DEFAULT_OUTPUT_WIDTH, DEFAULT_OUTPUT_HEIGHT
+    if not height:
+        height = round(int(width) * DEFAULT_OUTPUT_HEIGHT / DEFAULT_OUTPUT_WIDTH)
+    if not width:
+        width = round(int(height) * DEFAULT_OUTPUT_WIDTH / DEFAULT_OUTPUT_HEIGHT)
+    width, height = int(width), int(height)
+
+    for side in (width, height):
+        if not MIN_OUTPUT_SIDE <= side <= max_side:
+            raise ValueError(f"图片宽度和高度必须在{MIN_OUTPUT_SIDE}到{max_side}像素之间")
+    if width * height > max_pixels:
+        raise ValueError(f"图片尺寸过大（{width}×{height}），像素数不能超过{max_pixels}")
+    return width, height
+
+
+def figure_geometry(width, height):
+    """
+    输出尺寸对应的图形大小和分辨率
+
+    返回:
+        tuple: (figsize（英寸）, dpi)，figsize × dpi 恰好等于输出像素
+    """
+    dpi = width / FIGURE_WIDTH_INCHES
+    return (FIGURE_WIDTH_INCHES, height / dpi), dpi
+
+
+def compute_axes_rect(figsize, title_font_size=None, coordinates_font_size=None):
+    """
+    预先计算地图区域在图形中的位置，替代 tight_layout 和 bbox_inches='tight'
+
+    标题在上方、经纬度标签在下方和左侧，所需空间按字号直接计算，不需要先绘制一次再测量。
+    地图区域之后按等比例（aspect='equal'）在该范围内居中缩小。
+
+    参数:
+        figsize (tuple): 图形大小（英寸）
+        title_font_size (float, optional): 标题字号，不显示标题时为None
+        coordinates_font_size (float, optional): 经纬度标签字号，不显示经纬度时为None
+
+    返回:
+        list: [left, bottom, width, height]，以图形大小为单位
+    """
+    fig_width, fig_height = (size * 72 for size in figsize)
+    left = right = top = bottom = _PAGE_PAD
+
+    if title_font_size:
+        top += title_font_size * _LINE_HEIGHT + _TITLE_PAD
+    if coordinates_font_size:
+        bottom += coordinates_font_size * _LINE_HEIGHT + _TICK_PAD
+        left += coordinates_font_size * _DEGREE_LABEL_WIDTH + _TICK_PAD
+        # 最右侧的经度标签以刻度为中心，会超出地图边缘约半个标签宽度
+        right += coordinates_font_size * _DEGREE_LABEL_WIDTH / 2
+
+    width = max(fig_width - left - right, fig_width * 0.1)
+    height = max(fig_height - top - bottom, fig_height * 0.1)
+    return [left / fig_width, bottom / fig_height, width / fig_width, height / fig_height]
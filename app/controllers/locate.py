@@ -0,0 +1,258 @@
+import io
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import shapely
+
+try:
+    import pyarrow as pa
+except ImportError:  # 只在输出Arrow格式时需要
+    pa = None
+
+from app.controllers.boundary_store import get_projected_data, get_source_version
+from app.controllers.points import locate_points
+
+# 查询的级别（从粗到细），以及输出的名称、代码字段: 级别 -> (输出键, 名称字段, 代码字段)
+LOCATE_LEVELS = ('省', '市', '县')
+LOCATE_FIELDS = {
+    '省': ('province', '省', '省代码'),
+    '市': ('city', '市', '市代码'),
+    '县': ('county', 'NAME', 'PAC'),
+}
+LEVEL_ALIASES = {'省': '省', '市': '市', '县': '县', 'province': '省', 'city': '市', 'county': '县'}
+# 输出格式
+LOCATE_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+# 每批查询的点数（结果按批输出，内存与批大小成正比）
+LOCATE_BATCH_SIZE = int(os.environ.get('LOCATE_BATCH_SIZE', 500_000))
+# 单个请求的点数上限
+MAX_LOCATE_POINTS = int(os.environ.get('MAX_LOCATE_POINTS', 20_000_000))
+
+# 各级别常驻的查询数据 {级别: (数据版本, RegionLocator)}
+_locators = {}
+_locators_lock = threading.Lock()
+
+
+def normalize_levels(levels=None):
+    """
+    检查并规范化查询级别（支持中文和 province/city/county）
+
+    返回:
+        tuple: 按从粗到细排序的级别
+    """
+    if not levels:
+        return LOCATE_LEVELS
+    if isinstance(levels, str):
+        levels = [part for part in levels.split(',') if part.strip()]
+    resolved = set()
+    for level in levels:
+        level = LEVEL_ALIASES.get(str(level).strip())
+        if level is None:
+            raise ValueError(f"不支持的级别，可选: {', '.join(LEVEL_ALIASES)}")
+        resolved.add(level)
+    return tuple(level for level in LOCATE_LEVELS if level in resolved)
+
+
+def output_columns(levels):
+    """结果中的区域字段（不包括序号和坐标）"""
+    columns = []
+    for level in levels:
+        key = LOCATE_FIELDS[level][0]
+        columns.extend([key, f"{key}Code"])
+    return columns
+
+
+class RegionLocator:
+    """
+    某一级别常驻内存的点落区查询数据：经纬度坐标下预处理的区域几何、区域范围和属性表
+    """
+
+    def __init__(self, map_type):
+        dataset = get_projected_data(map_type, 'geographic')
+        self.map_type = map_type
+        self.attributes = dataset.attributes
+        self.geometries = dataset.geometry.to_shapely(np.arange(len(dataset)))
+        shapely.prepare(self.geometries)
+        self.bounds = shapely.bounds(self.geometries)
+
+    def locate(self, lon, lat):
+        """每个点所在区域在属性表中的位置（不在任何区域中为-1）"""
+        return locate_points(self.geometries, lon, lat, self.bounds)
+
+
+def get_locator(map_type):
+    """获取某一级别的查询数据（首次使用时建立，源文件更新后重新建立）"""
+    version = get_source_version(map_type)
+    with _locators_lock:
+        cached = _locators.get(map_type)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    locator = RegionLocator(map_type)
+    print(f"已建立{map_type}级点落区查询数据: {len(locator.attributes)}个区域")
+    with _locators_lock:
+        _locators[map_type] = (version, locator)
+    return locator
+
+
+def locate_coordinates(lon, lat, levels=None):
+    """
+    批量查询经纬度所在的省、市、县（Python接口）
+
+    先在最细的级别查询，同时从该级别的属性表中取出上级区域的名称和代码（县级数据包含所属的省、市），
+    只有在较细级别中没有找到的点才在较粗的级别中查询，因此通常每个点只需判断一次。
+
+    参数:
+        lon, lat: 经度、纬度数组（WGS84）
+        levels (list, optional): 查询的级别，默认为省、市、县
+
+    返回:
+        DataFrame: 与输入顺序一致，每个级别有名称列和代码列（如 province、provinceCode），找不到时为None
+    """
+    levels = normalize_levels(levels)
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    if lon.shape != lat.shape or lon.ndim != 1:
+        raise ValueError("经度和纬度必须是长度相同的一维数组")
+
+    result = {column: np.full(len(lon), None, dtype=object) for column in output_columns(levels)}
+    resolved = {level: np.zeros(len(lon), dtype=bool) for level in levels}
+    valid = np.isfinite(lon) & np.isfinite(lat)
+
+    for level in reversed(levels):
+        pending = np.flatnonzero(valid & ~resolved[level])
+        if not len(pending):
+            continue
+        locator = get_locator(level)
+        positions = locator.locate(lon[pending], lat[pending])
+        found = positions >= 0
+        rows, positions = pending[found], positions[found]
+        # 同时填写该级别属性表中包含的上级区域
+        for target in levels[:levels.index(level) + 1]:
+            key, name_field, code_field = LOCATE_FIELDS[target]
+            if name_field not in locator.attributes.columns:
+                continue
+            fill = ~resolved[target][rows]
+            result[key][rows[fill]] = locator.attributes[name_field].to_numpy(dtype=object)[positions[fill]]
+            if code_field in locator.attributes.columns:
+                codes = locator.attributes[code_field].to_numpy(dtype=object)[positions[fill]]
+                result[f"{key}Code"][rows[fill]] = codes
+            resolved[target][rows[fill]] = True
+
+    return pd.DataFrame(result)
+
+
+def iter_locate_batches(chunks, levels=None, max_points=MAX_LOCATE_POINTS):
+    """
+    按批查询，结果逐批返回（输入可以是按批读取的上传文件）
+
+    参数:
+        chunks: 每项为 (经度数组, 纬度数组, ...) 的序列
+        levels (list, optional): 查询的级别
+        max_points (int): 点数上限
+
+    返回:
+        generator: 每批一个DataFrame，包含 index（输入中的序号）和区域字段
+    """
+    levels = normalize_levels(levels)
+    offset = 0
+    for chunk in chunks:
+        lon, lat = np.asarray(chunk[0], dtype=np.float64), np.asarray(chunk[1], dtype=np.float64)
+        for start in range(0, len(lon), LOCATE_BATCH_SIZE):
+            batch_lon, batch_lat = lon[start:start + LOCATE_BATCH_SIZE], lat[start:start + LOCATE_BATCH_SIZE]
+            if offset + len(batch_lon) > max_points:
+                raise ValueError(f"单次查询的点数不能超过{max_points}")
+            located = locate_coordinates(batch_lon, batch_lat, levels)
+            located.insert(0, 'index', np.arange(offset, offset + len(batch_lon)))
+            offset += len(batch_lon)
+            yield located
+
+
+def coordinate_chunks(data):
+    """
+    把JSON请求中的坐标转换为查询输入
+
+    参数:
+        data (dict): {'coordinates': [[经度, 纬度], ...]} 或 {'lon': [...], 'lat': [...]}
+
+    返回:
+        list: [(经度数组, 纬度数组)]
+    """
+    if data.get('coordinates') is not None:
+        try:
+            coordinates = np.asarray(data['coordinates'], dtype=np.float64)
+        except (TypeError, ValueError):
+            coordinates = None
+        if coordinates is None or coordinates.ndim != 2 or coordinates.shape[1] != 2:
+            if coordinates is not None and coordinates.size == 0:
+                return []
+            raise ValueError("coordinates 必须是 [[经度, 纬度], ...]")
+        return [(coordinates[:, 0], coordinates[:, 1])]
+    if data.get('lon') is not None and data.get('lat') is not None:
+        try:
+            lon = np.asarray(data['lon'], dtype=np.float64)
+            lat = np.asarray(data['lat'], dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError("lon 和 lat 必须是数值数组")
+        if lon.shape != lat.shape or lon.ndim != 1:
+            raise ValueError("lon 和 lat 必须是长度相同的一维数组")
+        return [(lon, lat)]
+    raise ValueError("请提供 coordinates，或 lon 和 lat 数组，或上传CSV/Parquet文件")
+
+
+def encode_ndjson(batches):
+    """
+    按批编码为NDJSON（每行一个点）
+
+    同一批中的大量点落在少数区域中，每种区域组合的JSON片段只序列化一次，
+    每行只需拼接序号，比逐行序列化DataFrame快得多
+    """
+    for batch in batches:
+        if not len(batch):
+            continue
+        regions = batch.iloc[:, 1:]
+        groups = regions.groupby(list(regions.columns), dropna=False, sort=False).ngroup().to_numpy()
+        first_rows = regions.iloc[np.unique(groups, return_index=True)[1]].astype(object)
+        fragments = [
+            json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str)[1:]
+            for record in first_rows.where(first_rows.notna(), None).to_dict('records')
+        ]
+        lines = [f'{{"index":{index},{fragments[group]}'
+                 for index, group in zip(batch['index'].tolist(), groups.tolist())]
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def arrow_schema(levels):
+    """Arrow输出的表结构：index为int64，名称和代码列都是字符串（各批一致，与第一批的数据无关）"""
+    return pa.schema([('index', pa.int64())] + [(column, pa.string()) for column in output_columns(levels)])
+
+
+def encode_arrow(batches, levels):
+    """
+    按批编码为Arrow IPC流（每批一个RecordBatch）
+
+    表结构由查询级别预先确定：第一批的点都不在任何区域中（名称列全为空）时，之后的批次仍能写入；
+    没有任何点时输出只有表结构的空流
+    """
+    if pa is None:
+        raise ValueError("输出Arrow格式需要安装 pyarrow")
+    schema = arrow_schema(normalize_levels(levels))
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+    for batch in batches:
+        for column in batch.columns[1:]:
+            # 代码列可能是整数或字符串，统一为字符串
+            if column.endswith('Code'):
+                batch[column] = batch[column].map(lambda value: None if value is None else str(value))
+        writer.write_batch(pa.RecordBatch.from_pandas(batch, schema=schema, preserve_index=False))
+        # 第一次输出时包含表结构
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    writer.close()
+    yield sink.getvalue()
@@ -0,0 +1,37 @@
+import numpy as np
+from matplotlib.collections import PathCollection
+
+
+def build_region_collection(paths, facecolors, edgecolor, linewidth, zorder=1):
+    """
+    将一组区域绘制为单个PathCollection，每个区域对应一条路径
+
+    与GeoDataFrame.plot不同，MultiPolygon不会被拆分成多个图形，
+    因此facecolors与区域一一对应，之后可以直接用set_facecolor整体更新颜色。
+
+    参数:
+        paths: 每个区域的复合Path（空区域为None），见 RaggedGeometry.paths
+        facecolors: 填充颜色，单个颜色或与paths等长的颜色序列
+        edgecolor: 边界线颜色
+        linewidth (float): 边界线宽度
+        zorder (int): 绘制层级
+
+    返回:
+        tuple: (PathCollection, 有效区域的位置索引数组)
+    """
+    positions = np.asarray([i for i, path in enumerate(paths) if path is not None], dtype=int)
+
+    if isinstance(facecolors, (list, np.ndarray)) and len(facecolors) == len(paths):
+        facecolors = [facecolors[i] for i in positions]
+
+    collection = PathCollection([paths[i] for i in positions], facecolors=facecolors, edgecolors=edgecolor,
+                                linewidths=linewidth, zorder=zorder)
+    return collection, positions
+
+
+def add_region_collection(ax, collection):
+    """将区域集合加入坐标轴并更新数据范围"""
+    collection.set_transform(ax.transData)
+    ax.add_collection(collection, autolim=True)
+    ax.autoscale_view()
+    return collection
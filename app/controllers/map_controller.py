@@ -1,33 +1,57 @@
 import os
-import geopandas as gpd
+import io
+import base64
 # 首先设置matplotlib使用非交互式后端
 import matplotlib
-matplotlib.use('Agg')  # 在导入pyplot之前设置
-import matplotlib.pyplot as plt
-from matplotlib.colors import LinearSegmentedColormap
-import numpy as np
+matplotlib.use('Agg')  # 渲染只使用Figure和Agg画布，不经过pyplot
+import matplotlib.figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import pandas as pd
 from datetime import datetime
 import uuid
 import matplotlib.font_manager as fm
 from matplotlib import rcParams
 import platform
-from matplotlib.projections import get_projection_class
-from pyproj import CRS
-import pyproj
+import threading
+import time
+from PIL import Image
+from app.controllers.storage import get_map_storage, MAP_STORAGE_DIR
+from app.controllers.graticule import draw_graticule
+from app.controllers.boundary_store import (
+    SHP_FOLDER, DEFAULT_PROJECTION, get_region_attributes, get_projected_data,
+    get_projection_crs, get_scale_factor, get_data_version
+)
+from app.controllers.map_artists import build_region_collection, add_region_collection
+from app.controllers.choropleth import prepare_choropleth, color_values, draw_choropleth_legend
+from app.controllers.points import prepare_points, point_mode, aggregate_to_regions, draw_points
+from app.controllers.adjacency import get_adjacency, assign_colors
+from app.controllers.render_cache import lookup_render, render_cache_key, RENDER_CACHE_ENABLED
+from app.controllers.admission import check_deadline, estimate_render_cost, get_admission_controller
+from app.controllers.coalescing import get_single_flight, process_lock, read_handoff, write_handoff
+from app.controllers.telemetry import record_render
+from app.controllers.layout import resolve_output_size, figure_geometry, compute_axes_rect, MIN_OUTPUT_SIDE
+from app.controllers.outlines import (
+    OVERLAY_WIDTH_RATIOS, overlay_levels_for, build_outline_collection, get_simplified_geometry
+)
+from app.controllers.quality import quality_settings, get_quality_controller, report_quality
+from app.controllers.job_queue import get_render_queue, render_via_queue, encode_map_kwargs, record_inline_render
 
-# 定义shp文件路径
-SHP_FOLDER = 'shp'
-MAPS_OUTPUT_FOLDER = 'app/static/maps'
+# 保存的地图（不在静态文件目录中，只能通过 /maps/<文件名> 访问）
+MAPS_OUTPUT_FOLDER = MAP_STORAGE_DIR
 FONTS_FOLDER = 'app/static/fonts'
 
 # 确保输出目录存在
 os.makedirs(MAPS_OUTPUT_FOLDER, exist_ok=True)
 os.makedirs(FONTS_FOLDER, exist_ok=True)
 
-# 全局变量，用于缓存数据
+# 中文字体只查找一次（查找过程会修改matplotlib的全局字体设置，需要加锁）
+_chinese_font = None
+_chinese_font_loaded = False
+_font_lock = threading.Lock()
+
+# 全局变量，用于缓存数据 (数据版本, 区域列表)，边界数据更新后失效
 _province_data = None
 _city_data = None
-_county_data = None
 
 def get_region_data(region_type='province', parent_name=None):
     """
@@ -40,30 +64,32 @@ def get_region_data(region_type='province', parent_name=None):
     返回:
         list: 区域列表
     """
-    global _province_data, _city_data, _county_data
+    global _province_data, _city_data
+    version = get_data_version()
     
     # 根据不同区域类型读取对应数据
     if region_type == 'province':
         # 获取省级数据
-        if _province_data is None:
+        cached = _province_data
+        if cached is None or cached[0] != version:
             try:
                 province_path = os.path.join(SHP_FOLDER, '省.shp')
                 if not os.path.exists(province_path):
                     return {"error": "省级地图文件不存在"}
                 
                 # 读取省级地图
-                df = gpd.read_file(province_path, encoding='utf-8')
+                df = get_region_attributes('省')
                 if '省' in df.columns:
                     # 提取省份名称
                     provinces = sorted(df['省'].unique().tolist())
                     # 添加全国选项
-                    _province_data = [{'name': '全国', 'value': '全国'}] + [{'name': p, 'value': p} for p in provinces if p]
+                    cached = _province_data = (version, [{'name': '全国', 'value': '全国'}] + [{'name': p, 'value': p} for p in provinces if p])
                 else:
                     return {"error": "省级地图文件结构不正确"}
             except Exception as e:
                 return {"error": f"读取省级数据出错: {str(e)}"}
         
-        return _province_data
+        return cached[1]
     
     elif region_type == 'city':
         # 获取市级数据
@@ -74,7 +100,7 @@ def get_region_data(region_type='province', parent_name=None):
                     return {"error": "市级地图文件不存在"}
                 
                 # 读取市级地图
-                df = gpd.read_file(city_path, encoding='utf-8')
+                df = get_region_attributes('市')
                 if '市' in df.columns and '省' in df.columns:
                     # 按省份筛选
                     filtered_df = df[df['省'] == parent_name]
@@ -90,24 +116,25 @@ def get_region_data(region_type='province', parent_name=None):
                 return {"error": f"读取市级数据出错: {str(e)}"}
         else:
             # 如果没有提供省份，则返回所有市
-            if _city_data is None:
+            cached = _city_data
+            if cached is None or cached[0] != version:
                 try:
                     city_path = os.path.join(SHP_FOLDER, '市.shp')
                     if not os.path.exists(city_path):
                         return {"error": "市级地图文件不存在"}
                     
                     # 读取市级地图
-                    df = gpd.read_file(city_path, encoding='utf-8')
+                    df = get_region_attributes('市')
                     if '市' in df.columns:
                         # 提取城市名称
                         cities = sorted(df['市'].unique().tolist())
-                        _city_data = [{'name': c, 'value': c} for c in cities if c]
+                        cached = _city_data = (version, [{'name': c, 'value': c} for c in cities if c])
                     else:
                         return {"error": "市级地图文件结构不正确"}
                 except Exception as e:
                     return {"error": f"读取市级数据出错: {str(e)}"}
             
-            return _city_data
+            return cached[1]
     
     elif region_type == 'county':
         # 获取县级数据
@@ -118,7 +145,7 @@ def get_region_data(region_type='province', parent_name=None):
                     return {"error": "县级地图文件不存在"}
                 
                 # 读取县级地图
-                df = gpd.read_file(county_path, encoding='utf-8')
+                df = get_region_attributes('县')
                 if 'NAME' in df.columns and '市' in df.columns:
                     # 按城市筛选
                     filtered_df = df[df['市'] == parent_name]
@@ -279,6 +306,21 @@ def set_chinese_font():
     
     return None  # 没有找到字体时返回None
 
+def get_chinese_font():
+    """
+    获取中文字体属性（进程内只调用一次set_chinese_font，之后各线程共享只读的结果）
+    
+    返回:
+        FontProperties或None: 找到字体文件时返回字体属性，否则返回None（使用字体族后备方案）
+    """
+    global _chinese_font, _chinese_font_loaded
+    if not _chinese_font_loaded:
+        with _font_lock:
+            if not _chinese_font_loaded:
+                _chinese_font = set_chinese_font()
+                _chinese_font_loaded = True
+    return _chinese_font
+
 def hex_to_rgb(hex_color):
     """
     将十六进制颜色代码转换为RGB元组
@@ -296,19 +338,21 @@ def hex_to_rgb(hex_color):
     # 返回0-1范围的RGB值
     return tuple(c/255 for c in rgb)
 
-def find_region_in_gdf(gdf, region_name, map_type, region_name_for_msg=''):
+def find_region_in_gdf(dataset, gdf, region_name, map_type, region_name_for_msg=''):
     """
-    在GeoDataFrame中查找指定区域
+    在地图数据中查找指定区域
     
     参数:
-        gdf: GeoDataFrame数据
+        dataset: 当前地图的投影数据（ProjectedDataset）
+        gdf: 当前地图的属性表（已筛选）
         region_name: 要查找的区域名称
         map_type: 地图类型
         region_name_for_msg: 用于筛选的父区域名称
         
     返回:
-        GeoDataFrame或None: 找到的区域数据
+        tuple或None: (区域所属的投影数据, 找到的属性表行)，属性表的索引即区域在几何数组中的位置
     """
+    projection = dataset.projection
     if not region_name or not region_name.strip():
         return None
     
@@ -337,13 +381,13 @@ def find_region_in_gdf(gdf, region_name, map_type, region_name_for_msg=''):
                     exact_match = gdf[gdf[field] == search_term]
                     if not exact_match.empty:
                         print(f"找到精确匹配'{search_term}'的区域: {len(exact_match)}条")
-                        return exact_match
+                        return dataset, exact_match
                     
                     # 包含匹配
                     contains_match = gdf[gdf[field].str.contains(search_term, case=False, na=False)]
                     if not contains_match.empty:
                         print(f"找到包含'{search_term}'的区域: {len(contains_match)}条")
-                        return contains_match
+                        return dataset, contains_match
                 except Exception as e:
                     print(f"查找区域时出错: {str(e)}")
     
@@ -352,18 +396,17 @@ def find_region_in_gdf(gdf, region_name, map_type, region_name_for_msg=''):
         try:
             county_path = os.path.join(SHP_FOLDER, '县.shp')
             if os.path.exists(county_path):
-                county_gdf = gpd.read_file(county_path, encoding='utf-8')
+                county_data = get_projected_data('县', projection)
+                county_gdf = county_data.attributes
                 if 'NAME' in county_gdf.columns and '市' in county_gdf.columns and region_name_for_msg:
                     city_counties = county_gdf[county_gdf['市'] == region_name_for_msg]
                     if not city_counties.empty:
                         for search_term in search_variants:
                             county_match = city_counties[city_counties['NAME'] == search_term]
                             if not county_match.empty:
-                                # 确保坐标系一致
-                                if county_match.crs != gdf.crs:
-                                    county_match = county_match.to_crs(gdf.crs)
+                                # 各级数据使用同一投影，坐标系一致
                                 print(f"在县级地图中找到'{search_term}'")
-                                return county_match
+                                return county_data, county_match
         except Exception as e:
             print(f"在县级地图中查找时出错: {str(e)}")
     
@@ -373,7 +416,8 @@ def find_region_in_gdf(gdf, region_name, map_type, region_name_for_msg=''):
         try:
             city_path = os.path.join(SHP_FOLDER, '市.shp')
             if os.path.exists(city_path):
-                city_gdf = gpd.read_file(city_path, encoding='utf-8')
+                city_data = get_projected_data('市', projection)
+                city_gdf = city_data.attributes
                 if '市' in city_gdf.columns and '省' in city_gdf.columns:
                     # 只查找当前省份下的市
                     province_cities = city_gdf[city_gdf['省'] == region_name_for_msg]
@@ -381,50 +425,405 @@ def find_region_in_gdf(gdf, region_name, map_type, region_name_for_msg=''):
                         for search_term in search_variants:
                             city_match = province_cities[province_cities['市'] == search_term]
                             if not city_match.empty:
-                                # 确保坐标系一致
-                                if city_match.crs != gdf.crs:
-                                    city_match = city_match.to_crs(gdf.crs)
+                                # 各级数据使用同一投影，坐标系一致
                                 print(f"在市级地图中找到'{search_term}'（属于{region_name_for_msg}）")
-                                return city_match
+                                return city_data, city_match
         except Exception as e:
             print(f"在市级地图中查找时出错: {str(e)}")
     
     return None
 
-def generate_map(map_type='省', region_name=None, highlight_regions=None, 
-                 base_color="#EAEAEA", 
-                 border_color="white", border_width=0.5,
-                 show_labels=True, showTitle=True, customTitle='', titleFontSize=15,
-                 showCoordinates=False, coordinatesFontSize=20,
-                 showScaleBar=False, scaleBarStyle='default', scaleBarLocation='lower right', scaleBarFontSize=12,
-                 save_local=False):
+def color_neighbors(dataset, gdf, region_colors, region_name, color):
     """
-    生成地图图片，可以高亮显示多个区域（每个区域可以有独立颜色）
+    把与指定区域相邻的区域设为指定颜色（按邻接图查询，只与相邻区域的数量有关）
     
     参数:
-        map_type (str): 地图类型，可选 '省', '市', '县'
-        region_name (str, optional): 筛选指定的区域名称
-        highlight_regions (list, optional): 高亮显示的区域列表，每项包含 {'name': '区域名', 'color': '#颜色'}
-        base_color (str): 底图颜色(十六进制)
-        border_color (str): 边界线颜色
-        border_width (float): 边界线宽度
-        show_labels (bool): 是否显示标签
-        showTitle (bool): 是否显示标题
-        customTitle (str): 自定义标题，为空则使用默认标题
-        titleFontSize (int): 标题字体大小
-        showCoordinates (bool): 是否显示经纬度坐标
-        coordinatesFontSize (int): 经纬度字体大小
-        showScaleBar (bool): 是否显示比例尺
-        scaleBarStyle (str): 比例尺样式，可选 'segmented'(分段式), 'tick_only'(刻度线式), 'double_row'(双行交替式)
-        scaleBarLocation (str): 比例尺位置，可选 'lower right', 'lower left', 'upper right', 'upper left'
-        scaleBarFontSize (int): 比例尺字体大小
-        save_local (bool): 是否保存到本地文件系统
+        dataset: 当前地图的投影数据（ProjectedDataset）
+        gdf: 当前地图的属性表（已筛选）
+        region_colors (str或list): 各区域的底色
+        region_name (str): 区域名称，在同一级别的全部区域中查找（可以在当前地图范围之外）
+        color (str): 相邻区域的颜色
         
     返回:
-        str: 如果save_local=True，返回生成的图片路径；否则返回Base64编码的图片数据
+        str或list: 修改后的各区域底色
+    """
+    found = find_region_in_gdf(dataset, dataset.attributes, region_name, dataset.map_type)
+    if found is None or found[0] is not dataset:
+        print(f"警告: 未在{dataset.map_type}级数据中找到区域 '{region_name}'，不显示相邻区域")
+        return region_colors
+    
+    neighbors = get_adjacency(dataset.map_type).neighbors_of(found[1].index)
+    if isinstance(region_colors, str):
+        region_colors = [region_colors] * len(gdf)
+    region_colors = list(region_colors)
+    visible = gdf.index.get_indexer(neighbors)
+    for position in visible[visible >= 0]:
+        region_colors[position] = color
+    print(f"'{region_name}' 有 {len(neighbors)} 个相邻区域，当前地图中 {int((visible >= 0).sum())} 个")
+    return region_colors
+
+class MapFigure:
+    """
+    已构建的地图图形
+    
+    底图的所有区域在一个PathCollection中，每个区域对应一条路径。高亮区域如果就是底图中的区域，
+    直接修改底图集合中对应路径的颜色；否则（如市级地图中高亮的县）作为单独的覆盖层绘制。
+    因此更新高亮颜色或标题后只需重新栅格化和编码，不必重新读取、投影和绘制数据。
+    """
+    
+    def __init__(self, fig, ax, dataset, gdf, region_name,
+                 region_colors, border_color, border_width, chinese_font=None, geometry=None):
+        self.fig = fig
+        self.ax = ax
+        self.dataset = dataset
+        self.gdf = gdf  # 筛选后的属性表，索引为区域在dataset几何数组中的位置
+        self.map_type = dataset.map_type
+        self.region_name = region_name
+        self.projection = dataset.projection
+        self.border_color = border_color
+        self.border_width = border_width
+        self.chinese_font = chinese_font
+        
+        # 生成文件名和标题时使用的信息
+        self.is_national_map = False
+        self.filtered = False
+        self.original_region_name = region_name
+        
+        # 每个区域的底色（普通地图为统一底色，分级统计图为各区域的分级颜色）
+        if isinstance(region_colors, str):
+            region_colors = [region_colors] * len(gdf)
+        self.base_colors = list(region_colors)
+        # 底图几何默认使用原始数据，高负载时可以使用化简后的几何（位置与原始数据一一对应）
+        geometry = geometry if geometry is not None else dataset.geometry
+        self.base_collection, self.base_positions = build_region_collection(
+            geometry.paths(gdf.index), self.base_colors, border_color, border_width)
+        add_region_collection(ax, self.base_collection)
+        
+        self.highlight_regions = []
+        self.highlighted_positions = set()
+        self.label_artists = {}  # 区域在gdf中的位置 -> 标签Text
+        self.labels_drawn = False
+        self.label_limit = None  # 标签数量上限（高负载时设置，None表示默认规则）
+        self.title_artist = None
+        self.scale_bar_drawer = None  # 由build_map_figure设置，按当前视图绘制比例尺
+        # 版式：标题和经纬度标签占用的空间（字号，不显示时为None），地图区域的位置由此直接计算
+        self.title_font_size = None
+        self.coordinates_font_size = None
+        self.scale_bar_artists = []
+        self._resolved = {}  # 高亮区域名称 -> ('frame', 位置数组) / ('overlay', (数据, 属性表)) / None
+        self._overlays = {}  # 高亮区域名称 -> 覆盖层PathCollection
+        self.outline_detail = 'regional'  # 叠加边界的化简级别，由build_map_figure按视图范围设置
+        self.outline_artists = {}  # 叠加级别 -> 合并边界LineCollection
+    
+    def _frame_positions(self, found_data, found_gdf):
+        """如果找到的区域就是底图中的行，返回它们在底图中的位置，否则返回None"""
+        if found_data is not self.dataset or not found_gdf.index.isin(self.gdf.index).all():
+            return None
+        return self.gdf.index.get_indexer(found_gdf.index)
+    
+    def _resolve_highlight(self, hr_name):
+        """查找高亮区域（结果按名称缓存，重复更新颜色时不再查找）"""
+        if hr_name in self._resolved:
+            return self._resolved[hr_name]
+        
+        print(f"查找高亮区域: {hr_name}")
+        resolved = None
+        found = find_region_in_gdf(self.dataset, self.gdf, hr_name, self.map_type, self.region_name)
+        if found is not None and not found[1].empty:
+            positions = self._frame_positions(*found)
+            resolved = ('frame', positions) if positions is not None else ('overlay', found)
+        else:
+            print(f"警告: 未找到高亮区域 '{hr_name}'")
+        
+        self._resolved[hr_name] = resolved
+        return resolved
+    
+    def set_highlights(self, highlight_regions):
+        """
+        设置高亮区域（替换之前的全部高亮），只更新图形颜色
+        
+        参数:
+            highlight_regions (list): 每项包含 {'name': '区域名', 'color': '#颜色'}，后面的覆盖前面的
+        """
+        colors = list(self.base_colors)
+        highlighted = set()
+        overlay_colors = {}
+        applied = []
+        
+        for hr_item in highlight_regions or []:
+            if not isinstance(hr_item, dict):
+                print(f"跳过无效的高亮区域项: {hr_item}")
+                continue
+            
+            hr_name = (hr_item.get('name') or '').strip()
+            hr_color = hr_item.get('color', '#FF5733')
+            if not hr_name:
+                continue
+            
+            resolved = self._resolve_highlight(hr_name)
+            if resolved is None:
+                continue
+            
+            kind, target = resolved
+            if kind == 'frame':
+                for position in target:
+                    colors[position] = hr_color
+                highlighted.update(int(position) for position in target)
+            else:
+                overlay_colors[hr_name] = hr_color
+            applied.append({'name': hr_name, 'color': hr_color})
+        
+        self.base_collection.set_facecolor([colors[position] for position in self.base_positions])
+        
+        # 覆盖层：首次使用时创建，之后只切换颜色和可见性
+        for hr_name, hr_color in overlay_colors.items():
+            overlay = self._overlays.get(hr_name)
+            if overlay is None:
+                found_data, found_gdf = self._resolved[hr_name][1]
+                overlay, _ = build_region_collection(found_data.geometry.paths(found_gdf.index), hr_color,
+                                                     self.border_color, self.border_width, zorder=2)
+                add_region_collection(self.ax, overlay)
+                self._overlays[hr_name] = overlay
+            overlay.set_facecolor(hr_color)
+            overlay.set_visible(True)
+        for hr_name, overlay in self._overlays.items():
+            if hr_name not in overlay_colors:
+                overlay.set_visible(False)
+        
+        self.highlighted_positions = highlighted
+        self.highlight_regions = applied
+        for position, text in self.label_artists.items():
+            text.set_color(self.label_color(position))
+        print(f"[OK] 已应用 {len(applied)} 个高亮区域")
+    
+    def label_color(self, position):
+        """标签颜色：高亮区域使用白色文本以提高可见度"""
+        return 'white' if position in self.highlighted_positions else 'black'
+    
+    def apply_layout(self):
+        """按标题和经纬度标签的字号重新计算地图区域的位置（不需要预先绘制）"""
+        self.ax.set_position(compute_axes_rect(self.fig.get_size_inches(), self.title_font_size,
+                                               self.coordinates_font_size))
+
+    def set_output_size(self, width, height):
+        """修改输出尺寸（像素）并重新计算版式，尺寸需预先检查（见 resolve_output_size）"""
+        figsize, dpi = figure_geometry(width, height)
+        self.fig.set_dpi(dpi)
+        self.fig.set_size_inches(figsize, forward=False)
+        self.apply_layout()
+
+    def set_title(self, text, font_size=None):
+        """设置或更新标题"""
+        if self.title_artist is not None and font_size is None:
+            self.title_artist.set_text(text)
+            return self.title_artist
+        
+        kwargs = {'fontsize': font_size or 15}
+        if self.chinese_font:
+            kwargs['fontproperties'] = self.chinese_font
+        self.title_artist = self.ax.set_title(text, **kwargs)
+        return self.title_artist
+    
+    def set_base_color(self, base_color):
+        """修改底图颜色（分级统计图的区域颜色不受影响），之后需要重新应用高亮"""
+        self.base_colors = [base_color] * len(self.base_colors)
+    
+    def set_border(self, border_color, border_width):
+        """修改底图和覆盖层的边界线颜色和宽度"""
+        self.border_color = border_color
+        self.border_width = border_width
+        for collection in [self.base_collection, *self._overlays.values()]:
+            collection.set_edgecolor(border_color)
+            collection.set_linewidth(border_width)
+    
+    def set_overlays(self, levels, color='#555555', width=1.0):
+        """
+        在底图上叠加更粗级别的边界（如县级地图上的省界、市界），替换之前的叠加边界
+        
+        参数:
+            levels (list): 叠加级别，如 ['省', '市']
+            color (str): 边界线颜色
+            width (float): 省界线宽，市界按比例变细
+        """
+        for artist in self.outline_artists.values():
+            artist.remove()
+        self.outline_artists = {}
+        
+        for level in overlay_levels_for(self.map_type, levels):
+            collection = build_outline_collection(self.dataset, self.gdf, level, self.outline_detail,
+                                                  color, width * OVERLAY_WIDTH_RATIOS[level])
+            self.ax.add_collection(collection, autolim=False)
+            self.outline_artists[level] = collection
+        if self.outline_artists:
+            print(f"[OK] 已叠加{'、'.join(self.outline_artists)}级边界")
+    
+    def draw_labels(self):
+        """添加省/市/县名称标签"""
+        gdf = self.gdf
+        ax = self.ax
+        self.labels_drawn = True
+        name_fields = ['NAME', 'Name', 'name', 'CNAME', 'CName', 'cname', '市', '省', '县']
+        name_field_to_use = None
+        for field in name_fields:
+            if field in gdf.columns:
+                name_field_to_use = field
+                break
+        
+        if not name_field_to_use:
+            return
+        
+        print(f"使用{name_field_to_use}字段添加标签")
+        # 如果数据量大，只对部分区域添加标签（设置了标签数量上限时筛选后的地图也只显示部分标签）
+        max_labels = self.label_limit or 100
+        if len(gdf) > max_labels and (not self.filtered or self.label_limit):
+            print(f"数据量较大({len(gdf)}条)，仅显示部分标签")
+            try:
+                # 按面积降序排序，取最大的区域（不向共享的数据中写入新列）
+                areas = pd.Series(self.dataset.geometry.areas[gdf.index], index=gdf.index)
+                largest = areas.sort_values(ascending=False).index[:max_labels]
+                labeled_gdf = gdf.loc[largest]
+            except Exception as e:
+                print(f"计算区域面积时出错: {str(e)}")
+                # 如果计算面积失败，简单地取前N个记录
+                labeled_gdf = gdf.head(max_labels)
+        else:
+            labeled_gdf = gdf
+        
+        # 计算合适的字体大小 (根据区域数量调整)
+        font_size = 8 if len(labeled_gdf) > 30 else 10
+        text_kwargs = {'fontproperties': self.chinese_font} if self.chinese_font else {}
+        x_range = ax.get_xlim()
+        y_range = ax.get_ylim()
+        
+        label_positions = gdf.index.get_indexer(labeled_gdf.index)
+        # 标签位置（区域质心）在生成几何数组时已计算好
+        anchors = self.dataset.geometry.anchors[labeled_gdf.index]
+        for position, (idx, row), (x, y) in zip(label_positions, labeled_gdf.iterrows(), anchors):
+            try:
+                # 只有当中心点在绘图区域内时才添加标签
+                if x_range[0] <= x <= x_range[1] and y_range[0] <= y <= y_range[1]:
+                    label = str(row[name_field_to_use])
+                    # 如果是高亮区域，使用白色文本以提高可见度
+                    self.label_artists[position] = ax.text(x, y, label, fontsize=font_size, ha='center',
+                                                           va='center', color=self.label_color(position),
+                                                           **text_kwargs)
+            except Exception as e:
+                print(f"添加标签时出错: {str(e)}")
+    
+    def set_labels_visible(self, visible):
+        """显示或隐藏标签（首次显示时才创建标签）"""
+        if visible and not self.labels_drawn:
+            self.draw_labels()
+        for text in self.label_artists.values():
+            text.set_visible(visible)
+    
+    def default_title(self, highlight_regions=None):
+        """默认标题：根据地图类型、筛选区域和高亮区域生成"""
+        map_type = self.map_type
+        if self.is_national_map:
+            if map_type == '省':
+                map_title = "全国省级地图 - 中国行政区划"
+            elif map_type == '市':
+                map_title = "全国市级地图 - 中国行政区划"
+            else:
+                map_title = "全国县级地图 - 中国行政区划"
+        else:
+            map_title = f"{map_type}级地图 - 中国行政区划"
+            if self.filtered and self.original_region_name:
+                map_title = f"{map_type}级地图 - {self.original_region_name}区域"
+        
+        if highlight_regions and len(highlight_regions) > 0:
+            if len(highlight_regions) == 1:
+                map_title += f" (高亮: {highlight_regions[0]['name']})"
+            else:
+                map_title += f" (高亮: {len(highlight_regions)}个区域)"
+        return map_title
+    
+    def update_title(self, show_title, custom_title='', font_size=15, highlight_regions=None):
+        """按标题参数显示、隐藏或更新标题"""
+        if not show_title:
+            if self.title_artist is not None:
+                self.title_artist.set_visible(False)
+            self.title_font_size = None
+            self.apply_layout()
+            print("不显示地图标题")
+            return
+        
+        if custom_title and custom_title.strip():
+            # 使用自定义标题
+            map_title = custom_title.strip()
+        else:
+            # 使用默认标题逻辑
+            map_title = self.default_title(highlight_regions)
+        
+        # 设置标题及字体大小
+        self.set_title(map_title, font_size)
+        self.title_artist.set_visible(True)
+        self.title_font_size = self.title_artist.get_fontsize()
+        self.apply_layout()
+        print(f"设置地图标题: '{map_title}', 字体大小: {font_size}")
+    
+    def set_scale_bar(self, style, location, font_size):
+        """绘制比例尺（替换已有的比例尺），记录新增的图形元素以便之后移除"""
+        self.remove_scale_bar()
+        existing = set(self.ax.get_children())
+        try:
+            self.scale_bar_drawer(style, location, font_size)
+        except Exception as e:
+            print(f"绘制比例尺时出错: {str(e)}")
+        self.scale_bar_artists = [artist for artist in self.ax.get_children() if artist not in existing]
+    
+    def remove_scale_bar(self):
+        """移除已绘制的比例尺"""
+        for artist in self.scale_bar_artists:
+            artist.remove()
+        self.scale_bar_artists = []
+    
+    def render_png(self, dpi=None):
+        """
+        将图形编码为PNG（版式已预先计算，只绘制一次）
+        
+        参数:
+            dpi (float, optional): 分辨率，默认按构建时指定的像素尺寸输出
+        """
+        buf = io.BytesIO()
+        self.fig.savefig(buf, format='png', dpi=dpi or self.fig.dpi)
+        return buf.getvalue()
+    
+    def render_image(self, dpi=None):
+        """将图形栅格化为PIL图像（用于动画帧）"""
+        canvas = FigureCanvasAgg(self.fig)
+        output_dpi = self.fig.dpi
+        self.fig.set_dpi(dpi or output_dpi)
+        try:
+            canvas.draw()
+            width, height = canvas.get_width_height()
+            image = Image.frombuffer('RGBA', (width, height), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+            return image.convert('RGB')
+        finally:
+            self.fig.set_dpi(output_dpi)
+
+def build_map_figure(map_type='省', region_name=None, highlight_regions=None, 
+                     base_color="#EAEAEA", 
+                     border_color="white", border_width=0.5,
+                     show_labels=True, showTitle=True, customTitle='', titleFontSize=15,
+                     showCoordinates=False, coordinatesFontSize=20,
+                     showScaleBar=False, scaleBarStyle='default', scaleBarLocation='lower right', scaleBarFontSize=12,
+                     projection=DEFAULT_PROJECTION, choropleth=None,
+                     overlayLevels=None, overlayColor='#555555', overlayWidth=1.0,
+                     autoColor=False, autoColorPalette=None, highlightNeighbors='', neighborColor='#FFC300',
+                     points=None, width=None, height=None, quality=None):
     """
-    # 设置中文字体并获取字体属性
-    chinese_font = set_chinese_font()
+    构建地图图形（不编码输出），参数与 generate_map 相同（不含 save_local）
+    
+    quality为质量等级（见 quality.py，默认完整质量）：较低的等级按比例缩小输出尺寸，
+    使用化简后的底图几何，限制标签数量，并省略经纬网等较耗时的元素
+    
+    返回:
+        MapFigure: 可以继续更新高亮颜色、标题等并重新编码输出的地图图形
+    """
+    # 获取中文字体属性（只在首次渲染时查找字体，不再修改全局设置）
+    chinese_font = get_chinese_font()
     
     # 创建带字体的文本添加包装函数
     def add_text_with_font(ax, x, y, text, **kwargs):
@@ -441,30 +840,30 @@ def generate_map(map_type='省', region_name=None, highlight_regions=None,
     if map_type not in ['省', '市', '县']:
         raise ValueError("地图类型必须是 '省', '市' 或 '县'")
     
-    # 处理全国地图的特殊情况
-    is_national_map = (region_name == '全国' or not region_name or region_name == '')
+    # 检查投影有效性
+    get_projection_crs(projection)
     
-    # 构建shp文件路径
-    shp_path = os.path.join(SHP_FOLDER, f"{map_type}.shp")
+    # 检查输出尺寸（像素）
+    width, height = resolve_output_size(width, height)
+    settings = quality_settings(quality)
+    if settings['scale'] != 1:
+        width = max(MIN_OUTPUT_SIDE, round(width * settings['scale']))
+        height = max(MIN_OUTPUT_SIDE, round(height * settings['scale']))
+        print(f"质量等级 {quality}: 输出尺寸 {width}×{height}")
+    if showCoordinates and not settings['graticule']:
+        print(f"质量等级 {quality}: 不绘制经纬网")
+        showCoordinates = False
+    if scaleBarStyle == 'tick_only' and not settings['tick_scalebar']:
+        scaleBarStyle = 'default'
     
-    # 检查文件存在
-    if not os.path.exists(shp_path):
-        raise FileNotFoundError(f"找不到{shp_path}文件")
+    # 处理全国地图的特殊情况
+    is_national_map = (region_name == '全国' or not region_name or region_name == '')
     
-    try:
-        # 读取shp文件
-        gdf = gpd.read_file(shp_path, encoding='utf-8')
-    except Exception as e:
-        print(f"读取shp文件时出错: {str(e)}")
-        # 尝试使用不同的编码
-        try:
-            gdf = gpd.read_file(shp_path, encoding='gbk')
-        except Exception as e2:
-            print(f"尝试使用GBK编码读取文件时出错: {str(e2)}")
-            try:
-                gdf = gpd.read_file(shp_path, encoding='latin1')
-            except Exception as e3:
-                raise ValueError(f"无法读取shp文件: {str(e3)}")
+    # 读取投影后的数据（多个工作进程共享同一份几何数组，进程内按级别和投影缓存）
+    # 注意：属性表和几何数组是共享的，下面只做筛选，不修改它们
+    check_deadline('加载数据')
+    dataset = get_projected_data(map_type, projection)
+    gdf = dataset.attributes
     
     # 显示数据框的列名，帮助调试
     print(f"数据框列名: {gdf.columns.tolist()}")
@@ -544,7 +943,7 @@ def generate_map(map_type='省', region_name=None, highlight_regions=None,
                     # 尝试读取省级地图，查找省份
                     province_path = os.path.join(SHP_FOLDER, '省.shp')
                     if os.path.exists(province_path):
-                        province_gdf = gpd.read_file(province_path, encoding='utf-8')
+                        province_gdf = get_region_attributes('省')
                         # 查找省份
                         if '省' in province_gdf.columns:
                             for search_term in region_search_variants:
@@ -564,112 +963,77 @@ def generate_map(map_type='省', region_name=None, highlight_regions=None,
                     print(f"尝试在省级地图中查找时出错: {str(e)}")
     
     # 创建图形
-    plt.rcParams['figure.dpi'] = 100
-    plt.rcParams['savefig.dpi'] = 300
-    
-    # 使用Figure和Axes对象，避免使用pyplot的状态机接口
-    # 调整图形尺寸比例为16:9
-    fig = matplotlib.figure.Figure(figsize=(16, 9))
-    
-    # 使用标准的子图，而不使用投影（避免与GeoPandas兼容性问题）
-    ax = fig.add_subplot(111)
-    
-    # 投影转换 - 将地理坐标转换为适合中国地图的投影系统
-    try:
-        print(f"原始坐标系统: {gdf.crs}")
-        original_crs = gdf.crs  # 保存原始坐标系以便后续使用
-        
-        # 定义Lambert正形圆锥投影（中国测绘标准）
-        # 两个标准纬线覆盖中国南北跨度（海南到黑龙江）
-        asia_lcc_crs = CRS.from_proj4(
-            "+proj=lcc "
-            "+lat_1=25 +lat_2=47 "  # 两个标准纬线（纬度跨度覆盖南北中国）
-            "+lon_0=105 "            # 中心经度设在中国中部
-            "+lat_0=0 "
-            "+x_0=0 +y_0=0 "
-            "+datum=WGS84 "
-            "+units=m +no_defs"
-        )
-        
-        # 强制转换为Lambert正形圆锥投影（确保使用平面投影）
-        gdf = gdf.to_crs(asia_lcc_crs)
-        print(f"[OK] 坐标系统已转换为Lambert正形圆锥投影（中国测绘标准：lat_1=25, lat_2=47）")
-        print(f"[OK] 投影参数：中心经度105，标准纬线25和47")
-    except Exception as e:
-        print(f"尝试转换坐标系统时出错: {str(e)}")
-        # 使用PROJ字符串定义Lambert正形圆锥投影
-        try:
-            asia_lcc_crs = CRS.from_proj4(
-                "+proj=lcc "
-                "+lat_1=25 +lat_2=47 "  # 两个标准纬线（纬度跨度覆盖南北中国）
-                "+lon_0=105 "            # 中心经度设在中国中部
-                "+lat_0=0 "
-                "+x_0=0 +y_0=0 "
-                "+datum=WGS84 "
-                "+units=m +no_defs"
-            )
-            gdf = gdf.to_crs(asia_lcc_crs)
-            print(f"坐标系统已转换为Lambert正形圆锥投影（中国测绘标准：lat_1=25, lat_2=47）")
-        except Exception as e2:
-            print(f"使用PROJ字符串转换坐标系时出错: {str(e2)}")
-            original_crs = gdf.crs
+    # 使用Figure和Axes对象，避免使用pyplot的状态机接口和全局rcParams
+    # 图形宽度固定为16英寸，按输出像素换算分辨率，输出时不再裁剪（缩略图只需要缩略图的栅格化成本）
+    figsize, dpi = figure_geometry(width, height)
+    fig = matplotlib.figure.Figure(figsize=figsize, dpi=dpi)
     
-    # 处理多个高亮区域
-    highlight_gdfs_with_colors = []
+    # 地图区域的位置按标题和经纬度标签的字号直接计算，不使用tight_layout
+    ax = fig.add_axes(compute_axes_rect(figsize, titleFontSize if showTitle else None,
+                                        coordinatesFontSize if showCoordinates else None))
     
     print(f"收到 {len(highlight_regions)} 个高亮区域")
     print(f"底图区域: {region_name if region_name else '全国'}, 地图类型: {map_type}")
     
-    for hr_item in highlight_regions:
-        if not isinstance(hr_item, dict):
-            print(f"跳过无效的高亮区域项: {hr_item}")
-            continue
-        
-        hr_name = hr_item.get('name', '').strip()
-        hr_color = hr_item.get('color', '#FF5733')
-        
-        if not hr_name:
-            continue
-        
-        print(f"查找高亮区域: {hr_name} (颜色: {hr_color})")
-        
-        # 使用辅助函数查找区域
-        found_gdf = find_region_in_gdf(gdf, hr_name, map_type, region_name)
-        
-        if found_gdf is not None and not found_gdf.empty:
-            # 确保坐标系一致
-            if found_gdf.crs != gdf.crs:
-                found_gdf = found_gdf.to_crs(gdf.crs)
-            
-            highlight_gdfs_with_colors.append((found_gdf, hr_color))
-            print(f"[OK] 成功添加高亮区域 '{hr_name}' (颜色: {hr_color})")
-        else:
-            print(f"警告: 未找到高亮区域 '{hr_name}'")
-    
     # 绘制地图
-    # 先绘制底图
-    gdf.plot(ax=ax, color=base_color, edgecolor=border_color, linewidth=border_width)
+    # 先绘制底图：所有区域作为一个图形集合绘制，之后可以整体更新颜色
+    choropleth_legend = None
+    legend_title = (choropleth or {}).get('legendTitle', '')
+    region_colors = base_color
+    if choropleth:
+        # 分级统计图：一次关联全部数值，为每个区域计算颜色
+        region_colors, choropleth_legend = prepare_choropleth(gdf, map_type, choropleth, missing_color=base_color)
+    point_data = None
+    if points:
+        # 点数据：一次向量化投影；按区域汇总时以点数作为分级统计图的数值
+        check_deadline('读取点数据')
+        point_data = prepare_points(points, projection)
+        if point_mode(points) == 'regions':
+            if choropleth or autoColor:
+                raise ValueError("按区域汇总点数据时不能同时使用分级统计图或自动着色")
+            region_counts = aggregate_to_regions(dataset, gdf, *point_data)
+            region_colors, choropleth_legend = color_values(region_counts, points, missing_color=base_color)
+            legend_title = points.get('legendTitle', '点数')
+            point_data = None
+    if autoColor:
+        if choropleth:
+            raise ValueError("自动着色不能与分级统计图同时使用")
+        # 按预先建立的邻接图着色，不需要逐对计算多边形相交
+        region_colors = assign_colors(get_adjacency(map_type), gdf.index, autoColorPalette)
+    if highlightNeighbors and highlightNeighbors.strip():
+        region_colors = color_neighbors(dataset, gdf, region_colors, highlightNeighbors, neighborColor)
     
-    # 再绘制所有高亮区域（按顺序，每个用各自的颜色）
-    for highlight_gdf, highlight_color in highlight_gdfs_with_colors:
-        try:
-            highlight_gdf.plot(ax=ax, color=highlight_color, edgecolor=border_color, linewidth=border_width)
-            print(f"成功绘制高亮区域 (颜色: {highlight_color})")
-        except Exception as e:
-            print(f"绘制高亮区域时出错: {str(e)}")
+    check_deadline('绘制底图')
+    geometry = None
+    if settings['simplify']:
+        # 化简几何首次使用时在后台生成，生成前仍使用原始几何
+        geometry = get_simplified_geometry(dataset, settings['simplify']['national' if is_national_map else 'regional'])
+    map_figure = MapFigure(fig, ax, dataset, gdf, region_name,
+                           region_colors, border_color, border_width, chinese_font, geometry)
+    map_figure.label_limit = settings['max_labels']
+    map_figure.is_national_map = is_national_map
+    map_figure.filtered = filtered
+    map_figure.original_region_name = original_region_name
+    
+    # 再应用所有高亮区域（按顺序，每个用各自的颜色）
+    check_deadline('查找高亮区域')
+    map_figure.set_highlights(highlight_regions)
+    
+    # 叠加更粗级别的边界（使用预先合并的边界线，全国地图使用更粗的化简级别）
+    map_figure.outline_detail = 'national' if is_national_map else 'regional'
+    if overlayLevels:
+        map_figure.set_overlays(overlayLevels, overlayColor, overlayWidth)
     
     # 设置坐标轴宽高比，修复地图比例问题
     # 对于墨卡托投影地图使用'equal'确保比例正确
     ax.set_aspect('equal', adjustable='box')
-    
-    # 调整边界和布局，确保地图完整显示且不变形
-    fig.tight_layout(pad=2.0)
+    map_figure.coordinates_font_size = coordinatesFontSize if showCoordinates else None
     
     # 设置适当的视图范围以避免变形（针对中国地图）
     if is_national_map:
         try:
             # 获取数据边界并稍微扩大视图范围
-            bounds = gdf.total_bounds
+            bounds = dataset.geometry.total_bounds(gdf.index)
             x_min, y_min, x_max, y_max = bounds
             # 计算中心点
             x_center = (x_min + x_max) / 2
@@ -692,56 +1056,15 @@ def generate_map(map_type='省', region_name=None, highlight_regions=None,
         except Exception as e:
             print(f"设置视图范围时出错: {str(e)}")
     
+    # 在确定的视图范围内绘制点数据（逐点或按格网汇总）
+    if point_data is not None:
+        check_deadline('绘制点数据')
+        draw_points(ax, *point_data, points)
+    
     # 添加省/市/县名称标签
     if show_labels:
-        name_fields = ['NAME', 'Name', 'name', 'CNAME', 'CName', 'cname', '市', '省', '县']
-        name_field_to_use = None
-        for field in name_fields:
-            if field in gdf.columns:
-                name_field_to_use = field
-                break
-        
-        if name_field_to_use:
-            print(f"使用{name_field_to_use}字段添加标签")
-            # 如果数据量大，只对部分区域添加标签
-            max_labels = 100
-            if len(gdf) > max_labels and not filtered:
-                print(f"数据量较大({len(gdf)}条)，仅显示部分标签")
-                try:
-                    # 计算区域面积
-                    gdf['area'] = gdf.geometry.area
-                    # 按面积降序排序，取最大的区域
-                    labeled_gdf = gdf.sort_values('area', ascending=False).head(max_labels)
-                except Exception as e:
-                    print(f"计算区域面积时出错: {str(e)}")
-                    # 如果计算面积失败，简单地取前N个记录
-                    labeled_gdf = gdf.head(max_labels)
-            else:
-                labeled_gdf = gdf
-            
-            for idx, row in labeled_gdf.iterrows():
-                try:
-                    # 获取多边形的中心点
-                    centroid = row.geometry.centroid
-                    # 检查中心点是否在视图范围内
-                    x, y = centroid.x, centroid.y
-                    x_range = ax.get_xlim()
-                    y_range = ax.get_ylim()
-                    
-                    # 只有当中心点在绘图区域内时才添加标签
-                    if x_range[0] <= x <= x_range[1] and y_range[0] <= y <= y_range[1]:
-                        label = str(row[name_field_to_use])
-                        # 计算合适的字体大小 (根据区域数量调整)
-                        font_size = 8 if len(labeled_gdf) > 30 else 10
-                        
-                        # 如果是高亮区域，使用白色文本以提高可见度
-                        is_highlighted = any(idx in h_gdf.index for h_gdf, _ in highlight_gdfs_with_colors)
-                        label_color = 'white' if is_highlighted else 'black'
-                        
-                        add_text_with_font(ax, x, y, label, 
-                                fontsize=font_size, ha='center', va='center', color=label_color)
-                except Exception as e:
-                    print(f"添加标签时出错: {str(e)}")
+        check_deadline('添加标签')
+        map_figure.draw_labels()
                 
     # 移除坐标轴
     ax.set_axis_off()
@@ -750,218 +1073,20 @@ def generate_map(map_type='省', region_name=None, highlight_regions=None,
     if showCoordinates:
         # 重新启用坐标轴以显示经纬度
         ax.set_axis_on()
-        
-        # 如果当前是投影坐标系（Asia Lambert Conformal Conic），转换回地理坐标系以显示经纬度
-        if gdf.crs and ('102012' in str(gdf.crs) or '+proj=lcc' in str(gdf.crs).lower()):
-            try:
-                # 获取当前视图范围（等角圆锥投影坐标系）
-                x_min, x_max = ax.get_xlim()
-                y_min, y_max = ax.get_ylim()
-                
-                # 创建网格点
-                x_step = (x_max - x_min) / 5
-                y_step = (y_max - y_min) / 5
-                
-                # 创建从Asia Lambert Conformal Conic投影到WGS84的坐标转换器
-                transformer = pyproj.Transformer.from_crs(gdf.crs, "EPSG:4326", always_xy=True)
-                
-                # 创建经度刻度
-                lon_ticks = []
-                lon_labels = []
-                for x in np.arange(x_min, x_max + x_step, x_step):
-                    # 对于每个x坐标，使用中间y值进行转换
-                    y_mid = (y_min + y_max) / 2
-                    lon, _ = transformer.transform(x, y_mid)
-                    lon_ticks.append(x)
-                    lon_labels.append(f"{lon:.2f}°E")
-                
-                # 创建纬度刻度
-                lat_ticks = []
-                lat_labels = []
-                for y in np.arange(y_min, y_max + y_step, y_step):
-                    # 对于每个y坐标，使用中间x值进行转换
-                    x_mid = (x_min + x_max) / 2
-                    _, lat = transformer.transform(x_mid, y)
-                    lat_ticks.append(y)
-                    lat_labels.append(f"{lat:.2f}°N")
-                
-                # 设置刻度和标签
-                ax.set_xticks(lon_ticks)
-                ax.set_xticklabels(lon_labels, fontsize=coordinatesFontSize)
-                ax.set_yticks(lat_ticks)
-                ax.set_yticklabels(lat_labels, fontsize=coordinatesFontSize)
-                
-                # 添加网格线
-                ax.grid(True, linestyle='--', alpha=0.5)
-                
-                # 删除经纬度标签文本
-                ax.set_xlabel('')
-                ax.set_ylabel('')
-            except Exception as e:
-                print(f"显示经纬度网格时出错: {str(e)}")
-                # 如果发生错误，回退到简单刻度
-                ax.set_xticks([])
-                ax.set_yticks([])
-        elif gdf.crs and ('lcc' in str(gdf.crs).lower()):
-            try:
-                # 获取当前视图范围（等角圆锥投影坐标系）
-                x_min, x_max = ax.get_xlim()
-                y_min, y_max = ax.get_ylim()
-                
-                # 创建网格点
-                x_step = (x_max - x_min) / 5
-                y_step = (y_max - y_min) / 5
-                
-                # 创建从Lambert等角圆锥投影到WGS84的坐标转换器
-                transformer = pyproj.Transformer.from_crs(gdf.crs, "EPSG:4326", always_xy=True)
-                
-                # 创建经度刻度
-                lon_ticks = []
-                lon_labels = []
-                for x in np.arange(x_min, x_max + x_step, x_step):
-                    # 对于每个x坐标，使用中间y值进行转换
-                    y_mid = (y_min + y_max) / 2
-                    lon, _ = transformer.transform(x, y_mid)
-                    lon_ticks.append(x)
-                    lon_labels.append(f"{lon:.2f}°E")
-                
-                # 创建纬度刻度
-                lat_ticks = []
-                lat_labels = []
-                for y in np.arange(y_min, y_max + y_step, y_step):
-                    # 对于每个y坐标，使用中间x值进行转换
-                    x_mid = (x_min + x_max) / 2
-                    _, lat = transformer.transform(x_mid, y)
-                    lat_ticks.append(y)
-                    lat_labels.append(f"{lat:.2f}°N")
-                
-                # 设置刻度和标签
-                ax.set_xticks(lon_ticks)
-                ax.set_xticklabels(lon_labels, fontsize=coordinatesFontSize)
-                ax.set_yticks(lat_ticks)
-                ax.set_yticklabels(lat_labels, fontsize=coordinatesFontSize)
-                
-                # 添加网格线
-                ax.grid(True, linestyle='--', alpha=0.5)
-                
-                # 删除经纬度标签文本
-                ax.set_xlabel('')
-                ax.set_ylabel('')
-            except Exception as e:
-                print(f"显示经纬度网格时出错: {str(e)}")
-                # 如果发生错误，回退到简单刻度
-                ax.set_xticks([])
-                ax.set_yticks([])
-        elif gdf.crs and 'epsg:3857' in str(gdf.crs).lower():
-            try:
-                # 获取当前视图范围（投影坐标系）
-                x_min, x_max = ax.get_xlim()
-                y_min, y_max = ax.get_ylim()
-                
-                # 创建网格点
-                x_step = (x_max - x_min) / 5
-                y_step = (y_max - y_min) / 5
-                
-                # 转换为经纬度坐标
-                transformer = pyproj.Transformer.from_crs("EPSG:3857", "EPSG:4326", always_xy=True)
-                
-                # 创建经度刻度
-                lon_ticks = []
-                lon_labels = []
-                for x in np.arange(x_min, x_max + x_step, x_step):
-                    lon, _ = transformer.transform(x, 0)
-                    lon_ticks.append(x)
-                    lon_labels.append(f"{lon:.2f}°E")
-                
-                # 创建纬度刻度
-                lat_ticks = []
-                lat_labels = []
-                for y in np.arange(y_min, y_max + y_step, y_step):
-                    _, lat = transformer.transform(0, y)
-                    lat_ticks.append(y)
-                    lat_labels.append(f"{lat:.2f}°N")
-                
-                # 设置刻度和标签
-                ax.set_xticks(lon_ticks)
-                ax.set_xticklabels(lon_labels, fontsize=coordinatesFontSize)
-                ax.set_yticks(lat_ticks)
-                ax.set_yticklabels(lat_labels, fontsize=coordinatesFontSize)
-                
-                # 添加网格线
-                ax.grid(True, linestyle='--', alpha=0.5)
-                
-                # 删除经纬度标签文本
-                ax.set_xlabel('')
-                ax.set_ylabel('')
-            except Exception as e:
-                print(f"显示经纬度网格时出错: {str(e)}")
-                # 如果发生错误，回退到简单刻度
-                ax.set_xticks([])
-                ax.set_yticks([])
-        else:
-            # 如果已经是地理坐标系，直接添加经纬度刻度
-            try:
-                # 获取当前视图范围
-                x_min, x_max = ax.get_xlim()
-                y_min, y_max = ax.get_ylim()
-                
-                # 创建刻度
-                lon_ticks = np.linspace(x_min, x_max, 6)
-                lat_ticks = np.linspace(y_min, y_max, 6)
-                
-                # 设置刻度和标签
-                ax.set_xticks(lon_ticks)
-                ax.set_xticklabels([f"{x:.2f}°E" for x in lon_ticks], fontsize=coordinatesFontSize)
-                ax.set_yticks(lat_ticks)
-                ax.set_yticklabels([f"{y:.2f}°N" for y in lat_ticks], fontsize=coordinatesFontSize)
-                
-                # 添加网格线
-                ax.grid(True, linestyle='--', alpha=0.5)
-                
-                # 删除经纬度标签文本
-                ax.set_xlabel('')
-                ax.set_ylabel('')
-            except Exception as e:
-                print(f"显示经纬度网格时出错: {str(e)}")
-                ax.set_xticks([])
-                ax.set_yticks([])
+        try:
+            # 经纬网按坐标系和视图范围缓存，圆锥投影下绘制真实的弧形经纬线
+            draw_graticule(ax, dataset.crs, coordinatesFontSize)
+        except Exception as e:
+            print(f"显示经纬度网格时出错: {str(e)}")
+            # 如果发生错误，回退到简单刻度
+            ax.set_xticks([])
+            ax.set_yticks([])
     else:
         # 不显示经纬度时完全隐藏坐标轴
         ax.set_axis_off()
     
     # 设置标题
-    if showTitle:
-        if customTitle and customTitle.strip():
-            # 使用自定义标题
-            map_title = customTitle.strip()
-        else:
-            # 使用默认标题逻辑
-            if is_national_map:
-                if map_type == '省':
-                    map_title = "全国省级地图 - 中国行政区划"
-                elif map_type == '市':
-                    map_title = "全国市级地图 - 中国行政区划"
-                else:
-                    map_title = "全国县级地图 - 中国行政区划"
-            else:
-                map_title = f"{map_type}级地图 - 中国行政区划"
-                if filtered and original_region_name:
-                    map_title = f"{map_type}级地图 - {original_region_name}区域"
-            
-            if highlight_regions and len(highlight_regions) > 0:
-                if len(highlight_regions) == 1:
-                    map_title += f" (高亮: {highlight_regions[0]['name']})"
-                else:
-                    map_title += f" (高亮: {len(highlight_regions)}个区域)"
-        
-        # 设置标题及字体大小
-        if chinese_font:
-            ax.set_title(map_title, fontsize=titleFontSize, fontproperties=chinese_font)
-        else:
-            ax.set_title(map_title, fontsize=titleFontSize)
-        print(f"设置地图标题: '{map_title}', 字体大小: {titleFontSize}")
-    else:
-        print("不显示地图标题")
+    map_figure.update_title(showTitle, customTitle, titleFontSize, highlight_regions)
     
     # 添加自定义绘制的比例尺函数
     def draw_custom_scalebar(ax, style, location, font_size):
@@ -978,7 +1103,7 @@ def generate_map(map_type='省', region_name=None, highlight_regions=None,
         map_height_m = ylim[1] - ylim[0]
         
         # 自动选择合适的比例尺长度（千米）- 选择地图宽度的30-40%
-        total_km = map_width_m / 1000
+        total_km = map_width_m / scale_factor / 1000
         target_scale_km = total_km * 0.35  # 比例尺占地图宽度的35%
         
         # 选择最接近的"整数"公里数
@@ -1007,7 +1132,7 @@ def generate_map(map_type='省', region_name=None, highlight_regions=None,
         
         # 计算比例尺的像素长度（与实际地理距离匹配）
         scale_m = scale_km * 1000
-        scale_pixel_length = scale_m  # 精确匹配实际距离
+        scale_pixel_length = scale_m * scale_factor  # 按投影比例因子换算，精确匹配实际距离
         
         # 根据位置确定比例尺的起始坐标
         margin_x = map_width_m * 0.03  # 减小边距
@@ -1089,7 +1214,7 @@ def generate_map(map_type='省', region_name=None, highlight_regions=None,
         map_height_m = ylim[1] - ylim[0]
         
         # 自动选择合适的比例尺长度（千米）- 选择地图宽度的30-40%
-        total_km = map_width_m / 1000
+        total_km = map_width_m / scale_factor / 1000
         target_scale_km = total_km * 0.35  # 比例尺占地图宽度的35%
         
         # 选择最接近的"整数"公里数
@@ -1118,7 +1243,7 @@ def generate_map(map_type='省', region_name=None, highlight_regions=None,
         
         # 计算比例尺的像素长度（与实际地理距离匹配）
         scale_m = scale_km * 1000
-        scale_pixel_length = scale_m  # 精确匹配实际距离
+        scale_pixel_length = scale_m * scale_factor  # 按投影比例因子换算，精确匹配实际距离
         
         # 根据位置确定比例尺的起始坐标
         margin_x = map_width_m * 0.03  # 减小边距
@@ -1203,7 +1328,7 @@ def generate_map(map_type='省', region_name=None, highlight_regions=None,
         map_height_m = ylim[1] - ylim[0]
         
         # 自动选择合适的比例尺长度（千米）- 选择地图宽度的30-40%
-        total_km = map_width_m / 1000
+        total_km = map_width_m / scale_factor / 1000
         target_scale_km = total_km * 0.35  # 比例尺占地图宽度的35%
         
         # 选择最接近的"整数"公里数
@@ -1232,7 +1357,7 @@ def generate_map(map_type='省', region_name=None, highlight_regions=None,
         
         # 计算比例尺的像素长度（与实际地理距离匹配）
         scale_m = scale_km * 1000
-        scale_pixel_length = scale_m  # 精确匹配实际距离
+        scale_pixel_length = scale_m * scale_factor  # 按投影比例因子换算，精确匹配实际距离
         
         # 根据位置确定比例尺的起始坐标
         margin_x = map_width_m * 0.03  # 减小边距
@@ -1329,18 +1454,222 @@ def generate_map(map_type='省', region_name=None, highlight_regions=None,
         
         print(f"[OK] 已绘制双行交替式比例尺: {scale_km} km")
     
+    # 添加分级统计图图例
+    if choropleth_legend:
+        try:
+            draw_choropleth_legend(ax, choropleth_legend, legend_title, chinese_font)
+        except Exception as e:
+            print(f"绘制图例时出错: {str(e)}")
+    
+    def draw_scale_bar(style, location, font_size):
+        """按样式绘制比例尺"""
+        nonlocal scale_factor
+        # 地图中心处每米实际距离对应的投影坐标长度（墨卡托投影下明显大于1）
+        xlim = ax.get_xlim()
+        ylim = ax.get_ylim()
+        scale_factor = get_scale_factor(projection, sum(xlim) / 2, sum(ylim) / 2)
+        if scale_factor is None:
+            raise ValueError("经纬度坐标下无法绘制比例尺")
+        
+        if style == 'tick_only':
+            draw_tick_only_scalebar(ax, location, font_size)
+        elif style == 'double_row':
+            draw_double_row_scalebar(ax, location, font_size)
+        else:  # 默认使用分段式
+            draw_custom_scalebar(ax, style, location, font_size)
+    
+    scale_factor = None
+    map_figure.scale_bar_drawer = draw_scale_bar
+    
     # 添加比例尺
     if showScaleBar:
         # 使用自定义绘制的专业比例尺样式
+        map_figure.set_scale_bar(scaleBarStyle, scaleBarLocation, scaleBarFontSize)
+    
+    return map_figure
+
+
+def generate_map(map_type='省', region_name=None, highlight_regions=None, 
+                 base_color="#EAEAEA", 
+                 border_color="white", border_width=0.5,
+                 show_labels=True, showTitle=True, customTitle='', titleFontSize=15,
+                 showCoordinates=False, coordinatesFontSize=20,
+                 showScaleBar=False, scaleBarStyle='default', scaleBarLocation='lower right', scaleBarFontSize=12,
+                 save_local=False, projection=DEFAULT_PROJECTION, choropleth=None,
+                 overlayLevels=None, overlayColor='#555555', overlayWidth=1.0,
+                 autoColor=False, autoColorPalette=None, highlightNeighbors='', neighborColor='#FFC300',
+                 points=None, width=None, height=None, inline=False):
+    """
+    生成地图图片，可以高亮显示多个区域（每个区域可以有独立颜色）
+    
+    参数:
+        map_type (str): 地图类型，可选 '省', '市', '县'
+        region_name (str, optional): 筛选指定的区域名称
+        highlight_regions (list, optional): 高亮显示的区域列表，每项包含 {'name': '区域名', 'color': '#颜色'}
+        base_color (str): 底图颜色(十六进制)
+        border_color (str): 边界线颜色
+        border_width (float): 边界线宽度
+        show_labels (bool): 是否显示标签
+        showTitle (bool): 是否显示标题
+        customTitle (str): 自定义标题，为空则使用默认标题
+        titleFontSize (int): 标题字体大小
+        showCoordinates (bool): 是否显示经纬度坐标
+        coordinatesFontSize (int): 经纬度字体大小
+        showScaleBar (bool): 是否显示比例尺
+        scaleBarStyle (str): 比例尺样式，可选 'segmented'(分段式), 'tick_only'(刻度线式), 'double_row'(双行交替式)
+        scaleBarLocation (str): 比例尺位置，可选 'lower right', 'lower left', 'upper right', 'upper left'
+        scaleBarFontSize (int): 比例尺字体大小
+        save_local (bool): 是否保存到本地文件系统
+        projection (str): 地图投影，可选 'lcc'(Lambert正形圆锥), 'albers'(Albers等积圆锥), 'mercator'(Web墨卡托), 'geographic'(经纬度)
+        choropleth (dict, optional): 分级统计图选项，包含 data/table（区域代码或名称与数值）、
+            scheme（'quantile', 'equal_interval', 'natural_breaks'）、k（分级数）、cmap（色带）、legendTitle（图例标题）
+        overlayLevels (list, optional): 叠加显示的更粗级别边界，如县级地图上的 ['省', '市']
+        overlayColor (str): 叠加边界线颜色
+        overlayWidth (float): 叠加的省界线宽（市界按比例变细）
+        autoColor (bool): 按邻接关系自动为底图区域着色，相邻区域颜色不同（不能与分级统计图同时使用）
+        autoColorPalette (list, optional): 自动着色的色板，至少4种颜色，默认为 adjacency.AUTO_COLOR_PALETTE
+        highlightNeighbors (str): 突出显示与该区域相邻的区域（同一级别，不包括该区域本身）
+        neighborColor (str): 相邻区域的颜色
+        points (dict, optional): 点数据图层，包含 data/table（经纬度和可选的权重）、
+            mode（'scatter', 'hexbin', 'grid', 'regions'）、color、size、alpha、gridSize、cmap、logScale，
+            按区域汇总时另有 scheme、k、legendTitle（与分级统计图相同）
+        width (int, optional): 输出宽度（像素），默认4800
+        height (int, optional): 输出高度（像素），只指定宽度时按16:9计算
+        inline (bool): 不使用缓存、不合并相同的请求、不提交到渲染队列，直接在本进程内渲染（用于性能分析）
+        
+    负载高时按 quality.py 自动降低渲染质量，实际使用的质量等级通过 report_quality 报告给请求。
+    设置了 RENDER_QUEUE 时由渲染进程（render_worker.py）渲染，本函数等待结果。
+        
+    返回:
+        str: 如果save_local=True，返回生成的图片路径；否则返回Base64编码的图片数据
+    """
+    map_kwargs = dict(
+        map_type=map_type, region_name=region_name, highlight_regions=highlight_regions,
+        base_color=base_color, border_color=border_color, border_width=border_width,
+        show_labels=show_labels, showTitle=showTitle, customTitle=customTitle, titleFontSize=titleFontSize,
+        showCoordinates=showCoordinates, coordinatesFontSize=coordinatesFontSize,
+        showScaleBar=showScaleBar, scaleBarStyle=scaleBarStyle, scaleBarLocation=scaleBarLocation,
+        scaleBarFontSize=scaleBarFontSize, projection=projection, choropleth=choropleth,
+        overlayLevels=overlayLevels, overlayColor=overlayColor, overlayWidth=overlayWidth,
+        autoColor=autoColor, autoColorPalette=autoColorPalette,
+        highlightNeighbors=highlightNeighbors, neighborColor=neighborColor,
+        points=points, width=width, height=height
+    )
+    
+    # 相同参数的地图（包括预渲染的地图）直接使用缓存
+    storage = get_map_storage(MAPS_OUTPUT_FOLDER)
+    cache_alias, cached_path = lookup_render(storage, map_kwargs) if not inline else (None, None)
+    
+    # 负载高时降低渲染质量；低质量的地图使用单独的缓存键，负载降低后不会被当作完整质量的结果
+    quality = 'full'
+    if not cached_path:
+        quality = get_quality_controller().current_tier()
+        if quality != 'full':
+            map_kwargs['quality'] = quality
+            if not inline:
+                cache_alias, cached_path = lookup_render(storage, map_kwargs)
+    report_quality(quality)
+    
+    if inline:
+        # 性能分析需要记录实际的渲染过程，而不是读取缓存或等待其他请求、渲染进程的结果
+        data, filename = render_map_image(map_kwargs)
+        return deliver_map_image(data, filename, save_local)
+    
+    if cached_path:
+        print(f"使用已缓存的地图: {cache_alias}")
+        if save_local:
+            return f"maps/{cache_alias}"
+        with open(cached_path, 'rb') as f:
+            return deliver_map_image(f.read(), cache_alias, save_local)
+    
+    def render_map():
+        # 设置了渲染队列时交给渲染进程，否则在本进程内渲染
+        # 包括排队在内的耗时用于选择之后请求的质量等级
+        started = time.monotonic()
         try:
-            if scaleBarStyle == 'tick_only':
-                draw_tick_only_scalebar(ax, scaleBarLocation, scaleBarFontSize)
-            elif scaleBarStyle == 'double_row':
-                draw_double_row_scalebar(ax, scaleBarLocation, scaleBarFontSize)
-            else:  # 默认使用分段式
-                draw_custom_scalebar(ax, scaleBarStyle, scaleBarLocation, scaleBarFontSize)
-        except Exception as e:
-            print(f"绘制比例尺时出错: {str(e)}")
+            queue = get_render_queue()
+            job_id = render_cache_key(map_kwargs) if queue is not None else None
+            # 上传的数据表随任务提交（任务id包含数据表内容的散列），过大时在本进程内渲染
+            queued_kwargs = encode_map_kwargs(map_kwargs) if job_id else None
+            if queued_kwargs is not None:
+                # 渲染进程必须使用与缓存键相同版本的边界数据
+                payload = {'map_kwargs': queued_kwargs, 'data_version': get_data_version()}
+                data, filename = render_via_queue(queue, job_id, payload, fresh=not RENDER_CACHE_ENABLED)
+            else:
+                if queue is not None:
+                    print("上传的数据表过大或参数无法提交到渲染队列，在本进程内渲染")
+                    record_inline_render()
+                data, filename = render_map_image(map_kwargs)
+        finally:
+            get_quality_controller().observe(time.monotonic() - started)
+        if cache_alias:
+            storage.put(data, cache_alias)
+        return data, filename
+    
+    # 合并参数相同的并发请求，与是否缓存结果无关（不缓存时键仍然由规范化的参数决定）
+    flight_key = render_cache_key(map_kwargs)
+    
+    def render_shared():
+        # 其他进程可能刚刚渲染完相同的地图，取得锁后先检查存储（不缓存时检查交接的结果）
+        waiting_since = time.time()
+        with process_lock(flight_key):
+            if cache_alias:
+                resolved = storage.resolve(cache_alias)
+                if resolved:
+                    print(f"使用其他进程渲染的地图: {cache_alias}")
+                    with open(resolved[0], 'rb') as f:
+                        return f.read(), cache_alias
+            else:
+                handed_over = read_handoff(flight_key, waiting_since)
+                if handed_over:
+                    print(f"使用其他进程渲染的地图: {handed_over[1]}")
+                    return handed_over
+            data, filename = render_map()
+            if not cache_alias:
+                write_handoff(flight_key, data, filename)
+            return data, filename
+    
+    if flight_key:
+        # 参数相同的并发请求只渲染一次（同一进程内的线程和同一台机器上的进程）
+        data, filename = get_single_flight().do(flight_key, render_shared)
+    else:
+        data, filename = render_map()
+    return deliver_map_image(data, filename, save_local)
+
+def render_map_image(map_kwargs):
+    """
+    渲染一张地图（Web进程内渲染和 render_worker.py 的渲染进程共用）
+    
+    按估算成本申请渲染资源，服务器繁忙时排队或拒绝（AdmissionRejected）
+    
+    参数:
+        map_kwargs (dict): 地图参数（与build_map_figure相同）
+        
+    返回:
+        tuple: (PNG图片数据, 文件名)
+    """
+    pixel_scale = quality_settings(map_kwargs.get('quality'))['scale']
+    cost = estimate_render_cost(map_kwargs, pixel_scale=pixel_scale)
+    label = f"{map_kwargs.get('map_type')} {map_kwargs.get('region_name')}"
+    with get_admission_controller().admit(cost, label), record_render('map'):
+        map_figure = build_map_figure(**map_kwargs)
+        check_deadline('输出图片')
+        data = map_figure.render_png()
+    return data, build_map_filename(map_figure, map_kwargs.get('highlight_regions'))
+
+def build_map_filename(map_figure, highlight_regions=None, extension='png'):
+    """
+    根据地图类型、区域和高亮区域生成唯一文件名
+    
+    参数:
+        map_figure (MapFigure): 地图图形
+        highlight_regions (list, optional): 高亮区域列表
+        extension (str): 文件扩展名
+    """
+    map_type = map_figure.map_type
+    is_national_map = map_figure.is_national_map
+    original_region_name = map_figure.original_region_name
+    filtered = map_figure.filtered
     
     # 生成唯一文件名
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -1348,13 +1677,13 @@ def generate_map(map_type='省', region_name=None, highlight_regions=None,
     
     if is_national_map:
         if map_type == '省':
-            filename = f"全国省级_{timestamp}_{unique_id}.png"
+            filename = f"全国省级_{timestamp}_{unique_id}.{extension}"
         elif map_type == '市':
-            filename = f"全国市级_{timestamp}_{unique_id}.png"
+            filename = f"全国市级_{timestamp}_{unique_id}.{extension}"
         else:
-            filename = f"全国县级_{timestamp}_{unique_id}.png"
+            filename = f"全国县级_{timestamp}_{unique_id}.{extension}"
     else:
-        filename = f"{map_type}_{timestamp}_{unique_id}.png"
+        filename = f"{map_type}_{timestamp}_{unique_id}.{extension}"
     
     # 如果有区域名和高亮区域，加入文件名
     name_parts = []
@@ -1374,31 +1703,35 @@ def generate_map(map_type='省', region_name=None, highlight_regions=None,
     
     if name_parts:
         if is_national_map:
-            filename = f"全国_{'_'.join(name_parts)}_{timestamp}_{unique_id}.png"
+            filename = f"全国_{'_'.join(name_parts)}_{timestamp}_{unique_id}.{extension}"
         else:
-            filename = f"{map_type}_{'_'.join(name_parts)}_{timestamp}_{unique_id}.png"
+            filename = f"{map_type}_{'_'.join(name_parts)}_{timestamp}_{unique_id}.{extension}"
+    return filename
+
+def deliver_map_image(data, filename, save_local, mimetype='image/png'):
+    """
+    输出编码后的地图
     
+    参数:
+        data (bytes): 编码后的图片（或压缩包）数据
+        filename (str): 文件名
+        save_local (bool): 是否保存到本地文件系统
+        mimetype (str): 数据类型
+        
+    返回:
+        str: 如果save_local=True，返回保存后的相对路径；否则返回Base64编码的data URI
+    """
     # 区分是保存到本地还是直接返回Base64
     if save_local:
-        # 如果需要保存到本地
-        output_path = os.path.join(MAPS_OUTPUT_FOLDER, filename)
-        fig.savefig(output_path, bbox_inches='tight')
-        print(f"地图生成成功，保存至: {output_path}")
+        # 如果需要保存到本地：按内容去重存储，文件名作为别名
+        digest = get_map_storage(MAPS_OUTPUT_FOLDER).put(data, filename)
+        print(f"地图生成成功，保存至: {filename} (内容 {digest[:12]})")
         # 返回相对路径
         return f"maps/{filename}"
     else:
         # 直接返回Base64编码的图片，不保存到本地
-        import io
-        import base64
-        
-        # 将图表保存到内存中的BytesIO对象
-        buf = io.BytesIO()
-        fig.savefig(buf, format='png', bbox_inches='tight')
-        buf.seek(0)
-        
-        # 将图像转换为Base64编码
-        img_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
+        img_base64 = base64.b64encode(data).decode('utf-8')
         print("地图生成成功，作为Base64编码返回")
         
         # 返回Base64编码的图片数据
-        return f"data:image/png;base64,{img_base64}" 
\ No newline at end of file
+        return f"data:{mimetype};base64,{img_base64}"
@@ -0,0 +1,98 @@
+from app.controllers.boundary_store import DEFAULT_PROJECTION
+
+
+def parse_map_options(data):
+    """
+    将请求参数转换为generate_map的关键字参数（生成地图、生成动画和预渲染共用）
+    """
+    map_type = data.get('mapType', '省')  # 默认是省级地图
+    region_name = data.get('regionName', '').strip()  # 可选的区域名称筛选
+    
+    # 新增高亮和颜色自定义参数
+    highlight_regions = data.get('highlightRegions', [])  # 多个高亮区域（包含区域名和颜色）
+    # 兼容旧版单区域参数
+    if not highlight_regions and data.get('highlightRegion'):
+        highlight_regions = [{
+            'name': data.get('highlightRegion').strip(),
+            'color': data.get('highlightColor', '#FF5733')
+        }]
+    base_color = data.get('baseColor', '#EAEAEA')  # 底图颜色
+    border_color = data.get('borderColor', 'white')  # 边界线颜色
+    border_width = float(data.get('borderWidth', 0.5))  # 边界线宽度
+    show_labels = data.get('showLabels', True)  # 是否显示标签
+    
+    # 新增标题自定义参数
+    show_title = data.get('showTitle', True)  # 是否显示标题
+    custom_title = data.get('customTitle', '').strip()  # 自定义标题
+    title_font_size = int(data.get('titleFontSize', 15))  # 标题字体大小
+    
+    # 新增经纬度显示参数
+    show_coordinates = data.get('showCoordinates', False)  # 是否显示经纬度
+    coordinates_font_size = int(data.get('coordinatesFontSize', 8))  # 经纬度字体大小
+    
+    # 新增比例尺显示参数
+    show_scale_bar = data.get('showScaleBar', False)  # 是否显示比例尺
+    scale_bar_style = data.get('scaleBarStyle', 'default')  # 比例尺样式
+    scale_bar_location = data.get('scaleBarLocation', 'lower right')  # 比例尺位置
+    scale_bar_font_size = int(data.get('scaleBarFontSize', 12))  # 比例尺字体大小
+    
+    # 新增本地保存控制参数
+    save_local = data.get('saveLocal', False)  # 是否保存到本地文件系统
+    
+    # 地图投影
+    projection = data.get('projection', DEFAULT_PROJECTION)  # lcc, albers, mercator, geographic
+    
+    # 分级统计图参数（数据可以是JSON，也可以是上传的CSV/Parquet文件）
+    choropleth = data.get('choropleth')
+    
+    # 叠加更粗级别的边界（如县级地图上叠加省界、市界）
+    overlay_levels = data.get('overlayLevels') or []
+    if isinstance(overlay_levels, str):
+        overlay_levels = [overlay_levels]
+    overlay_color = data.get('overlayColor', '#555555')  # 叠加边界线颜色
+    overlay_width = float(data.get('overlayWidth', 1.0))  # 叠加的省界线宽
+    
+    # 点数据图层（数据可以是JSON，也可以是上传的CSV/Parquet文件）
+    points = data.get('points')
+    
+    # 按邻接关系自动着色（相邻区域颜色不同），以及突出显示某个区域的相邻区域
+    auto_color = bool(data.get('autoColor', False))
+    auto_color_palette = data.get('autoColorPalette') or None
+    highlight_neighbors = (data.get('highlightNeighbors') or '').strip()
+    neighbor_color = data.get('neighborColor', '#FFC300')
+    
+    # 输出尺寸（像素），默认4800×2700；缩略图可以只指定宽度，例如800
+    width = int(data['width']) if data.get('width') else None
+    height = int(data['height']) if data.get('height') else None
+    
+    return dict(
+        map_type=map_type, 
+        region_name=region_name,
+        highlight_regions=highlight_regions,  # 传递多区域数组
+        base_color=base_color,
+        border_color=border_color,
+        border_width=border_width,
+        show_labels=show_labels,
+        showTitle=show_title,
+        customTitle=custom_title,
+        titleFontSize=title_font_size,
+        showCoordinates=show_coordinates,
+        coordinatesFontSize=coordinates_font_size,
+        showScaleBar=show_scale_bar,
+        scaleBarStyle=scale_bar_style,
+        scaleBarLocation=scale_bar_location,
+        scaleBarFontSize=scale_bar_font_size,
+        save_local=save_local,
+        projection=projection,
+        choropleth=choropleth,
+        overlayLevels=overlay_levels,
+        overlayColor=overlay_color,
+        overlayWidth=overlay_width,
+        autoColor=auto_color,
+        autoColorPalette=auto_color_palette,
+        highlightNeighbors=highlight_neighbors,
+        neighborColor=neighbor_color,
+        points=points,
+        width=width,
+        height=height
+    )
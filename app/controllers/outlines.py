@@ -0,0 +1,213 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+from matplotlib.collections import LineCollection
+
+from app.controllers.shared_geometry import RaggedGeometry
+
+# 级别从粗到细的顺序，只能在细级别的地图上叠加更粗级别的边界
+LEVEL_RANK = {'省': 0, '市': 1, '县': 2}
+# 合并区域时使用的分组字段（优先使用代码，名称可能重名）
+OVERLAY_GROUP_FIELDS = {
+    '省': ('省代码', '省'),
+    '市': ('市代码', '市'),
+}
+# 叠加边界线宽（相对overlayWidth的比例），省界比市界粗
+OVERLAY_WIDTH_RATIOS = {'省': 1.0, '市': 0.6}
+
+# 化简级别：容差为数据范围（长边）的比例。全国地图上一个像素约3公里，不需要完整精度
+SIMPLIFY_LEVELS = {
+    'national': 1 / 4000,
+    'regional': 1 / 40000,
+    # 高负载时的低质量全国地图（见 quality.py）
+    'coarse': 1 / 1500,
+}
+# 进程内缓存的合并边界和化简几何数量（每个“数据集 × 叠加级别 × 化简级别”组合一项）
+OUTLINE_CACHE_SIZE = int(os.environ.get('OUTLINE_CACHE_SIZE', 12))
+
+_outlines = OrderedDict()
+_outlines_lock = threading.Lock()
+# 正在后台生成的化简几何
+_pending = set()
+
+
+def overlay_levels_for(map_type, levels):
+    """
+    检查叠加级别，只保留比地图级别更粗的级别，按从细到粗排序（粗边界绘制在上层）
+
+    参数:
+        map_type (str): 地图级别
+        levels (list): 请求的叠加级别，如 ['省', '市']
+
+    返回:
+        list: 有效的叠加级别
+    """
+    valid = []
+    for level in levels or []:
+        if level not in LEVEL_RANK:
+            raise ValueError(f"不支持的叠加级别: {level}，可选: {', '.join(OVERLAY_GROUP_FIELDS)}")
+        if LEVEL_RANK[level] >= LEVEL_RANK[map_type]:
+            print(f"{map_type}级地图不能叠加{level}级边界，已忽略")
+            continue
+        if level not in valid:
+            valid.append(level)
+    return sorted(valid, key=LEVEL_RANK.get, reverse=True)
+
+
+def group_field(attributes, level):
+    """合并为某一级别时使用的分组字段"""
+    for field in OVERLAY_GROUP_FIELDS[level]:
+        if field in attributes.columns:
+            return field
+    raise ValueError(f"数据中缺少{level}级分组字段（{', '.join(OVERLAY_GROUP_FIELDS[level])}）")
+
+
+def _line_arrays(geometry):
+    """将边界线拆分为坐标数组列表"""
+    return [shapely.get_coordinates(part) for part in shapely.get_parts(geometry) if not part.is_empty]
+
+
+def _build_outlines(dataset, level, simplify_level):
+    """按分组字段合并区域，整体化简后取边界线"""
+    attributes = dataset.attributes
+    field = group_field(attributes, level)
+    groups = attributes.groupby(field, sort=False).indices
+
+    geometries = dataset.geometry.to_shapely(np.arange(len(attributes)))
+    keys = list(groups)
+    dissolved = np.array([shapely.union_all(geometries[groups[key]]) for key in keys], dtype=object)
+
+    xmin, ymin, xmax, ymax = dataset.geometry.total_bounds(np.arange(len(attributes)))
+    tolerance = max(xmax - xmin, ymax - ymin) * SIMPLIFY_LEVELS[simplify_level]
+    try:
+        # 整体化简：相邻区域的公共边只化简一次，化简后仍然重合
+        simplified = shapely.coverage_simplify(dissolved, tolerance)
+    except Exception as e:
+        print(f"整体化简{level}级边界失败，改为逐个化简: {str(e)}")
+        simplified = shapely.simplify(dissolved, tolerance, preserve_topology=True)
+
+    outlines = {key: _line_arrays(shapely.boundary(geometry)) for key, geometry in zip(keys, simplified)}
+    print(f"已生成{dataset.map_type}级数据的{level}级合并边界: {len(outlines)}个区域, 化简级别 {simplify_level}")
+    return outlines
+
+
+def _cache_get(key, dataset):
+    """读取缓存（数据集重新加载后，例如源文件更新，不再使用旧的结果）"""
+    with _outlines_lock:
+        cached = _outlines.get(key)
+        if cached is not None and cached[0] is dataset:
+            _outlines.move_to_end(key)
+            return cached[1]
+    return None
+
+
+def _cache_put(key, dataset, value):
+    with _outlines_lock:
+        _outlines[key] = (dataset, value)
+        _outlines.move_to_end(key)
+        while len(_outlines) > OUTLINE_CACHE_SIZE:
+            _outlines.popitem(last=False)
+
+
+def get_dissolved_outlines(dataset, level, simplify_level):
+    """
+    获取数据集按某一级别合并后的边界线（按数据集、级别和化简级别缓存）
+
+    参数:
+        dataset (ProjectedDataset): 投影后的数据集（例如县级数据）
+        level (str): 合并到的级别，'省' 或 '市'
+        simplify_level (str): 化简级别，见 SIMPLIFY_LEVELS
+
+    返回:
+        dict: 分组字段的值 -> 边界线坐标数组列表
+    """
+    key = (dataset.map_type, dataset.projection, level, simplify_level)
+    outlines = _cache_get(key, dataset)
+    if outlines is None:
+        outlines = _build_outlines(dataset, level, simplify_level)
+        _cache_put(key, dataset, outlines)
+    return outlines
+
+
+def _build_simplified_geometry(dataset, simplify_level):
+    """整体化简数据集中的全部区域（相邻区域之间不产生缝隙）"""
+    positions = np.arange(len(dataset))
+    geometries = dataset.geometry.to_shapely(positions)
+    xmin, ymin, xmax, ymax = dataset.geometry.total_bounds(positions)
+    tolerance = max(xmax - xmin, ymax - ymin) * SIMPLIFY_LEVELS[simplify_level]
+    try:
+        simplified = shapely.coverage_simplify(geometries, tolerance)
+    except Exception as e:
+        print(f"整体化简{dataset.map_type}级区域失败，改为逐个化简: {str(e)}")
+        simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+    geometry = RaggedGeometry.from_geometries(simplified)
+    print(f"已生成{dataset.map_type}级数据的化简几何: 化简级别 {simplify_level}, "
+          f"顶点 {len(dataset.geometry.coords)} -> {len(geometry.coords)}")
+    return geometry
+
+
+def get_simplified_geometry(dataset, simplify_level, wait=False):
+    """
+    获取数据集化简后的区域几何（用于高负载时的低质量渲染，按数据集和化简级别缓存）
+
+    首次请求时默认在后台线程中生成并返回None，调用方先使用原始几何，避免在负载高时再增加一次耗时的化简。
+
+    参数:
+        dataset (ProjectedDataset): 投影后的数据集
+        simplify_level (str): 化简级别，见 SIMPLIFY_LEVELS
+        wait (bool): 为True时在当前线程中生成
+
+    返回:
+        RaggedGeometry 或 None: 与dataset.geometry位置一一对应的化简几何；尚未生成时为None
+    """
+    key = (dataset.map_type, dataset.projection, 'regions', simplify_level)
+    geometry = _cache_get(key, dataset)
+    if geometry is not None:
+        return geometry
+
+    def build():
+        try:
+            _cache_put(key, dataset, _build_simplified_geometry(dataset, simplify_level))
+        except Exception as e:
+            print(f"生成{dataset.map_type}级化简几何时出错: {str(e)}")
+        finally:
+            with _outlines_lock:
+                _pending.discard(key)
+
+    if wait:
+        build()
+        return _cache_get(key, dataset)
+
+    with _outlines_lock:
+        if key in _pending:
+            return None
+        _pending.add(key)
+    threading.Thread(target=build, name=f"simplify-{dataset.map_type}-{simplify_level}", daemon=True).start()
+    return None
+
+
+def build_outline_collection(dataset, gdf, level, simplify_level, color, linewidth, zorder=2.5):
+    """
+    为地图中出现的区域绘制合并后的边界线
+
+    参数:
+        dataset (ProjectedDataset): 地图使用的数据集
+        gdf (DataFrame): 筛选后的属性表
+        level (str): 叠加级别
+        simplify_level (str): 化简级别
+        color: 线条颜色
+        linewidth (float): 线条宽度
+        zorder (float): 绘制层级（高亮覆盖层之上、标签之下）
+
+    返回:
+        LineCollection: 边界线集合
+    """
+    outlines = get_dissolved_outlines(dataset, level, simplify_level)
+    segments = []
+    for key in gdf[group_field(gdf, level)].unique():
+        segments.extend(outlines.get(key, ()))
+    return LineCollection(segments, colors=color, linewidths=linewidth, zorder=zorder,
+                          capstyle='round', joinstyle='round')
@@ -0,0 +1,309 @@
+import os
+from functools import lru_cache
+
+import matplotlib
+import numpy as np
+import pandas as pd
+import shapely
+from matplotlib.colors import LogNorm, Normalize
+from pyproj import Transformer
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # 只在上传Parquet文件时需要
+    pq = None
+
+from app.controllers.boundary_store import get_projection_crs
+
+# 点数据的显示方式：逐点绘制、六边形格网汇总、方形格网汇总、按行政区汇总
+POINT_MODES = ('scatter', 'hexbin', 'grid', 'regions')
+DEFAULT_POINT_MODE = 'scatter'
+DEFAULT_POINT_COLOR = '#D7301F'
+DEFAULT_POINT_SIZE = 2.0  # 点的面积（磅²，与matplotlib的scatter相同）
+DEFAULT_POINT_ALPHA = 0.6
+DEFAULT_GRID_SIZE = 80  # 格网汇总时沿地图宽度方向的格子数
+MAX_GRID_SIZE = 500
+# 单个请求的点数上限
+MAX_POINTS = int(os.environ.get('MAX_POINTS', 5_000_000))
+# 读取上传文件时每批的行数（只保留经纬度和权重列，内存与行数成正比而与文件大小无关）
+POINT_CHUNK_ROWS = 200_000
+# 点图层的绘制顺序：在底图、高亮和叠加边界之上，标签之下
+POINT_ZORDER = 2.8
+
+# 可识别的列名（不区分大小写）
+_LON_COLUMNS = ('lon', 'lng', 'longitude', 'x', '经度')
+_LAT_COLUMNS = ('lat', 'latitude', 'y', '纬度')
+_WEIGHT_COLUMNS = ('weight', 'value', 'count', '权重')
+
+
+def _find_column(columns, candidates):
+    """按候选名称查找列（不区分大小写），找不到时返回None"""
+    lookup = {str(column).strip().lower(): column for column in columns}
+    for candidate in candidates:
+        if candidate in lookup:
+            return lookup[candidate]
+    return None
+
+
+def _table_arrays(table):
+    """从数据表中取出经度、纬度和权重数组"""
+    lon_column = _find_column(table.columns, _LON_COLUMNS)
+    lat_column = _find_column(table.columns, _LAT_COLUMNS)
+    if lon_column is None or lat_column is None:
+        raise ValueError(f"点数据需要包含经度列（{'/'.join(_LON_COLUMNS)}）和纬度列（{'/'.join(_LAT_COLUMNS)}）")
+    weight_column = _find_column(table.columns, _WEIGHT_COLUMNS)
+    lon = pd.to_numeric(table[lon_column], errors='coerce').to_numpy(dtype=np.float64)
+    lat = pd.to_numeric(table[lat_column], errors='coerce').to_numpy(dtype=np.float64)
+    weight = (pd.to_numeric(table[weight_column], errors='coerce').to_numpy(dtype=np.float64)
+              if weight_column is not None else None)
+    return lon, lat, weight
+
+
+def _read_tables(file):
+    """按批读取上传的CSV或Parquet文件，只读取经纬度和权重列"""
+    filename = (file.filename or '').lower()
+    wanted = {*_LON_COLUMNS, *_LAT_COLUMNS, *_WEIGHT_COLUMNS}
+    if filename.endswith('.parquet'):
+        if pq is None:
+            raise ValueError("读取Parquet文件需要安装 pyarrow")
+        parquet = pq.ParquetFile(file.stream)
+        columns = [name for name in parquet.schema_arrow.names if name.strip().lower() in wanted]
+        for batch in parquet.iter_batches(batch_size=POINT_CHUNK_ROWS, columns=columns):
+            yield batch.to_pandas()
+    elif filename.endswith('.csv') or filename.endswith('.txt'):
+        yield from pd.read_csv(file.stream, chunksize=POINT_CHUNK_ROWS,
+                               usecols=lambda name: str(name).strip().lower() in wanted)
+    else:
+        raise ValueError("只支持CSV或Parquet格式的点数据文件")
+
+
+def read_point_chunks(file):
+    """
+    按批读取上传的点数据文件（点数据图层和批量查询所在区域共用）
+
+    参数:
+        file: 上传的CSV或Parquet文件（werkzeug FileStorage）
+
+    返回:
+        generator: 每批 (经度数组, 纬度数组, 权重数组或None)，坐标无法解析时为nan
+    """
+    for table in _read_tables(file):
+        yield _table_arrays(table)
+
+
+def load_point_table(records=None, file=None):
+    """
+    读取点数据（经纬度，可带权重）
+
+    参数:
+        records: JSON数据，可以是 [[经度, 纬度], ...]、[[经度, 纬度, 权重], ...]、
+            [{'lon': ..., 'lat': ..., 'weight': ...}, ...] 或 {'lon': [...], 'lat': [...], 'weight': [...]}
+        file: 上传的CSV或Parquet文件（werkzeug FileStorage），按批读取
+
+    返回:
+        DataFrame: lon、lat列（float64）和可选的weight列，已去掉坐标无效的点
+    """
+    if file is not None:
+        parts, total = [], 0
+        for arrays in read_point_chunks(file):
+            total += len(arrays[0])
+            if total > MAX_POINTS:
+                raise ValueError(f"点数据不能超过{MAX_POINTS}个")
+            parts.append(arrays)
+        if not parts:
+            raise ValueError("点数据文件为空")
+        lon, lat = np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts])
+        weight = (np.concatenate([part[2] for part in parts]) if parts[0][2] is not None else None)
+    elif isinstance(records, pd.DataFrame):
+        lon, lat, weight = _table_arrays(records)
+    elif isinstance(records, dict):
+        lon, lat, weight = _table_arrays(pd.DataFrame(records))
+    elif isinstance(records, list):
+        if records and isinstance(records[0], (list, tuple)):
+            try:
+                array = np.asarray(records, dtype=np.float64)
+            except ValueError:
+                array = None
+            if array is None or array.ndim != 2 or array.shape[1] not in (2, 3):
+                raise ValueError("点数据的每一项必须是 [经度, 纬度] 或 [经度, 纬度, 权重]")
+            lon, lat = array[:, 0], array[:, 1]
+            weight = array[:, 2] if array.shape[1] == 3 else None
+        else:
+            lon, lat, weight = _table_arrays(pd.DataFrame.from_records(records))
+    else:
+        raise ValueError("点数据必须是列表、字典或上传的文件")
+
+    if len(lon) > MAX_POINTS:
+        raise ValueError(f"点数据不能超过{MAX_POINTS}个")
+    valid = np.isfinite(lon) & np.isfinite(lat) & (np.abs(lon) <= 180) & (np.abs(lat) <= 90)
+    table = pd.DataFrame({'lon': lon[valid], 'lat': lat[valid]})
+    if weight is not None:
+        table['weight'] = np.nan_to_num(weight[valid])
+    if not valid.all():
+        print(f"忽略 {int((~valid).sum())} 个坐标无效的点")
+    return table
+
+
+def point_count(options):
+    """点数据的数量（用于估算渲染成本，不读取数据）"""
+    if not options:
+        return 0
+    table = options.get('table')
+    if table is not None:
+        return len(table)
+    data = options.get('data')
+    if isinstance(data, dict):
+        return max((len(values) for values in data.values() if isinstance(values, list)), default=0)
+    return len(data) if isinstance(data, list) else 0
+
+
+@lru_cache(maxsize=None)
+def _transformer(projection):
+    """经纬度到地图投影的坐标转换（每种投影只创建一次）"""
+    return Transformer.from_crs('EPSG:4326', get_projection_crs(projection), always_xy=True)
+
+
+def project_points(lon, lat, projection):
+    """一次向量化的坐标转换，把经纬度数组转换为投影坐标"""
+    x, y = _transformer(projection).transform(lon, lat)
+    return np.asarray(x), np.asarray(y)
+
+
+def locate_points(geometries, x, y, bounds=None):
+    """
+    向量化的点落区查询
+
+    点按x坐标排序一次，每个区域先用范围在排序数组上二分查找出候选点，再用预处理后的区域几何
+    一次判断全部候选点（shapely.intersects_xy，不为每个点创建几何对象）。
+    总耗时与候选点数成正比，百万个点对全国县级数据不到一秒。落在公共边上的点归入位置靠前的区域。
+
+    参数:
+        geometries (ndarray): 区域的Shapely几何数组（会被预处理）
+        x, y (ndarray): 点坐标（与区域使用同一坐标系）
+        bounds (ndarray, optional): 预先计算的区域范围 (R, 4)
+
+    返回:
+        ndarray: 每个点所在区域在geometries中的位置，不在任何区域中的点为-1
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    result = np.full(len(x), -1, dtype=np.int64)
+    if not len(x) or not len(geometries):
+        return result
+    order = np.argsort(x, kind='stable')
+    sorted_x, sorted_y = x[order], y[order]
+    if bounds is None:
+        bounds = shapely.bounds(geometries)
+    shapely.prepare(geometries)
+
+    # 逆序处理，同一个点命中多个区域时保留位置最小的区域
+    for position in range(len(geometries) - 1, -1, -1):
+        x_min, y_min, x_max, y_max = bounds[position]
+        if np.isnan(x_min):
+            continue
+        start = np.searchsorted(sorted_x, x_min, side='left')
+        end = np.searchsorted(sorted_x, x_max, side='right')
+        strip_y = sorted_y[start:end]
+        candidates = np.flatnonzero((strip_y >= y_min) & (strip_y <= y_max)) + start
+        if not len(candidates):
+            continue
+        hit = shapely.intersects_xy(geometries[position], sorted_x[candidates], sorted_y[candidates])
+        result[order[candidates[hit]]] = position
+    return result
+
+
+def prepare_points(options, projection):
+    """
+    读取点数据并投影
+
+    返回:
+        tuple: (x, y, 权重或None)
+    """
+    table = options.get('table')
+    if table is None:
+        table = load_point_table(options.get('data'))
+    x, y = project_points(table['lon'].to_numpy(), table['lat'].to_numpy(), projection)
+    weight = table['weight'].to_numpy() if 'weight' in table.columns else None
+    print(f"点数据: {len(x)} 个点")
+    return x, y, weight
+
+
+def point_mode(options):
+    """检查并返回点数据的显示方式"""
+    mode = options.get('mode') or DEFAULT_POINT_MODE
+    if mode not in POINT_MODES:
+        raise ValueError(f"不支持的点数据显示方式: {mode}，可选: {', '.join(POINT_MODES)}")
+    return mode
+
+
+def aggregate_to_regions(dataset, gdf, x, y, weight=None):
+    """
+    按区域汇总点数（或权重之和）
+
+    返回:
+        ndarray: 与gdf行顺序一致的汇总值
+    """
+    located = locate_points(dataset.geometry.to_shapely(gdf.index), x, y)
+    inside = located >= 0
+    print(f"点数据按区域汇总: {int(inside.sum())}/{len(located)} 个点落在地图区域内")
+    return np.bincount(located[inside], weights=None if weight is None else weight[inside],
+                       minlength=len(gdf)).astype(np.float64)
+
+
+def _grid_size(options):
+    size = int(options.get('gridSize') or DEFAULT_GRID_SIZE)
+    return max(1, min(size, MAX_GRID_SIZE))
+
+
+def _norm(options):
+    return LogNorm() if options.get('logScale') else Normalize()
+
+
+def draw_points(ax, x, y, weight, options):
+    """
+    在当前视图范围内绘制点图层（需在设置视图范围之后调用）
+
+    - scatter: 所有点作为一个集合绘制
+    - hexbin / grid: 按六边形或方形格网汇总后绘制，颜色表示点数（或权重之和）
+
+    返回:
+        Artist 或 None: 点图层；格网汇总时视图范围内没有点则不绘制
+    """
+    mode = point_mode(options)
+    xlim, ylim = ax.get_xlim(), ax.get_ylim()
+    x_min, x_max = sorted(xlim)
+    y_min, y_max = sorted(ylim)
+    # 只绘制视图范围内的点（区域地图通常只需要其中一小部分）
+    visible = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+    x, y = x[visible], y[visible]
+    weight = weight[visible] if weight is not None else None
+    alpha = float(options.get('alpha', DEFAULT_POINT_ALPHA))
+    cmap = matplotlib.colormaps.get(options.get('cmap') or 'YlOrRd')
+    if cmap is None:
+        raise ValueError(f"不支持的色带: {options.get('cmap')}")
+
+    if mode == 'scatter':
+        artist = ax.scatter(x, y, s=float(options.get('size', DEFAULT_POINT_SIZE)),
+                            c=options.get('color', DEFAULT_POINT_COLOR), alpha=alpha,
+                            linewidths=0, marker='o', zorder=POINT_ZORDER)
+    elif mode == 'hexbin' and not len(x):
+        # 没有点时hexbin无法确定色阶范围（线性色阶会报错），不绘制
+        artist = None
+    elif mode == 'hexbin':
+        artist = ax.hexbin(x, y, C=weight, reduce_C_function=np.sum, gridsize=_grid_size(options),
+                           extent=(x_min, x_max, y_min, y_max), mincnt=1 if weight is None else None,
+                           cmap=cmap, norm=_norm(options), alpha=alpha, linewidths=0, zorder=POINT_ZORDER)
+    else:
+        nx = _grid_size(options)
+        cell = (x_max - x_min) / nx
+        ny = max(1, int(np.ceil((y_max - y_min) / cell)))
+        counts, _, _ = np.histogram2d(x, y, bins=(nx, ny), weights=weight,
+                                      range=((x_min, x_min + nx * cell), (y_min, y_min + ny * cell)))
+        artist = ax.imshow(np.ma.masked_equal(counts.T, 0), origin='lower', interpolation='nearest',
+                           extent=(x_min, x_min + nx * cell, y_min, y_min + ny * cell),
+                           cmap=cmap, norm=_norm(options), alpha=alpha, zorder=POINT_ZORDER,
+                           aspect=ax.get_aspect())
+    # 格网图层不改变已经设置的视图范围
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+    print(f"[OK] 已绘制点图层（{mode}）: 视图范围内 {len(x)} 个点")
+    return artist
@@ -0,0 +1,401 @@
+import os
+import struct
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection, PathCollection
+
+from app.controllers.map_controller import build_map_figure, build_map_filename, MAPS_OUTPUT_FOLDER
+from app.controllers.layout import resolve_output_size
+from app.controllers.storage import get_map_storage
+from app.controllers.render_cache import lookup_render
+from app.controllers.coalescing import get_single_flight, process_lock
+from app.controllers.admission import check_deadline, estimate_render_cost, get_admission_controller
+from app.controllers.telemetry import record_render
+
+# 大幅面输出的尺寸上限（Agg单边不能超过65535像素）
+POSTER_MAX_SIDE = int(os.environ.get('POSTER_MAX_SIDE', 60000))
+POSTER_MAX_PIXELS = int(os.environ.get('POSTER_MAX_PIXELS', 600_000_000))
+# 每个条带的栅格缓冲区大小上限（MB），决定条带高度，即渲染时的峰值内存
+POSTER_STRIP_MB = float(os.environ.get('POSTER_STRIP_MB', 64))
+# 条带高度下限（像素）
+MIN_STRIP_ROWS = 16
+
+# 支持的大幅面格式及扩展名
+POSTER_FORMATS = {
+    'png': 'png',
+    'tiff': 'tif',
+}
+# 压缩级别（大图的编码时间主要取决于压缩级别）
+_COMPRESS_LEVEL = 6
+
+
+def strip_rows_for(width):
+    """按缓冲区大小上限计算条带高度（RGBA，每像素4字节）"""
+    return max(MIN_STRIP_ROWS, int(POSTER_STRIP_MB * 1024 * 1024 // (width * 4)))
+
+
+def _sub_filter(rows):
+    """水平差分：每个字节减去左侧像素的同一通道（与PNG的Sub滤波、TIFF的Predictor 2相同）"""
+    filtered = np.empty_like(rows)
+    filtered[:, :3] = rows[:, :3]
+    np.subtract(rows[:, 3:], rows[:, :-3], out=filtered[:, 3:])
+    return filtered
+
+
+class StreamingPNGWriter:
+    """
+    逐条带写入的PNG编码器（8位RGB）
+
+    每个条带的行经过Sub滤波后送入同一个zlib压缩流，压缩后的数据随时写出为IDAT块，
+    整张图片不需要同时保存在内存中。
+    """
+
+    def __init__(self, fileobj, width, height, dpi=None):
+        self.file = fileobj
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(_COMPRESS_LEVEL)
+
+        fileobj.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        if dpi:
+            # 物理尺寸（每米像素数），打印时按原尺寸输出
+            pixels_per_metre = round(dpi / 0.0254)
+            self._chunk(b'pHYs', struct.pack('>IIB', pixels_per_metre, pixels_per_metre, 1))
+
+    def _chunk(self, chunk_type, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    def write_rows(self, rgb):
+        """
+        写入若干行像素
+
+        参数:
+            rgb (ndarray): 形状为 (行数, 宽度, 3) 的uint8数组
+        """
+        rows = rgb.reshape(len(rgb), self.width * 3)
+        scanlines = np.empty((len(rows), self.width * 3 + 1), dtype=np.uint8)
+        scanlines[:, 0] = 1  # 滤波类型: Sub
+        scanlines[:, 1:] = _sub_filter(rows)
+        data = self._compressor.compress(scanlines.tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+        self.rows_written += len(rows)
+
+    def close(self):
+        """结束压缩流并写入文件尾"""
+        if self.rows_written != self.height:
+            raise ValueError(f"PNG行数不完整: {self.rows_written}/{self.height}")
+        self._chunk(b'IDAT', self._compressor.flush())
+        self._chunk(b'IEND', b'')
+
+
+class StreamingTIFFWriter:
+    """
+    逐条带写入的TIFF编码器（8位RGB，Deflate压缩，水平差分）
+
+    每个条带单独压缩后立即写出，文件末尾写入记录各条带位置的IFD。
+    需要可以定位（seek）的文件对象，文件不能超过4GB（经典TIFF的偏移量为32位）。
+    """
+
+    def __init__(self, fileobj, width, height, rows_per_strip, dpi=None):
+        self.file = fileobj
+        self.width = width
+        self.height = height
+        self.rows_per_strip = rows_per_strip
+        self.dpi = dpi
+        self.rows_written = 0
+        self._offsets = []
+        self._byte_counts = []
+
+        # 文件头：小端序，IFD偏移量在关闭时填写
+        fileobj.write(b'II*\x00' + struct.pack('<I', 0))
+
+    def _tell(self):
+        position = self.file.tell()
+        if position >= 2 ** 32:
+            raise ValueError("TIFF文件超过4GB，请减小尺寸或使用PNG格式")
+        return position
+
+    def write_rows(self, rgb):
+        """
+        写入一个条带（除最后一个条带外，行数必须等于rows_per_strip）
+
+        参数:
+            rgb (ndarray): 形状为 (行数, 宽度, 3) 的uint8数组
+        """
+        if len(rgb) != self.rows_per_strip and self.rows_written + len(rgb) != self.height:
+            raise ValueError(f"TIFF条带行数必须为{self.rows_per_strip}")
+        data = zlib.compress(_sub_filter(rgb.reshape(len(rgb), self.width * 3)).tobytes(), _COMPRESS_LEVEL)
+        self._offsets.append(self._tell())
+        self._byte_counts.append(len(data))
+        self.file.write(data)
+        self.rows_written += len(rgb)
+
+    def _write_array(self, fmt, values):
+        """写入IFD引用的数组（字对齐），返回偏移量"""
+        if self.file.tell() % 2:
+            self.file.write(b'\x00')
+        offset = self._tell()
+        self.file.write(struct.pack(f'<{len(values)}{fmt}', *values))
+        return offset
+
+    def close(self):
+        """写入IFD并在文件头中登记其位置"""
+        if self.rows_written != self.height:
+            raise ValueError(f"TIFF行数不完整: {self.rows_written}/{self.height}")
+
+        strips = len(self._offsets)
+        entries = []  # (标签, 类型, 数量, 值或偏移量)；类型 3=SHORT, 4=LONG, 5=RATIONAL
+
+        def add_array(tag, fmt, field_type, values):
+            if len(values) == 1 and field_type in (3, 4):
+                entries.append((tag, field_type, 1, values[0]))
+            else:
+                entries.append((tag, field_type, len(values), self._write_array(fmt, values)))
+
+        entries.append((256, 4, 1, self.width))            # ImageWidth
+        entries.append((257, 4, 1, self.height))           # ImageLength
+        add_array(258, 'H', 3, [8, 8, 8])                   # BitsPerSample
+        entries.append((259, 3, 1, 8))                     # Compression: Deflate
+        entries.append((262, 3, 1, 2))                     # PhotometricInterpretation: RGB
+        add_array(273, 'I', 4, self._offsets)              # StripOffsets
+        entries.append((277, 3, 1, 3))                     # SamplesPerPixel
+        entries.append((278, 4, 1, self.rows_per_strip))   # RowsPerStrip
+        add_array(279, 'I', 4, self._byte_counts)          # StripByteCounts
+        if self.dpi:
+            resolution = (round(self.dpi * 100), 100)
+            entries.append((282, 5, 1, self._write_array('I', resolution)))  # XResolution
+            entries.append((283, 5, 1, self._write_array('I', resolution)))  # YResolution
+        entries.append((284, 3, 1, 1))                     # PlanarConfiguration: 交错存储
+        if self.dpi:
+            entries.append((296, 3, 1, 2))                 # ResolutionUnit: 英寸
+        entries.append((317, 3, 1, 2))                     # Predictor: 水平差分
+
+        if self.file.tell() % 2:
+            self.file.write(b'\x00')
+        ifd_offset = self._tell()
+        self.file.write(struct.pack('<H', len(entries)))
+        for tag, field_type, count, value in sorted(entries):
+            # SHORT类型的单个值存放在值字段的低位
+            packed = struct.pack('<HI', value, 0)[:4] if field_type == 3 and count == 1 else struct.pack('<I', value)
+            self.file.write(struct.pack('<HHI', tag, field_type, count) + packed)
+        self.file.write(struct.pack('<I', 0))
+
+        self.file.seek(4)
+        self.file.write(struct.pack('<I', ifd_offset))
+        self.file.seek(0, os.SEEK_END)
+        print(f"TIFF写入完成: {strips}个条带")
+
+
+def _path_y_ranges(collection):
+    """集合中每条路径在数据坐标中的纵向范围"""
+    ranges = np.empty((len(collection.get_paths()), 2))
+    for index, path in enumerate(collection.get_paths()):
+        ys = path.vertices[:, 1]
+        ranges[index] = (ys.min(), ys.max()) if len(ys) else (np.inf, -np.inf)
+    return ranges
+
+
+def _subset(values, count, keep):
+    """按路径筛选颜色、线宽等逐路径属性（单个值的属性保持不变）"""
+    values = np.asarray(values)
+    return values[keep] if len(values) == count and count > 1 else values
+
+
+class StripCuller:
+    """
+    条带渲染时只绘制与当前条带相交的区域和边界线
+
+    底图、高亮覆盖层和叠加边界都是数据坐标中的集合，预先计算每条路径的纵向范围，
+    每个条带临时替换为相交的路径（连同逐路径的颜色和线宽），渲染完成后恢复。
+    """
+
+    def __init__(self, ax):
+        self.ax = ax
+        self.entries = []
+        for collection in ax.collections:
+            if not isinstance(collection, (PathCollection, LineCollection)) or not collection.get_visible():
+                continue
+            if collection.get_transform() != ax.transData or np.any(collection.get_offsets()):
+                continue
+            self.entries.append((collection, collection.get_paths(), _path_y_ranges(collection),
+                                 collection.get_facecolor(), collection.get_edgecolor(),
+                                 collection.get_linewidth()))
+
+    @contextmanager
+    def clip(self, y_min, y_max):
+        """
+        临时只保留纵向范围与 [y_min, y_max] 相交的路径
+
+        参数:
+            y_min, y_max (float): 条带在数据坐标中的纵向范围（已包含线宽余量）
+        """
+        try:
+            for collection, paths, ranges, facecolor, edgecolor, linewidth in self.entries:
+                keep = np.flatnonzero((ranges[:, 1] >= y_min) & (ranges[:, 0] <= y_max))
+                self._apply(collection, [paths[i] for i in keep], len(paths), keep,
+                            facecolor, edgecolor, linewidth)
+            yield
+        finally:
+            for collection, paths, ranges, facecolor, edgecolor, linewidth in self.entries:
+                self._apply(collection, paths, len(paths), slice(None), facecolor, edgecolor, linewidth)
+
+    @staticmethod
+    def _apply(collection, paths, count, keep, facecolor, edgecolor, linewidth):
+        if isinstance(collection, LineCollection):
+            collection.set_segments([path.vertices for path in paths])
+        else:
+            collection.set_paths(paths)
+        collection.set_facecolor(_subset(facecolor, count, keep))
+        collection.set_edgecolor(_subset(edgecolor, count, keep))
+        collection.set_linewidth(_subset(linewidth, count, keep))
+
+
+def render_strips(map_figure, width, height, rows_per_strip):
+    """
+    按水平条带栅格化地图，每次只占用一个条带的缓冲区
+
+    先按完整尺寸确定地图区域在图片中的像素位置，之后每个条带把图形缩小为条带高度，
+    地图区域整体平移（整数像素），因此各条带拼接后的区域填充与一次渲染整张图片的结果相同。
+    两处例外：线条平移后的浮点舍入可能使个别像素的抗锯齿值相差1～2；
+    Agg在画布边缘裁剪路径后从裁剪处重新开始虚线图案，虚线（经纬网）在条带边界处的虚实位置与整张渲染不同。
+
+    参数:
+        map_figure (MapFigure): 已按输出尺寸设置好版式的地图图形
+        width, height (int): 输出尺寸（像素）
+        rows_per_strip (int): 条带高度（像素）
+
+    返回:
+        generator: 自上而下逐条带产生 (行数, 宽度, 3) 的uint8数组
+    """
+    fig, ax = map_figure.fig, map_figure.ax
+    dpi = fig.dpi
+    full_size = fig.get_size_inches()
+
+    # 按完整尺寸应用等比例约束，得到地图区域的最终位置（像素）
+    ax.apply_aspect()
+    position = ax.get_position()
+    left, bottom = position.x0 * width, position.y0 * height
+    axes_width, axes_height = position.width * width, position.height * height
+    to_data = ax.transData.frozen().inverted()
+    # 线宽和标记超出路径范围的余量（像素）
+    margin = 4 + max((np.max(collection.get_linewidth(), initial=0) for collection in ax.collections),
+                     default=0) * dpi / 72
+    culler = StripCuller(ax)
+
+    aspect = ax.get_aspect()
+    adjustable = ax.get_adjustable()
+    original_position = ax.get_position(original=True)
+    canvas = FigureCanvasAgg(fig)
+    # 位置已经确定，条带渲染时不再按条带的宽高比调整地图区域
+    ax.set_aspect('auto')
+    try:
+        for top in range(0, height, rows_per_strip):
+            check_deadline(f"渲染第{top // rows_per_strip + 1}个条带")
+            rows = min(rows_per_strip, height - top)
+            # 条带在完整图片中的纵向范围（像素，自下而上）
+            strip_bottom = height - top - rows
+            fig.set_size_inches(full_size[0], rows / dpi, forward=False)
+            ax.set_position([left / width, (bottom - strip_bottom) / rows, axes_width / width, axes_height / rows])
+
+            y_low = to_data.transform((0, strip_bottom - margin))[1]
+            y_high = to_data.transform((0, strip_bottom + rows + margin))[1]
+            with culler.clip(min(y_low, y_high), max(y_low, y_high)):
+                canvas.draw()
+            buffer = np.asarray(canvas.buffer_rgba())
+            yield np.ascontiguousarray(buffer[:, :, :3])
+    finally:
+        fig.set_size_inches(full_size, forward=False)
+        ax.set_aspect(aspect, adjustable=adjustable)
+        ax.set_position(original_position)
+
+
+def write_poster(map_figure, fileobj, width, height, output_format='png'):
+    """
+    将地图按条带渲染并流式编码到文件
+
+    参数:
+        map_figure (MapFigure): 地图图形
+        fileobj: 以二进制写入方式打开的文件（TIFF需要可以定位）
+        width, height (int): 输出尺寸（像素）
+        output_format (str): 'png' 或 'tiff'
+    """
+    rows_per_strip = strip_rows_for(width)
+    map_figure.set_output_size(width, height)
+    dpi = map_figure.fig.dpi
+    if output_format == 'tiff':
+        writer = StreamingTIFFWriter(fileobj, width, height, rows_per_strip, dpi)
+    else:
+        writer = StreamingPNGWriter(fileobj, width, height, dpi)
+
+    print(f"开始条带渲染: {width}×{height}, 每条带{rows_per_strip}行, 共{-(-height // rows_per_strip)}个条带")
+    for strip in render_strips(map_figure, width, height, rows_per_strip):
+        writer.write_rows(strip)
+    writer.close()
+
+
+def generate_poster(output_format='png', save_local=True, **map_kwargs):
+    """
+    生成大幅面地图（如20000像素以上的印刷用县级地图）
+
+    按水平条带渲染并流式写入PNG或TIFF文件，峰值内存只与条带大小（POSTER_STRIP_MB）有关，与输出尺寸无关。
+    结果总是保存到地图存储中（图片过大，不适合Base64返回）。
+
+    参数:
+        output_format (str): 'png' 或 'tiff'
+        save_local (bool): 忽略，大幅面地图总是保存
+        **map_kwargs: 地图参数（与generate_map相同），width/height为输出尺寸
+
+    返回:
+        str: 保存后的相对路径
+    """
+    if output_format not in POSTER_FORMATS:
+        raise ValueError(f"不支持的大幅面格式: {output_format}，可选: {', '.join(POSTER_FORMATS)}")
+    width, height = resolve_output_size(map_kwargs.get('width'), map_kwargs.get('height'),
+                                        max_side=POSTER_MAX_SIDE, max_pixels=POSTER_MAX_PIXELS)
+    map_kwargs['width'], map_kwargs['height'] = width, height
+    extension = POSTER_FORMATS[output_format]
+
+    storage = get_map_storage(MAPS_OUTPUT_FOLDER)
+    cache_alias, cached_path = lookup_render(storage, map_kwargs, extension)
+    if cached_path:
+        print(f"使用已缓存的大幅面地图: {cache_alias}")
+        return f"maps/{cache_alias}"
+
+    def render_poster():
+        # 图形按默认尺寸构建（构建与输出尺寸无关），输出前再设置为大幅面尺寸
+        build_kwargs = dict(map_kwargs, width=None, height=None)
+        path = storage.temp_path(f".{extension}")
+        try:
+            with get_admission_controller().admit(estimate_render_cost(map_kwargs), f"大幅面 {width}×{height}"), \
+                    record_render('poster'):
+                map_figure = build_map_figure(**build_kwargs)
+                with open(path, 'wb') as f:
+                    write_poster(map_figure, f, width, height, output_format)
+            filename = cache_alias or build_map_filename(map_figure, map_kwargs.get('highlight_regions'), extension)
+            digest = storage.put_file(path, filename)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        print(f"大幅面地图生成成功，保存至: {filename} (内容 {digest[:12]})")
+        return f"maps/{filename}"
+
+    def render_shared():
+        with process_lock(cache_alias):
+            if storage.resolve(cache_alias):
+                print(f"使用其他进程渲染的大幅面地图: {cache_alias}")
+                return f"maps/{cache_alias}"
+            return render_poster()
+
+    if cache_alias:
+        return get_single_flight().do(cache_alias, render_shared)
+    return render_poster()
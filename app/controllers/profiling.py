@@ -0,0 +1,163 @@
+import os
+import re
+import io
+import time
+import uuid
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+
+# 性能分析结果保存目录及数量上限（超过上限时删除最旧的分析结果）
+PROFILES_FOLDER = os.environ.get('PROFILES_FOLDER', 'profiles')
+PROFILES_MAX_COUNT = int(os.environ.get('PROFILES_MAX_COUNT', 20))
+# 报告中列出的函数数量和内存分配位置数量
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_TOP_ALLOCATIONS = 25
+
+# 分析结果文件名格式：{profile_id}.prof / {profile_id}.txt
+_PROFILE_FILE_PATTERN = re.compile(r'^[0-9]{8}_[0-9]{6}_[0-9a-f]{8}\.(prof|txt)$')
+
+# tracemalloc是进程级的，同一时间只允许一个请求进行性能分析
+_profile_lock = threading.Lock()
+
+
+def run_profiled(func, *args, label='', **kwargs):
+    """
+    在cProfile和tracemalloc下执行一次函数调用，并将分析结果写入PROFILES_FOLDER
+
+    如果已有其他请求正在分析，则直接执行函数而不做分析。
+
+    参数:
+        func: 要执行的函数
+        label (str): 写入报告头部的说明文字
+        *args, **kwargs: 传递给func的参数
+
+    返回:
+        tuple: (函数返回值, profile_id)，未进行分析时profile_id为None
+    """
+    if not _profile_lock.acquire(blocking=False):
+        print("已有请求正在进行性能分析，本次请求不做分析")
+        return func(*args, **kwargs), None
+
+    try:
+        profile_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+        # 如果tracemalloc已经由其他途径启用，则不在结束时关闭它
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start(10)
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.take_snapshot()
+
+        profiler = cProfile.Profile()
+        start_time = time.perf_counter()
+        profiler.enable()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start_time
+            snapshot = tracemalloc.take_snapshot()
+            current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            if started_tracemalloc:
+                tracemalloc.stop()
+
+            try:
+                _write_profile(profile_id, label, profiler, baseline, snapshot,
+                               elapsed, current_bytes, peak_bytes)
+                _prune_profiles()
+                print(f"性能分析结果已保存: {profile_id} (耗时 {elapsed:.2f}s)")
+            except Exception as e:
+                print(f"保存性能分析结果时出错: {str(e)}")
+                profile_id = None
+
+        return result, profile_id
+    finally:
+        _profile_lock.release()
+
+
+def _write_profile(profile_id, label, profiler, baseline, snapshot,
+                   elapsed, current_bytes, peak_bytes):
+    """将cProfile数据和内存分配报告写入磁盘"""
+    os.makedirs(PROFILES_FOLDER, exist_ok=True)
+
+    # 原始cProfile数据，可用 snakeviz / pstats 打开
+    profiler.dump_stats(os.path.join(PROFILES_FOLDER, f"{profile_id}.prof"))
+
+    # 文本报告：耗时最多的函数 + 新增内存最多的分配位置
+    stats_stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stats_stream)
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+
+    allocation_lines = []
+    for stat in snapshot.compare_to(baseline, 'lineno')[:PROFILE_TOP_ALLOCATIONS]:
+        frame = stat.traceback[0]
+        allocation_lines.append(
+            f"{stat.size_diff / 1024:10.1f} KiB  {stat.count_diff:8d} 块  "
+            f"{frame.filename}:{frame.lineno}"
+        )
+
+    report_path = os.path.join(PROFILES_FOLDER, f"{profile_id}.txt")
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write(f"性能分析: {profile_id}\n")
+        if label:
+            f.write(f"请求: {label}\n")
+        f.write(f"总耗时: {elapsed:.3f} s\n")
+        f.write(f"内存: 结束时 {current_bytes / 1024 / 1024:.1f} MiB, "
+                f"峰值 {peak_bytes / 1024 / 1024:.1f} MiB\n\n")
+        f.write("=== 新增内存最多的分配位置 ===\n")
+        f.write('\n'.join(allocation_lines) + '\n\n')
+        f.write("=== 累计耗时最多的函数 ===\n")
+        f.write(stats_stream.getvalue())
+
+
+def _prune_profiles():
+    """只保留最新的PROFILES_MAX_COUNT份分析结果"""
+    profile_ids = sorted({name.rsplit('.', 1)[0] for name in os.listdir(PROFILES_FOLDER)
+                          if _PROFILE_FILE_PATTERN.match(name)})
+    stale_ids = profile_ids[:max(len(profile_ids) - PROFILES_MAX_COUNT, 0)]
+    for old_id in stale_ids:
+        for ext in ('prof', 'txt'):
+            try:
+                os.remove(os.path.join(PROFILES_FOLDER, f"{old_id}.{ext}"))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    """
+    列出已保存的性能分析结果
+
+    返回:
+        list: 按时间倒序排列的结果，每项包含文件名、大小和修改时间
+    """
+    if not os.path.isdir(PROFILES_FOLDER):
+        return []
+
+    profiles = []
+    for name in os.listdir(PROFILES_FOLDER):
+        if not _PROFILE_FILE_PATTERN.match(name):
+            continue
+        path = os.path.join(PROFILES_FOLDER, name)
+        stat = os.stat(path)
+        profiles.append({
+            'name': name,
+            'size': stat.st_size,
+            'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds')
+        })
+    return sorted(profiles, key=lambda p: p['name'], reverse=True)
+
+
+def get_profile_path(name):
+    """
+    获取分析结果文件的路径，文件名不合法或不存在时返回None
+
+    参数:
+        name (str): 文件名，如 '20250101_120000_abcdef12.prof'
+    """
+    if not _PROFILE_FILE_PATTERN.match(name or ''):
+        return None
+    path = os.path.join(PROFILES_FOLDER, name)
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from app.controllers.admission import get_admission_controller
+
+# 是否在负载高时降低渲染质量（设为0时总是以完整质量渲染）
+QUALITY_DEGRADE_ENABLED = os.environ.get('QUALITY_DEGRADE', '1') != '0'
+# 目标渲染时间（秒，包括排队），近期平均时间接近该值时开始降低质量
+QUALITY_TARGET_SECONDS = float(os.environ.get('QUALITY_TARGET_SECONDS', 10))
+# 计算近期平均渲染时间的时间窗口（秒）
+QUALITY_WINDOW_SECONDS = 60
+# 恢复更高质量前负载需要保持较低的时间（秒），避免在两个等级之间反复切换
+QUALITY_RECOVERY_SECONDS = float(os.environ.get('QUALITY_RECOVERY_SECONDS', 15))
+
+# 质量等级，从高到低
+QUALITY_TIERS = ('full', 'reduced', 'minimal')
+# 各等级的渲染设置：
+#   scale: 输出尺寸（即DPI）的比例
+#   simplify: 底图使用的化简几何（按全国/区域地图分别选择化简级别，None表示原始几何）
+#   max_labels: 标签数量上限（None表示默认规则）
+#   graticule: 是否绘制经纬网
+#   tick_scalebar: 是否使用刻度线式比例尺（否则改为分段式）
+QUALITY_SETTINGS = {
+    'full': {'scale': 1.0, 'simplify': None, 'max_labels': None, 'graticule': True, 'tick_scalebar': True},
+    'reduced': {'scale': 0.75, 'simplify': {'national': 'national', 'regional': 'regional'},
+                'max_labels': 50, 'graticule': True, 'tick_scalebar': False},
+    'minimal': {'scale': 0.5, 'simplify': {'national': 'coarse', 'regional': 'national'},
+                'max_labels': 20, 'graticule': False, 'tick_scalebar': False},
+}
+# 进入各等级的负载阈值（负载 = 排队比例与平均渲染时间/目标时间中的较大者）
+_DEGRADE_THRESHOLDS = {'reduced': 0.5, 'minimal': 0.8}
+# 恢复时的阈值余量
+_RECOVERY_MARGIN = 0.15
+
+
+def quality_settings(tier):
+    """质量等级对应的渲染设置（None表示完整质量）"""
+    if tier is None:
+        tier = 'full'
+    if tier not in QUALITY_SETTINGS:
+        raise ValueError(f"不支持的质量等级: {tier}，可选: {', '.join(QUALITY_TIERS)}")
+    return QUALITY_SETTINGS[tier]
+
+
+class QualityController:
+    """
+    按负载选择渲染质量
+
+    负载取排队请求数占队列上限的比例和近期平均渲染时间（包括排队）占目标时间的比例中的较大者。
+    负载升高时立即降低质量；负载降低后需要保持 QUALITY_RECOVERY_SECONDS 秒才恢复，每次只恢复一级。
+    """
+
+    def __init__(self, target_seconds=QUALITY_TARGET_SECONDS, recovery_seconds=QUALITY_RECOVERY_SECONDS,
+                 admission=None):
+        self.target_seconds = target_seconds
+        self.recovery_seconds = recovery_seconds
+        self.admission = admission
+        self.level = 0  # QUALITY_TIERS中的位置
+        self._samples = deque()  # (时间, 秒数)
+        self._calm_since = None
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        """记录一次渲染请求的耗时（包括排队）"""
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, seconds))
+            self._expire(now)
+
+    def _expire(self, now):
+        while self._samples and now - self._samples[0][0] > QUALITY_WINDOW_SECONDS:
+            self._samples.popleft()
+
+    def pressure(self):
+        """当前负载（0表示空闲，1表示排队已满或平均耗时达到目标时间）"""
+        admission = self.admission or get_admission_controller()
+        stats = admission.stats()
+        queue_pressure = stats['queued'] / admission.max_queue if admission.max_queue else 0
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            latency = sum(seconds for _, seconds in self._samples) / len(self._samples) if self._samples else 0
+        return max(queue_pressure, latency / self.target_seconds)
+
+    def current_tier(self):
+        """按当前负载选择质量等级"""
+        if not QUALITY_DEGRADE_ENABLED:
+            return 'full'
+        pressure = self.pressure()
+        target = 0
+        for index, tier in enumerate(QUALITY_TIERS[1:], start=1):
+            if pressure >= _DEGRADE_THRESHOLDS[tier]:
+                target = index
+
+        now = time.monotonic()
+        with self._lock:
+            if target >= self.level:
+                if target > self.level:
+                    print(f"负载较高({pressure:.2f})，渲染质量降为 {QUALITY_TIERS[target]}")
+                self.level = target
+                self._calm_since = None
+            else:
+                # 负载需要低于当前等级阈值一定余量，并保持一段时间才恢复一级
+                if pressure >= _DEGRADE_THRESHOLDS[QUALITY_TIERS[self.level]] - _RECOVERY_MARGIN:
+                    self._calm_since = None
+                elif self._calm_since is None:
+                    self._calm_since = now
+                elif now - self._calm_since >= self.recovery_seconds:
+                    self.level -= 1
+                    self._calm_since = now
+                    print(f"负载降低({pressure:.2f})，渲染质量恢复为 {QUALITY_TIERS[self.level]}")
+            return QUALITY_TIERS[self.level]
+
+    def stats(self):
+        """当前质量等级和负载"""
+        return {
+            'tier': QUALITY_TIERS[self.level],
+            'pressure': round(self.pressure(), 3),
+            'targetSeconds': self.target_seconds,
+        }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_quality_controller():
+    """获取进程内共享的质量控制器"""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = QualityController()
+    return _controller
+
+
+_local = threading.local()
+
+
+@contextmanager
+def track_quality():
+    """
+    记录当前请求实际使用的质量等级，用法:
+
+        with track_quality() as quality:
+            generate_map(...)
+        quality['tier']
+    """
+    previous = getattr(_local, 'record', None)
+    record = {'tier': 'full'}
+    _local.record = record
+    try:
+        yield record
+    finally:
+        _local.record = previous
+
+
+def report_quality(tier):
+    """渲染函数报告本次请求使用的质量等级（不在 track_quality 中时忽略）"""
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        record['tier'] = tier or 'full'
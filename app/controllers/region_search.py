@@ -0,0 +1,227 @@
+import bisect
+import heapq
+import re
+import threading
+
+from app.controllers.boundary_store import get_region_attributes, get_data_version
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # 未安装pypinyin时只支持汉字搜索
+    lazy_pinyin = None
+
+# 搜索结果数量
+DEFAULT_SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+# 模糊匹配时至少命中的n-gram比例
+FUZZY_MIN_OVERLAP = 0.5
+
+# 级别排序：同分时省优先，其次市、县
+LEVEL_ORDER = {'省': 0, '市': 1, '县': 2}
+
+_LATIN_QUERY = re.compile(r'^[a-z]+$')
+_SEPARATORS = re.compile(r"[\s'·\-_]+")
+
+
+def _normalize(text):
+    """统一大小写并去掉空白和分隔符"""
+    return _SEPARATORS.sub('', str(text or '')).lower()
+
+
+def _ngrams(text):
+    """单字和相邻两字（中文名称较短，二元组足以区分）"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+class RegionSearchIndex:
+    """
+    省、市、县名称的搜索索引
+
+    - 汉字：名称的n-gram倒排索引，先求候选集合再按子串位置排序；
+      没有子串匹配时按与完整层级（如"湖南省长沙市"）的n-gram重合度做模糊匹配，可以输入"湖南长沙"或有错别字
+    - 拼音（需要安装pypinyin）：全拼和首字母的有序列表，按前缀二分查找
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.names = [_normalize(entry['name']) for entry in entries]
+
+        self.grams = {}
+        self.path_grams = {}
+        for entry_id, (entry, name) in enumerate(zip(entries, self.names)):
+            for gram in _ngrams(name):
+                self.grams.setdefault(gram, []).append(entry_id)
+            for gram in _ngrams(_normalize(''.join(entry['path']))):
+                self.path_grams.setdefault(gram, []).append(entry_id)
+
+        # (拼音, 条目) 有序列表，用于前缀查找
+        self.pinyin_keys = []
+        if lazy_pinyin is not None:
+            for entry_id, entry in enumerate(entries):
+                syllables = lazy_pinyin(entry['name'])
+                initials = ''.join(s[0] for s in lazy_pinyin(entry['name'], style=Style.FIRST_LETTER) if s)
+                self.pinyin_keys.append((''.join(syllables).lower(), entry_id))
+                self.pinyin_keys.append((initials.lower(), entry_id))
+            self.pinyin_keys.sort()
+
+    def _rank(self, entry_id, match_rank, position=0):
+        """排序键：匹配类型、匹配位置、级别、名称长度"""
+        entry = self.entries[entry_id]
+        return (match_rank, position, LEVEL_ORDER.get(entry['level'], 3), len(self.names[entry_id]), entry_id)
+
+    def _search_pinyin(self, query):
+        """按拼音全拼或首字母前缀查找"""
+        ranked = {}
+        start = bisect.bisect_left(self.pinyin_keys, (query, -1))
+        for key, entry_id in self.pinyin_keys[start:]:
+            if not key.startswith(query):
+                break
+            rank = self._rank(entry_id, 0 if key == query else 1)
+            ranked[entry_id] = min(rank, ranked.get(entry_id, rank))
+        return ranked
+
+    def _search_text(self, query):
+        """按名称的子串和n-gram查找"""
+        grams = _ngrams(query) if len(query) > 1 else {query}
+        postings = [self.grams.get(gram, ()) for gram in grams]
+        ranked = {}
+
+        # 所有n-gram都命中的条目才可能包含完整子串
+        if all(postings):
+            candidates = set(min(postings, key=len))
+            for posting in postings:
+                if len(candidates) <= 1:
+                    break
+                candidates.intersection_update(posting)
+            for entry_id in candidates:
+                position = self.names[entry_id].find(query)
+                if position < 0:
+                    continue
+                if self.names[entry_id] == query:
+                    ranked[entry_id] = self._rank(entry_id, 0)
+                else:
+                    ranked[entry_id] = self._rank(entry_id, 1 if position == 0 else 2, position)
+
+        # 没有子串匹配时按完整层级做模糊匹配（例如"湖南长沙"、输错或多输了一个字）
+        if not ranked and len(query) > 1:
+            overlap = {}
+            for gram in grams:
+                for entry_id in self.path_grams.get(gram, ()):
+                    overlap[entry_id] = overlap.get(entry_id, 0) + 1
+            needed = max(1, int(len(grams) * FUZZY_MIN_OVERLAP + 0.5))
+            for entry_id, count in overlap.items():
+                if count >= needed:
+                    ranked[entry_id] = self._rank(entry_id, 3, len(grams) - count)
+        return ranked
+
+    def search(self, query, limit=DEFAULT_SEARCH_LIMIT, level=None):
+        """
+        搜索区域
+
+        参数:
+            query (str): 名称、名称片段、拼音全拼或首字母
+            limit (int): 返回结果数量
+            level (str, optional): 只返回某一级别（'省', '市', '县'）
+
+        返回:
+            list: 按相关度排序的区域，每项包含 name, level, code, path（完整的行政区划层级）
+        """
+        query = _normalize(query)
+        if not query:
+            return []
+
+        if _LATIN_QUERY.match(query) and self.pinyin_keys:
+            ranked = self._search_pinyin(query)
+        else:
+            ranked = self._search_text(query)
+
+        if level:
+            ranked = {entry_id: rank for entry_id, rank in ranked.items()
+                      if self.entries[entry_id]['level'] == level}
+        best = heapq.nsmallest(limit, ranked.values())
+        return [self.entries[rank[-1]] for rank in best]
+
+
+def _clean(value):
+    """属性值转换为字符串，缺失值为空字符串"""
+    if value is None or value != value:
+        return ''
+    return str(value).strip()
+
+
+def build_region_entries():
+    """
+    从省、市、县属性表生成搜索条目
+
+    返回:
+        list: 每项包含 name, level, code, province, city, path
+    """
+    entries = []
+    columns = {
+        '省': ('省', '省代码'),
+        '市': ('市', '市代码'),
+        '县': ('NAME', 'PAC'),
+    }
+    for level, (name_field, code_field) in columns.items():
+        df = get_region_attributes(level)
+        if name_field not in df.columns:
+            print(f"搜索索引: {level}级数据缺少字段 {name_field}，已跳过")
+            continue
+
+        seen = set()
+        for record in df.to_dict('records'):
+            name = _clean(record.get(name_field))
+            province = _clean(record.get('省'))
+            if level == '县':
+                city = _clean(record.get('市'))
+            elif level == '市':
+                city = name
+            else:
+                city = ''
+            if not name or (level, name, province, city) in seen:
+                continue
+            seen.add((level, name, province, city))
+
+            # 完整层级，如 ['广东省', '广州市', '天河区']；直辖市的省、市同名时只保留一次
+            path = []
+            for part in (province, city, name):
+                if part and part not in path:
+                    path.append(part)
+            entries.append({
+                'name': name,
+                'level': level,
+                'code': _clean(record.get(code_field)),
+                'province': province,
+                'city': city,
+                'path': path,
+            })
+    return entries
+
+
+# (数据版本, RegionSearchIndex)
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_region_search_index():
+    """获取进程内共享的搜索索引（首次调用时构建，边界数据更新后重新构建）"""
+    global _index
+    version = get_data_version()
+    cached = _index
+    if cached is None or cached[0] != version:
+        with _index_lock:
+            cached = _index
+            if cached is None or cached[0] != version:
+                index = RegionSearchIndex(build_region_entries())
+                cached = _index = (version, index)
+                print(f"区域搜索索引已构建: {len(index.entries)}个区域"
+                      f"{'，支持拼音' if index.pinyin_keys else '（未安装pypinyin，不支持拼音）'}")
+    return cached[1]
+
+
+def search_regions(query, limit=DEFAULT_SEARCH_LIMIT, level=None):
+    """搜索省、市、县名称，参数和返回值见 RegionSearchIndex.search"""
+    limit = max(1, min(int(limit), MAX_SEARCH_LIMIT))
+    return get_region_search_index().search(query, limit, level)
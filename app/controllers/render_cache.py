@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from app.controllers.boundary_store import get_data_version
+
+# 是否复用相同参数已生成的地图（设为0时每次都重新渲染）
+RENDER_CACHE_ENABLED = os.environ.get('RENDER_CACHE', '1') != '0'
+# 样式版本：修改了绘图代码、字体或默认样式后递增，使已缓存的地图失效
+RENDER_STYLE_VERSION = os.environ.get('RENDER_STYLE_VERSION', '1')
+
+# 只影响输出方式、不影响图片内容的参数
+_OUTPUT_OPTIONS = ('save_local',)
+# 可以包含上传数据表（options['table']）的参数
+TABLE_OPTIONS = ('choropleth', 'points')
+
+
+def has_uploaded_table(map_kwargs):
+    """参数中是否有上传的数据表（分级统计数据或点数据文件）"""
+    return any(isinstance(map_kwargs.get(name), dict) and isinstance(map_kwargs[name].get('table'), pd.DataFrame)
+               for name in TABLE_OPTIONS)
+
+
+def _table_digest(value):
+    """上传的数据表按列名、类型和内容的散列参与键的计算"""
+    if isinstance(value, pd.DataFrame):
+        digest = hashlib.sha256()
+        digest.update(json.dumps([[str(column), str(dtype)] for column, dtype in value.dtypes.items()],
+                                 ensure_ascii=False).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+        return {'table': digest.hexdigest()}
+    raise TypeError(f"无法序列化的参数: {type(value).__name__}")
+
+
+def render_cache_key(map_kwargs, extension='png'):
+    """
+    根据地图参数、数据版本和样式版本生成缓存键
+
+    参数:
+        map_kwargs (dict): 完整的地图参数（与generate_map相同）
+        extension (str): 图片格式
+
+    返回:
+        str 或 None: 缓存键（上传的数据表按内容散列）；参数无法序列化时返回None
+    """
+    options = {key: value for key, value in map_kwargs.items() if key not in _OUTPUT_OPTIONS}
+    try:
+        canonical = json.dumps(options, sort_keys=True, ensure_ascii=False, separators=(',', ':'),
+                               default=_table_digest)
+    except (TypeError, ValueError):
+        return None
+    payload = f"{canonical}|{extension}|{get_data_version()}|{RENDER_STYLE_VERSION}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def render_cache_alias(map_kwargs, key, extension='png'):
+    """缓存图片在存储中的文件名（包含地图类型和区域，便于下载时识别）"""
+    region_name = map_kwargs.get('region_name') or '全国'
+    safe_region_name = 'China' if region_name == '全国' else ''.join(e for e in region_name if e.isalnum())
+    return f"cache_{map_kwargs.get('map_type', '')}_{safe_region_name}_{key[:24]}.{extension}"
+
+
+def lookup_render(storage, map_kwargs, extension='png'):
+    """
+    查找相同参数已生成的地图
+
+    参数:
+        storage (MapStorage): 地图存储
+        map_kwargs (dict): 完整的地图参数
+
+    返回:
+        tuple: (缓存文件名, 缓存图片路径)；无法缓存时文件名为None，未命中时路径为None
+    """
+    # 上传文件的地图通常只生成一次，不写入存储
+    if not RENDER_CACHE_ENABLED or has_uploaded_table(map_kwargs):
+        return None, None
+    key = render_cache_key(map_kwargs, extension)
+    if key is None:
+        return None, None
+    alias = render_cache_alias(map_kwargs, key, extension)
+    resolved = storage.resolve(alias)
+    return alias, resolved[0] if resolved else None
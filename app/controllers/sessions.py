@@ -0,0 +1,199 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from app.controllers.boundary_store import get_boundary_store, use_boundary_store
+from app.controllers.map_controller import build_map_figure, build_map_filename, deliver_map_image
+
+# 同时保留的编辑会话数量上限，超出时关闭最久未使用的会话
+MAP_SESSION_MAX = int(os.environ.get('MAP_SESSION_MAX', 20))
+# 会话空闲超过该时间（秒）后关闭
+MAP_SESSION_TTL_SECONDS = int(os.environ.get('MAP_SESSION_TTL_SECONDS', 900))
+# 编辑预览的默认分辨率（导出最终图片时可以传入更高的dpi）
+SESSION_PREVIEW_DPI = int(os.environ.get('SESSION_PREVIEW_DPI', 100))
+
+# 修改后必须重新构建图形的参数（数据筛选、投影、分级数据、自动着色、点数据、经纬网和图片比例都依赖重新绘制）
+REBUILD_OPTIONS = ('map_type', 'region_name', 'projection', 'choropleth',
+                   'autoColor', 'autoColorPalette', 'highlightNeighbors', 'neighborColor', 'points',
+                   'showCoordinates', 'coordinatesFontSize', 'width', 'height')
+TITLE_OPTIONS = ('showTitle', 'customTitle', 'titleFontSize')
+SCALE_BAR_OPTIONS = ('showScaleBar', 'scaleBarStyle', 'scaleBarLocation', 'scaleBarFontSize')
+OVERLAY_OPTIONS = ('overlayLevels', 'overlayColor', 'overlayWidth')
+
+
+def _option_changed(old, new):
+    """比较参数是否变化（分级统计数据中可能包含DataFrame，无法直接比较时视为已变化）"""
+    if old is new:
+        return False
+    try:
+        return bool(old != new)
+    except (TypeError, ValueError):
+        return True
+
+
+def _points_by_region(map_kwargs):
+    """是否按区域汇总点数据（区域颜色由点数决定）"""
+    points = map_kwargs.get('points')
+    return bool(points) and points.get('mode') == 'regions'
+
+
+class MapSession:
+    """
+    一个编辑会话：保留已构建的地图图形，参数修改后只更新受影响的图形元素
+    """
+
+    def __init__(self, session_id, map_kwargs, options=None, dpi=SESSION_PREVIEW_DPI):
+        self.session_id = session_id
+        self.options = dict(options or {})  # 原始请求参数，修改时在此基础上合并
+        self.save_local = map_kwargs.get('save_local', False)
+        self.dpi = dpi
+        self.lock = threading.Lock()
+        self.last_access = time.time()
+        self.map_kwargs = self._figure_kwargs(map_kwargs)
+        # 会话内的所有修改都使用创建时的边界数据版本，边界数据更新后不会与已绘制的图形混用
+        self.boundary_store = get_boundary_store()
+        with use_boundary_store(self.boundary_store):
+            self.map_figure = build_map_figure(**self.map_kwargs)
+
+    @staticmethod
+    def _figure_kwargs(map_kwargs):
+        """去掉只影响输出方式的参数"""
+        return {key: value for key, value in map_kwargs.items() if key != 'save_local'}
+
+    def update(self, map_kwargs):
+        """
+        应用修改后的参数
+
+        参数:
+            map_kwargs (dict): 完整的地图参数（与generate_map相同）
+
+        返回:
+            tuple: (是否重新构建了图形, 发生变化的参数列表)
+        """
+        with use_boundary_store(self.boundary_store):
+            return self._apply(map_kwargs)
+
+    def _apply(self, map_kwargs):
+        self.save_local = map_kwargs.get('save_local', False)
+        new_kwargs = self._figure_kwargs(map_kwargs)
+        changed = [key for key in new_kwargs
+                   if _option_changed(self.map_kwargs.get(key), new_kwargs[key])]
+        if not changed:
+            return False, changed
+
+        # 相邻区域的颜色是在底色上计算的，按区域汇总点数时底色是没有点的区域的颜色，底色变化时也需要重新构建
+        if any(key in REBUILD_OPTIONS for key in changed) or (
+                'base_color' in changed and (new_kwargs.get('highlightNeighbors') or _points_by_region(new_kwargs))):
+            print(f"会话 {self.session_id}: 参数 {changed} 需要重新构建地图")
+            self.map_figure = build_map_figure(**new_kwargs)
+            self.map_kwargs = new_kwargs
+            return True, changed
+
+        print(f"会话 {self.session_id}: 增量更新 {changed}")
+        map_figure = self.map_figure
+        if 'base_color' in changed and not new_kwargs.get('choropleth') and not new_kwargs.get('autoColor'):
+            map_figure.set_base_color(new_kwargs['base_color'])
+        if 'border_color' in changed or 'border_width' in changed:
+            map_figure.set_border(new_kwargs['border_color'], new_kwargs['border_width'])
+        if 'highlight_regions' in changed or 'base_color' in changed:
+            map_figure.set_highlights(new_kwargs['highlight_regions'])
+        if any(key in OVERLAY_OPTIONS for key in changed):
+            map_figure.set_overlays(new_kwargs['overlayLevels'], new_kwargs['overlayColor'],
+                                    new_kwargs['overlayWidth'])
+        if 'show_labels' in changed:
+            map_figure.set_labels_visible(new_kwargs['show_labels'])
+        # 默认标题中包含高亮区域信息
+        if any(key in TITLE_OPTIONS for key in changed) or 'highlight_regions' in changed:
+            map_figure.update_title(new_kwargs['showTitle'], new_kwargs['customTitle'],
+                                    new_kwargs['titleFontSize'], new_kwargs['highlight_regions'])
+        if any(key in SCALE_BAR_OPTIONS for key in changed):
+            if new_kwargs['showScaleBar']:
+                map_figure.set_scale_bar(new_kwargs['scaleBarStyle'], new_kwargs['scaleBarLocation'],
+                                         new_kwargs['scaleBarFontSize'])
+            else:
+                map_figure.remove_scale_bar()
+
+        self.map_kwargs = new_kwargs
+        return False, changed
+
+    def render(self):
+        """
+        按会话的分辨率和保存方式编码当前图形
+
+        返回:
+            str: 如果save_local=True，返回保存后的相对路径；否则返回Base64编码的data URI
+        """
+        filename = build_map_filename(self.map_figure, self.map_kwargs.get('highlight_regions'))
+        return deliver_map_image(self.map_figure.render_png(self.dpi), filename, self.save_local)
+
+
+class SessionManager:
+    """
+    编辑会话管理：按空闲时间过期，数量超过上限时关闭最久未使用的会话
+    """
+
+    def __init__(self, max_sessions=MAP_SESSION_MAX, ttl_seconds=MAP_SESSION_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        """关闭空闲超时的会话（调用方需持有锁）"""
+        for session_id in [sid for sid, session in self._sessions.items()
+                           if now - session.last_access > self.ttl_seconds]:
+            del self._sessions[session_id]
+            print(f"编辑会话已过期: {session_id}")
+
+    def create(self, map_kwargs, options=None, dpi=SESSION_PREVIEW_DPI):
+        """
+        创建会话并构建地图图形
+
+        参数:
+            map_kwargs (dict): 地图参数（与generate_map相同）
+            options (dict): 原始请求参数
+            dpi (int): 预览分辨率
+
+        返回:
+            MapSession: 新会话
+        """
+        session = MapSession(uuid.uuid4().hex, map_kwargs, options, dpi)
+        with self._lock:
+            self._expire(time.time())
+            self._sessions[session.session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                session_id, _ = self._sessions.popitem(last=False)
+                print(f"编辑会话数量超过上限，关闭会话: {session_id}")
+        return session
+
+    def get(self, session_id):
+        """获取会话，不存在或已过期时返回None"""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_access = now
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def close(self, session_id):
+        """关闭会话，返回会话是否存在"""
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+
+_session_manager = None
+_session_manager_lock = threading.Lock()
+
+
+def get_session_manager():
+    """获取进程内共享的会话管理器"""
+    global _session_manager
+    if _session_manager is None:
+        with _session_manager_lock:
+            if _session_manager is None:
+                _session_manager = SessionManager()
+    return _session_manager
@@ -0,0 +1,307 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+from matplotlib.path import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl，发布时不加跨进程锁（目录重命名本身是原子的）
+    fcntl = None
+
+
+def _default_shared_dir():
+    """优先使用内存文件系统 /dev/shm，不存在时使用临时目录"""
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return os.path.join('/dev/shm', 'china-map-generator')
+    return os.path.join(tempfile.gettempdir(), 'china-map-generator')
+
+
+# 共享几何数组的发布目录（同一台机器上的所有工作进程共用）
+SHARED_GEOMETRY_DIR = os.environ.get('SHARED_GEOMETRY_DIR') or _default_shared_dir()
+# 设为0时每个进程各自在内存中保存数组，不发布到共享目录
+SHARED_GEOMETRY_ENABLED = os.environ.get('SHARED_GEOMETRY', '1').lower() not in ('0', 'false', 'no')
+# 发布新版本后旧版本保留的时间（秒）；最近的一个旧版本总是保留，供仍在使用旧数据的进程挂载
+SHARED_GEOMETRY_GRACE_SECONDS = int(os.environ.get('SHARED_GEOMETRY_GRACE_SECONDS', 3600))
+
+# 数组格式版本（格式变化后重新发布，不会挂载旧格式的数据）
+GEOMETRY_FORMAT_VERSION = 2
+_GEOMETRY_ARRAYS = ('coords', 'ring_offsets', 'polygon_offsets', 'region_offsets',
+                    'bounds', 'anchors', 'areas', 'quantization')
+# 顶点量化后的最大整数值（留出余量，避免舍入后超出int32范围）
+_QUANTIZATION_RANGE = 2 ** 30
+
+
+class RaggedGeometry:
+    """
+    区域几何的紧凑扁平表示（偏移布局与 shapely.to_ragged_array 的MultiPolygon相同）
+
+    - coords: (N, 2) int32 量化顶点，实际坐标 = coords * scale + origin
+    - quantization: [origin_x, origin_y, scale]
+    - ring_offsets: 每个环在coords中的起止位置（int32）
+    - polygon_offsets: 每个多边形在环序列中的起止位置（int32）
+    - region_offsets: 每个区域在多边形序列中的起止位置（int32）
+    - bounds: (R, 4) 每个区域的范围；anchors: (R, 2) 标签位置（质心）；areas: (R,) 面积
+
+    每个顶点只占8字节，没有逐区域的Python/GEOS对象；数组可以是只读的内存映射。
+    只在需要时转换为matplotlib Path或Shapely几何对象。
+    """
+
+    def __init__(self, coords, ring_offsets, polygon_offsets, region_offsets,
+                 bounds, anchors, areas, quantization):
+        self.coords = coords
+        self.ring_offsets = ring_offsets
+        self.polygon_offsets = polygon_offsets
+        self.region_offsets = region_offsets
+        self.bounds = bounds
+        self.anchors = anchors
+        self.areas = areas
+        self.quantization = quantization
+
+    @classmethod
+    def from_geometries(cls, geometries):
+        """
+        由Polygon/MultiPolygon几何数组创建（缺失的几何视为空区域）
+
+        参数:
+            geometries: shapely几何对象序列
+        """
+        geometries = np.asarray(geometries, dtype=object).copy()
+        missing = shapely.is_missing(geometries)
+        geometries[missing] = shapely.from_wkt('MULTIPOLYGON EMPTY')
+        geometries = shapely.force_2d(geometries)
+        geometry_type, coords, offsets = shapely.to_ragged_array(geometries)
+        if geometry_type == shapely.GeometryType.POLYGON:
+            # 全部是Polygon时没有多边形到区域的一层偏移，每个区域正好一个多边形
+            offsets = (*offsets, np.arange(len(geometries) + 1))
+        elif geometry_type != shapely.GeometryType.MULTIPOLYGON:
+            raise ValueError(f"边界数据只能包含面状几何，实际为: {geometry_type.name}")
+
+        # 按数据范围的中心和最大半径量化为int32
+        bounds = shapely.bounds(geometries)
+        if len(coords):
+            lower, upper = coords.min(axis=0), coords.max(axis=0)
+            origin = (lower + upper) / 2
+            scale = max(float((upper - lower).max()) / 2, 1e-9) / _QUANTIZATION_RANGE
+        else:
+            origin, scale = np.zeros(2), 1.0
+        quantized = np.round((coords - origin) / scale).astype(np.int32)
+
+        centroids = shapely.centroid(geometries)
+        anchors = np.column_stack([shapely.get_x(centroids), shapely.get_y(centroids)])
+        return cls(quantized, *(np.asarray(values, dtype=np.int32) for values in offsets),
+                   bounds, anchors, shapely.area(geometries),
+                   np.array([origin[0], origin[1], scale], dtype=np.float64))
+
+    def __len__(self):
+        return len(self.region_offsets) - 1
+
+    @property
+    def nbytes(self):
+        """几何数组占用的字节数"""
+        return sum(getattr(self, name).nbytes for name in _GEOMETRY_ARRAYS)
+
+    def arrays(self):
+        """返回用于发布的数组字典"""
+        return {name: getattr(self, name) for name in _GEOMETRY_ARRAYS}
+
+    def dequantize(self, coords):
+        """将量化顶点还原为投影坐标（float64）"""
+        return coords * self.quantization[2] + self.quantization[:2]
+
+    def coord_range(self, position):
+        """区域顶点在coords中的起止位置，以及环的起止位置"""
+        polygon_start, polygon_end = self.region_offsets[position], self.region_offsets[position + 1]
+        ring_start, ring_end = self.polygon_offsets[polygon_start], self.polygon_offsets[polygon_end]
+        return self.ring_offsets[ring_start], self.ring_offsets[ring_end], ring_start, ring_end
+
+    def path(self, position):
+        """
+        将一个区域转换为复合matplotlib Path（内环形成空洞）
+
+        返回:
+            Path 或 None: 空区域返回None
+        """
+        coord_start, coord_end, ring_start, ring_end = self.coord_range(position)
+        if coord_end == coord_start:
+            return None
+
+        codes = np.full(coord_end - coord_start, Path.LINETO, dtype=Path.code_type)
+        ring_bounds = self.ring_offsets[ring_start:ring_end + 1] - coord_start
+        codes[ring_bounds[:-1]] = Path.MOVETO
+        codes[ring_bounds[1:] - 1] = Path.CLOSEPOLY
+        return Path(self.dequantize(self.coords[coord_start:coord_end]), codes)
+
+    def paths(self, positions):
+        """按位置批量转换为Path列表（空区域为None）"""
+        return [self.path(position) for position in positions]
+
+    def to_shapely(self, positions):
+        """
+        按需将部分区域转换为Shapely 2几何对象
+
+        参数:
+            positions: 区域位置序列
+
+        返回:
+            ndarray: MultiPolygon数组
+        """
+        coords, ring_offsets, polygon_offsets, region_offsets = [], [0], [0], [0]
+        for position in positions:
+            coord_start, coord_end, ring_start, ring_end = self.coord_range(position)
+            polygon_start, polygon_end = self.region_offsets[position], self.region_offsets[position + 1]
+            coords.append(self.coords[coord_start:coord_end])
+            ring_offsets.extend(self.ring_offsets[ring_start + 1:ring_end + 1] - coord_start + ring_offsets[-1])
+            polygon_offsets.extend(self.polygon_offsets[polygon_start + 1:polygon_end + 1] - ring_start
+                                   + polygon_offsets[-1])
+            region_offsets.append(region_offsets[-1] + polygon_end - polygon_start)
+
+        if not coords:
+            return np.array([], dtype=object)
+        offsets = tuple(np.asarray(values, dtype=np.int64)
+                        for values in (ring_offsets, polygon_offsets, region_offsets))
+        return shapely.from_ragged_array(shapely.GeometryType.MULTIPOLYGON,
+                                         self.dequantize(np.concatenate(coords)), offsets)
+
+    def total_bounds(self, positions):
+        """若干区域的总范围 (xmin, ymin, xmax, ymax)"""
+        bounds = self.bounds[np.asarray(positions, dtype=int)]
+        bounds = bounds[~np.isnan(bounds).any(axis=1)]
+        if not len(bounds):
+            return np.full(4, np.nan)
+        return np.array([bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max()])
+
+
+def _attribute_arrays(attributes):
+    """将属性表转换为可内存映射的数组（字符串列使用定长Unicode数组和缺失值掩码）"""
+    arrays = {}
+    columns = []
+    for i, column in enumerate(attributes.columns):
+        series = attributes[column]
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            arrays[f"attr_{i}"] = series.to_numpy()
+            columns.append({'name': str(column), 'kind': 'number'})
+        else:
+            nulls = series.isna().to_numpy()
+            arrays[f"attr_{i}"] = np.asarray(series.where(~nulls, '').astype(str).to_numpy(), dtype=str)
+            arrays[f"attr_{i}_nulls"] = nulls
+            columns.append({'name': str(column), 'kind': 'string'})
+    return arrays, columns
+
+
+def _attributes_from_arrays(arrays, columns):
+    """由共享数组重建属性表（属性表很小，按进程复制）"""
+    data = {}
+    for i, column in enumerate(columns):
+        values = arrays[f"attr_{i}"]
+        if column['kind'] == 'string':
+            series = pd.Series(values.tolist(), dtype=object)
+            series[np.asarray(arrays[f"attr_{i}_nulls"])] = None
+        else:
+            series = pd.Series(np.asarray(values))
+        data[column['name']] = series
+    return pd.DataFrame(data)
+
+
+def _write_dataset(directory, geometry, attributes):
+    """将几何数组和属性写入目录（meta.json最后写入）"""
+    arrays, columns = _attribute_arrays(attributes)
+    arrays.update(geometry.arrays())
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), values, allow_pickle=False)
+    with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'count': len(geometry), 'columns': columns}, f, ensure_ascii=False)
+
+
+def _read_dataset(directory):
+    """以只读内存映射方式挂载目录中的数组"""
+    with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    arrays = {}
+    for filename in os.listdir(directory):
+        if filename.endswith('.npy'):
+            arrays[filename[:-4]] = np.load(os.path.join(directory, filename), mmap_mode='r',
+                                            allow_pickle=False)
+    geometry = RaggedGeometry(*(arrays[name] for name in _GEOMETRY_ARRAYS))
+    return geometry, _attributes_from_arrays(arrays, meta['columns'])
+
+
+def _remove_stale_versions(prefix, current):
+    """
+    删除同一数据集过期的旧版本
+
+    数据更新后，替换前开始的请求仍固定在旧版本上，可能还需要挂载旧版本中尚未加载的数据集，
+    因此除当前版本外总是保留最近的一个旧版本，更早的版本发布超过 SHARED_GEOMETRY_GRACE_SECONDS 秒后才删除
+    （已挂载的进程仍可继续使用已映射的数据）
+    """
+    try:
+        names = os.listdir(SHARED_GEOMETRY_DIR)
+    except OSError:
+        return
+    versions = []
+    for name in names:
+        if name.startswith(prefix) and name != current and not name.endswith('.lock'):
+            try:
+                versions.append((os.stat(os.path.join(SHARED_GEOMETRY_DIR, name)).st_mtime, name))
+            except OSError:
+                continue
+    versions.sort(reverse=True)
+    expire_before = time.time() - SHARED_GEOMETRY_GRACE_SECONDS
+    for published, name in versions[1:]:
+        if published < expire_before:
+            shutil.rmtree(os.path.join(SHARED_GEOMETRY_DIR, name), ignore_errors=True)
+
+
+def attach_or_publish(name, version, build):
+    """
+    挂载共享的几何数组；尚未发布时调用build()生成并发布
+
+    同一台机器上只有一个进程执行build，其他进程等待后直接挂载，
+    各进程的几何数据都是同一份内存映射文件的只读视图，进程数增加时内存不随之增长。
+
+    参数:
+        name (str): 数据集名称（如 '县-lcc'）
+        version (str): 数据版本（源文件变化时改变）
+        build (callable): 返回 (RaggedGeometry, 属性DataFrame)
+
+    返回:
+        tuple: (RaggedGeometry, 属性DataFrame)
+    """
+    if not SHARED_GEOMETRY_ENABLED:
+        return build()
+
+    key = f"{name}-{version}-v{GEOMETRY_FORMAT_VERSION}"
+    directory = os.path.join(SHARED_GEOMETRY_DIR, key)
+    if os.path.exists(os.path.join(directory, 'meta.json')):
+        return _read_dataset(directory)
+
+    os.makedirs(SHARED_GEOMETRY_DIR, exist_ok=True)
+    with open(os.path.join(SHARED_GEOMETRY_DIR, f"{name}.lock"), 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # 等待锁期间可能已由其他进程发布
+            if not os.path.exists(os.path.join(directory, 'meta.json')):
+                geometry, attributes = build()
+                staging = tempfile.mkdtemp(prefix=f".{key}.", dir=SHARED_GEOMETRY_DIR)
+                os.chmod(staging, 0o755)
+                try:
+                    _write_dataset(staging, geometry, attributes)
+                    os.replace(staging, directory)
+                    # 目录的修改时间作为发布时间（清理旧版本时使用）
+                    os.utime(directory)
+                except OSError:
+                    shutil.rmtree(staging, ignore_errors=True)
+                    if not os.path.exists(os.path.join(directory, 'meta.json')):
+                        raise
+                print(f"已发布共享几何数据: {key} ({geometry.nbytes / 1024 / 1024:.1f} MiB)")
+                _remove_stale_versions(f"{name}-", key)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return _read_dataset(directory)
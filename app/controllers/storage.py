@@ -0,0 +1,333 @@
+import os
+import re
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+import tempfile
+from contextlib import contextmanager
+
+# 存储目录：不能位于 app/static 下，否则索引和blob可以被直接下载，图片只能通过 /maps/<别名> 访问
+MAP_STORAGE_DIR = os.environ.get('MAP_STORAGE_DIR', 'data/maps')
+# 旧版本的存储目录（位于静态文件目录中），首次启动时把其中的图片迁移到 MAP_STORAGE_DIR
+LEGACY_MAPS_FOLDER = 'app/static/maps'
+# 存储配额（MB）和过期时间（小时，0表示不过期）
+MAPS_STORAGE_QUOTA_MB = float(os.environ.get('MAPS_STORAGE_QUOTA_MB', 1024))
+MAPS_STORAGE_TTL_HOURS = float(os.environ.get('MAPS_STORAGE_TTL_HOURS', 168))
+
+# 别名只允许普通文件名（不允许路径分隔符）
+_ALIAS_PATTERN = re.compile(r'^[^/\\\x00]+$')
+# 访问时间的最小更新间隔（秒），避免每次读取都写数据库
+_TOUCH_INTERVAL = 60
+# 两次过期清理之间的最小间隔（秒）
+_EVICT_INTERVAL = 300
+
+
+class MapStorage:
+    """
+    地图图片存储管理
+
+    文件按内容的SHA-256存储为唯一的blob（相同的地图只保存一份），
+    对外通过可读的文件名别名访问。索引保存在SQLite中，多个进程可以共享同一目录。
+    超过容量配额时按最近访问时间（LRU）淘汰，超过TTL未访问的图片也会被清理。
+
+    目录结构:
+        {root}/blobs/{digest[:2]}/{digest}
+        {root}/index.sqlite3
+    """
+
+    def __init__(self, root, quota_bytes, ttl_seconds=0):
+        self.root = root
+        self.blobs_dir = os.path.join(root, 'blobs')
+        self.index_path = os.path.join(root, 'index.sqlite3')
+        self.quota_bytes = int(quota_bytes)
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._last_evict = 0
+
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL)''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS aliases (
+                alias TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                created REAL NOT NULL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_aliases_digest ON aliases (digest)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_blobs_accessed ON blobs (accessed)')
+
+    def _connect(self):
+        """每个线程使用独立的SQLite连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def blob_path(self, digest):
+        """blob在磁盘上的路径"""
+        return os.path.join(self.blobs_dir, digest[:2], digest)
+
+    @contextmanager
+    def _write_transaction(self):
+        """
+        写事务（BEGIN IMMEDIATE）：同一时间只有一个线程或进程能修改索引，
+        blob文件的写入和删除也放在事务中进行，保存和淘汰不会交错
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def put(self, data, alias):
+        """
+        保存图片数据并登记别名
+
+        参数:
+            data (bytes): 图片数据
+            alias (str): 对外使用的文件名
+
+        返回:
+            str: 图片内容的SHA-256
+        """
+        if not _ALIAS_PATTERN.match(alias):
+            raise ValueError(f"不合法的文件名: {alias}")
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+
+        def write_blob():
+            # 内容相同的图片只写一次；先写临时文件再原子重命名，避免读到半个文件
+            if os.path.exists(path):
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+        self._register(digest, len(data), alias, write_blob)
+        return digest
+
+    def put_file(self, path, alias):
+        """
+        将磁盘上已写好的图片文件移入存储并登记别名（大幅面地图不需要整体读入内存）
+
+        参数:
+            path (str): 图片文件路径，应与存储位于同一文件系统（见 temp_path），调用后文件被移走或删除
+            alias (str): 对外使用的文件名
+
+        返回:
+            str: 图片内容的SHA-256
+        """
+        if not _ALIAS_PATTERN.match(alias):
+            raise ValueError(f"不合法的文件名: {alias}")
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        size = os.path.getsize(path)
+
+        blob_path = self.blob_path(digest)
+
+        def move_blob():
+            if os.path.exists(blob_path):
+                os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(path, blob_path)
+
+        self._register(digest, size, alias, move_blob)
+        return digest
+
+    def temp_path(self, suffix=''):
+        """在存储目录中创建临时文件（之后通过 put_file 移入存储），返回路径"""
+        fd, path = tempfile.mkstemp(dir=self.blobs_dir, suffix=f"{suffix}.tmp")
+        os.close(fd)
+        return path
+
+    def _register(self, digest, size, alias, store_blob):
+        """
+        在同一个写事务中保存blob文件（store_blob）并在索引中登记blob和别名，之后按配额淘汰
+
+        淘汰也在写事务中删除文件，因此不会出现索引指向刚被删除的blob的情况
+        """
+        now = time.time()
+        with self._write_transaction() as conn:
+            store_blob()
+            conn.execute('''INSERT INTO blobs (digest, size, created, accessed) VALUES (?, ?, ?, ?)
+                            ON CONFLICT(digest) DO UPDATE SET accessed = excluded.accessed''',
+                         (digest, size, now, now))
+            conn.execute('INSERT OR REPLACE INTO aliases (alias, digest, created) VALUES (?, ?, ?)',
+                         (alias, digest, now))
+
+        self.evict()
+
+    def resolve(self, alias):
+        """
+        根据别名查找图片
+
+        返回:
+            tuple 或 None: (blob路径, digest, 创建时间)
+        """
+        conn = self._connect()
+        row = conn.execute('''SELECT b.digest, b.created, b.accessed FROM aliases a
+                              JOIN blobs b ON a.digest = b.digest WHERE a.alias = ?''',
+                           (alias,)).fetchone()
+        if row is None:
+            return None
+
+        digest, created, accessed = row
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            return None
+
+        now = time.time()
+        if now - accessed > _TOUCH_INTERVAL:
+            with conn:
+                conn.execute('UPDATE blobs SET accessed = ? WHERE digest = ?', (now, digest))
+        return path, digest, created
+
+    def evict(self, force=False):
+        """
+        按TTL和容量配额淘汰图片
+
+        参数:
+            force (bool): 为True时忽略清理间隔立即执行
+        """
+        now = time.time()
+        over_quota = self.total_bytes() > self.quota_bytes
+        if not force and not over_quota and now - self._last_evict < _EVICT_INTERVAL:
+            return
+        self._last_evict = now
+
+        conn = self._connect()
+        # {digest: 选出时的访问时间}
+        stale = {}
+        if self.ttl_seconds > 0:
+            stale = dict(conn.execute(
+                'SELECT digest, accessed FROM blobs WHERE accessed < ?', (now - self.ttl_seconds,)).fetchall())
+
+        if over_quota:
+            # 淘汰到配额的90%，避免每次写入都触发淘汰
+            target = self.quota_bytes * 0.9
+            total = self.total_bytes()
+            for digest, size, accessed in conn.execute('SELECT digest, size, accessed FROM blobs ORDER BY accessed'):
+                if total <= target:
+                    break
+                if digest not in stale:
+                    stale[digest] = accessed
+                    total -= size
+
+        deleted = sum(self._delete_blob(digest, accessed) for digest, accessed in stale.items())
+        if deleted:
+            print(f"地图存储已淘汰 {deleted} 个文件")
+
+    def _delete_blob(self, digest, accessed):
+        """
+        删除blob及其全部别名；选出之后又被保存或访问过（访问时间已更新）的blob不删除
+
+        返回:
+            bool: 是否删除
+        """
+        with self._write_transaction() as conn:
+            deleted = conn.execute('DELETE FROM blobs WHERE digest = ? AND accessed <= ?',
+                                   (digest, accessed)).rowcount
+            if not deleted:
+                return False
+            conn.execute('DELETE FROM aliases WHERE digest = ?', (digest,))
+            try:
+                os.remove(self.blob_path(digest))
+            except FileNotFoundError:
+                pass
+        return True
+
+    def total_bytes(self):
+        """当前存储的总字节数"""
+        row = self._connect().execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()
+        return row[0]
+
+    def import_legacy_files(self, folder):
+        """
+        将旧版本存储目录（位于静态文件目录中）里的图片导入存储，之后删除旧文件
+
+        包括直接保存在目录下的图片文件（原文件名作为别名）和旧的blob存储（保留原别名）
+        """
+        if not os.path.isdir(folder) or os.path.abspath(folder) == os.path.abspath(self.root):
+            return
+        imported = 0
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if not name.lower().endswith(('.png', '.gif', '.webp', '.zip', '.tif', '.tiff')) or not os.path.isfile(path):
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    self.put(f.read(), name)
+                os.remove(path)
+                imported += 1
+            except Exception as e:
+                print(f"导入旧地图文件{name}时出错: {str(e)}")
+
+        legacy_index = os.path.join(folder, 'index.sqlite3')
+        if os.path.exists(legacy_index):
+            try:
+                conn = sqlite3.connect(legacy_index, timeout=30)
+                try:
+                    rows = conn.execute('SELECT alias, digest FROM aliases').fetchall()
+                finally:
+                    conn.close()
+                for alias, digest in rows:
+                    blob = os.path.join(folder, 'blobs', digest[:2], digest)
+                    if os.path.exists(blob):
+                        with open(blob, 'rb') as f:
+                            self.put(f.read(), alias)
+                        imported += 1
+                shutil.rmtree(os.path.join(folder, 'blobs'), ignore_errors=True)
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(legacy_index + suffix):
+                        os.remove(legacy_index + suffix)
+            except Exception as e:
+                print(f"导入旧地图存储时出错: {str(e)}")
+        if imported:
+            print(f"已将 {imported} 个旧地图文件导入存储")
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_map_storage(root=MAP_STORAGE_DIR):
+    """
+    获取全局的地图存储实例（首次调用时创建，并导入旧版本遗留的文件）
+
+    参数:
+        root (str): 存储目录，默认为 MAP_STORAGE_DIR
+    """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                storage = MapStorage(
+                    root,
+                    quota_bytes=MAPS_STORAGE_QUOTA_MB * 1024 * 1024,
+                    ttl_seconds=MAPS_STORAGE_TTL_HOURS * 3600
+                )
+                storage.import_legacy_files(LEGACY_MAPS_FOLDER)
+                _storage = storage
+    return _storage
@@ -0,0 +1,220 @@
+import json
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows下没有resource模块
+    resource = None
+
+# 各工作进程的内存统计保存目录（管理接口汇总同一台机器上所有进程的数据）
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'china-map-generator-metrics'))
+# 每个进程保留的最近渲染记录数
+METRICS_RECENT_RENDERS = 50
+# 工作进程渲染次数达到该值后回收（0表示不限制）
+WORKER_MAX_RENDERS = int(os.environ.get('WORKER_MAX_RENDERS', 500))
+# 工作进程RSS超过该值（MB）后回收（0表示不限制）
+WORKER_MAX_RSS_MB = float(os.environ.get('WORKER_MAX_RSS_MB', 1536))
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def get_rss_bytes():
+    """当前进程的常驻内存（RSS）；不支持/proc的系统上返回峰值RSS"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        if resource is None:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS上单位为字节，Linux上为KB
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_heap_usage():
+    """
+    Python堆的使用情况
+
+    返回:
+        dict: allocatedBlocks（已分配的对象块数）；tracemalloc已启用时另含 tracedBytes
+    """
+    usage = {'allocatedBlocks': sys.getallocatedblocks()}
+    if tracemalloc.is_tracing():
+        usage['tracedBytes'] = tracemalloc.get_traced_memory()[0]
+    return usage
+
+
+class WorkerTelemetry:
+    """
+    当前工作进程的渲染次数和内存变化统计
+
+    每次渲染前后记录RSS和Python堆，统计写入 METRICS_DIR/{pid}.json。
+    启用回收后（gunicorn工作进程），渲染次数或RSS超过阈值时向自身发送SIGTERM，
+    gunicorn会等待进行中的请求完成后退出该进程并启动新的进程。
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.started = time.time()
+        self.renders = 0
+        self.active = 0
+        self.baseline_rss = get_rss_bytes()
+        self.peak_rss = self.baseline_rss
+        self.recent = deque(maxlen=METRICS_RECENT_RENDERS)
+        self.recycle_enabled = False
+        self.recycle_reason = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def record(self, kind):
+        """
+        记录一次渲染的耗时和内存变化
+
+        参数:
+            kind (str): 渲染类型，如 'map'、'animation'、'session'
+        """
+        rss_before = get_rss_bytes()
+        heap_before = get_heap_usage()
+        started = time.perf_counter()
+        with self._lock:
+            self.active += 1
+        try:
+            yield
+        finally:
+            rss_after = get_rss_bytes()
+            heap_after = get_heap_usage()
+            sample = {
+                'kind': kind,
+                'time': time.time(),
+                'seconds': round(time.perf_counter() - started, 3),
+                'rssBefore': rss_before,
+                'rssAfter': rss_after,
+                'rssDelta': rss_after - rss_before,
+                'blocksDelta': heap_after['allocatedBlocks'] - heap_before['allocatedBlocks'],
+            }
+            if 'tracedBytes' in heap_after and 'tracedBytes' in heap_before:
+                sample['tracedDelta'] = heap_after['tracedBytes'] - heap_before['tracedBytes']
+            with self._lock:
+                self.active -= 1
+                self.renders += 1
+                self.peak_rss = max(self.peak_rss, rss_after)
+                self.recent.append(sample)
+            self._publish()
+            self._maybe_recycle(rss_after)
+
+    def snapshot(self):
+        """当前进程的统计数据"""
+        rss = get_rss_bytes()
+        with self._lock:
+            return {
+                'pid': self.pid,
+                'uptimeSeconds': round(time.time() - self.started),
+                'renders': self.renders,
+                'activeRenders': self.active,
+                'rss': rss,
+                'baselineRss': self.baseline_rss,
+                'rssGrowth': rss - self.baseline_rss,
+                'peakRss': self.peak_rss,
+                'heap': get_heap_usage(),
+                'recycleReason': self.recycle_reason,
+                'recent': list(self.recent),
+            }
+
+    def _publish(self):
+        """将统计写入共享目录（先写临时文件再替换，读取时不会读到一半）"""
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            path = os.path.join(METRICS_DIR, f"{self.pid}.json")
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"写入内存统计时出错: {str(e)}")
+
+    def _maybe_recycle(self, rss):
+        """渲染次数或RSS超过阈值时请求gunicorn平滑重启当前工作进程（只触发一次）"""
+        if not self.recycle_enabled or self.recycle_reason:
+            return
+        reason = None
+        if WORKER_MAX_RENDERS and self.renders >= WORKER_MAX_RENDERS:
+            reason = f"渲染次数达到{WORKER_MAX_RENDERS}"
+        elif WORKER_MAX_RSS_MB and rss > WORKER_MAX_RSS_MB * 1024 * 1024:
+            reason = f"RSS {rss / 1024 / 1024:.0f}MB 超过 {WORKER_MAX_RSS_MB:.0f}MB"
+        if reason is None:
+            return
+        self.recycle_reason = reason
+        self._publish()
+        print(f"工作进程 {self.pid} {reason}，完成进行中的请求后重启")
+        os.kill(self.pid, signal.SIGTERM)
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def get_worker_telemetry():
+    """获取当前进程的统计对象（fork后的子进程会重新创建）"""
+    global _telemetry
+    if _telemetry is None or _telemetry.pid != os.getpid():
+        with _telemetry_lock:
+            if _telemetry is None or _telemetry.pid != os.getpid():
+                _telemetry = WorkerTelemetry()
+    return _telemetry
+
+
+def enable_worker_recycling():
+    """在gunicorn工作进程中调用（见gunicorn.conf.py），启用按渲染次数和RSS回收"""
+    get_worker_telemetry().recycle_enabled = True
+
+
+def record_render(kind):
+    """记录一次渲染的耗时和内存变化，用法: with record_render('map'): ..."""
+    return get_worker_telemetry().record(kind)
+
+
+def collect_worker_metrics():
+    """
+    汇总同一台机器上所有工作进程的统计（已退出的进程的记录会被删除）
+
+    返回:
+        list: 每个进程的统计数据
+    """
+    workers = {}
+    if os.path.isdir(METRICS_DIR):
+        for name in os.listdir(METRICS_DIR):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(METRICS_DIR, name)
+            try:
+                pid = int(name[:-len('.json')])
+                # 检查进程是否仍在运行（Windows下os.kill会结束进程，不做检查）
+                if os.name == 'posix':
+                    os.kill(pid, 0)
+            except ValueError:
+                continue
+            except ProcessLookupError:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(path, encoding='utf-8') as f:
+                    workers[pid] = json.load(f)
+            except (OSError, ValueError):
+                continue
+    # 当前进程使用实时数据
+    current = get_worker_telemetry().snapshot()
+    workers[current['pid']] = current
+    return sorted(workers.values(), key=lambda item: item['pid'])
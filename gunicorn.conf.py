@@ -0,0 +1,27 @@
+import os
+
+# gunicorn配置：gunicorn -c gunicorn.conf.py wsgi:app
+
+# 监听地址
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# 使用线程工作模式：渲染过程不修改全局状态，一个进程内可以同时处理多个请求，
+# 某个请求在读取文件或等待网络时，其他线程可以继续渲染
+worker_class = 'gthread'
+# 进程数（编辑会话保存在进程内存中，多于1个进程时需要负载均衡器保持会话粘性）
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# 每个进程的线程数
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# 县级全国地图渲染可能较慢
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+# 工作进程回收（渲染次数或RSS超过阈值）或重启时，等待进行中的请求完成的时间
+graceful_timeout = timeout
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """工作进程启动后启用按渲染次数和RSS回收（WORKER_MAX_RENDERS、WORKER_MAX_RSS_MB）"""
+    from app.controllers.telemetry import enable_worker_recycling
+    enable_worker_recycling()
@@ -0,0 +1,163 @@
+"""
+离线预渲染地图（缓存预热）
+
+按清单批量生成地图并写入Web应用使用的地图存储，之后相同参数的请求直接返回已生成的图片。
+数据或样式更新后在项目根目录下运行一次（样式更新时先递增 RENDER_STYLE_VERSION）：
+
+    python prerender.py --standard            # 全国和各省 × 省/市/县 × 默认样式
+    python prerender.py manifest.json -j 8    # 按清单文件渲染，使用8个进程
+
+清单文件格式（参数与 /api/generate-map 的请求参数相同）:
+
+    {
+        "regions": ["全国", "@provinces"],      // "@provinces" 表示所有省份
+        "mapTypes": ["省", "市", "县"],
+        "styles": {"default": {}, "dark": {"baseColor": "#333333", "borderColor": "#999999"}},
+        "maps": [{"mapType": "市", "regionName": "广东省", "showScaleBar": true}]
+    }
+
+regions × mapTypes × styles 的每个组合各生成一张地图，maps 中的地图单独生成。
+已经存在于存储中的地图会被跳过，因此中断后重新运行即可从中断处继续。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from app.controllers.map_controller import build_map_figure, MAPS_OUTPUT_FOLDER
+from app.controllers.map_options import parse_map_options
+from app.controllers.boundary_store import get_region_attributes
+from app.controllers.render_cache import RENDER_STYLE_VERSION, render_cache_key, render_cache_alias
+from app.controllers.storage import get_map_storage
+
+# 未指定清单时使用的标准清单
+STANDARD_MANIFEST = {
+    'regions': ['全国', '@provinces'],
+    'mapTypes': ['省', '市', '县'],
+    'styles': {'default': {}},
+}
+
+
+def expand_manifest(manifest):
+    """
+    将清单展开为地图参数列表
+
+    参数:
+        manifest (dict): 清单，包含 regions、mapTypes、styles 和 maps
+
+    返回:
+        list: 每项为一张地图的请求参数（与 /api/generate-map 相同）
+    """
+    regions = []
+    for region in manifest.get('regions', []):
+        if region == '@provinces':
+            provinces = get_region_attributes('省')['省'].dropna().astype(str).str.strip()
+            regions.extend(name for name in provinces.unique() if name)
+        else:
+            regions.append(region)
+
+    specs = []
+    styles = manifest.get('styles') or {'default': {}}
+    for region in regions:
+        for map_type in manifest.get('mapTypes', ['省']):
+            for style in styles.values():
+                spec = dict(style)
+                spec['mapType'] = map_type
+                spec['regionName'] = '' if region == '全国' else region
+                specs.append(spec)
+    specs.extend(manifest.get('maps', []))
+
+    # 去掉重复的地图（例如 maps 中重复列出了组合里已有的地图）
+    unique_specs = {}
+    for spec in specs:
+        unique_specs.setdefault(json.dumps(spec, sort_keys=True, ensure_ascii=False), spec)
+    return list(unique_specs.values())
+
+
+def _init_worker(verbose):
+    """工作进程初始化：默认不输出渲染过程中的日志"""
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+
+
+def render_spec(task):
+    """
+    渲染一张地图并写入存储（在工作进程中执行）
+
+    参数:
+        task (tuple): (序号, 请求参数, 是否强制重新渲染)
+
+    返回:
+        tuple: (序号, 状态, 文件名或错误信息, 耗时秒数)，状态为 'rendered'、'skipped' 或 'failed'
+    """
+    index, spec, force = task
+    started = time.time()
+    try:
+        map_kwargs = parse_map_options(spec)
+        map_kwargs.pop('save_local')
+        key = render_cache_key(map_kwargs)
+        if key is None:
+            return index, 'failed', '参数无法缓存', time.time() - started
+        alias = render_cache_alias(map_kwargs, key)
+
+        storage = get_map_storage(MAPS_OUTPUT_FOLDER)
+        if not force and storage.resolve(alias):
+            return index, 'skipped', alias, time.time() - started
+
+        map_figure = build_map_figure(**map_kwargs)
+        storage.put(map_figure.render_png(), alias)
+        return index, 'rendered', alias, time.time() - started
+    except Exception as e:
+        return index, 'failed', str(e), time.time() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='批量预渲染地图并写入地图存储')
+    parser.add_argument('manifest', nargs='?', help='清单文件（JSON）')
+    parser.add_argument('--standard', action='store_true', help='使用标准清单：全国和各省 × 省/市/县 × 默认样式')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='并行进程数（默认为CPU核数）')
+    parser.add_argument('--force', action='store_true', help='重新渲染已存在的地图')
+    parser.add_argument('--dry-run', action='store_true', help='只列出要渲染的地图')
+    parser.add_argument('-v', '--verbose', action='store_true', help='输出渲染过程中的日志')
+    args = parser.parse_args(argv)
+
+    if args.manifest:
+        with open(args.manifest, encoding='utf-8') as f:
+            manifest = json.load(f)
+    elif args.standard:
+        manifest = STANDARD_MANIFEST
+    else:
+        parser.error('请指定清单文件或 --standard')
+
+    if os.environ.get('RENDER_CACHE', '1') == '0':
+        print('RENDER_CACHE=0 时Web应用不使用预渲染的地图')
+        return 1
+
+    specs = expand_manifest(manifest)
+    print(f"共 {len(specs)} 张地图，样式版本 {RENDER_STYLE_VERSION}，{args.jobs} 个进程")
+    if args.dry_run:
+        for spec in specs:
+            print(json.dumps(spec, ensure_ascii=False))
+        return 0
+
+    counts = {'rendered': 0, 'skipped': 0, 'failed': 0}
+    started = time.time()
+    tasks = [(index, spec, args.force) for index, spec in enumerate(specs)]
+    with multiprocessing.Pool(args.jobs, initializer=_init_worker, initargs=(args.verbose,)) as pool:
+        for done, (index, status, detail, elapsed) in enumerate(
+                pool.imap_unordered(render_spec, tasks), start=1):
+            counts[status] += 1
+            if status == 'failed':
+                print(f"[{done}/{len(specs)}] 失败 {json.dumps(specs[index], ensure_ascii=False)}: {detail}")
+            elif status == 'rendered':
+                print(f"[{done}/{len(specs)}] 已渲染 {detail} ({elapsed:.1f}秒)")
+
+    print(f"完成: 渲染 {counts['rendered']} 张，跳过 {counts['skipped']} 张（已存在），"
+          f"失败 {counts['failed']} 张，用时 {time.time() - started:.0f}秒")
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+地图渲染进程（横向扩展）
+
+Web进程设置 RENDER_QUEUE 后不再自己渲染地图，而是把任务（以请求参数的散列为id）提交到共享队列并等待结果。
+本脚本启动的渲染进程从队列中领取任务、渲染并把结果写回队列，可以在多台机器上运行：
+
+    RENDER_QUEUE=sqlite python render_worker.py -j 4                  # 同一台机器，SQLite队列
+    RENDER_QUEUE=redis://queue-host:6379/0 python render_worker.py    # 多台机器，Redis队列
+
+渲染期间每 JOB_HEARTBEAT_SECONDS 秒发送一次心跳；渲染进程崩溃后，心跳超过 JOB_STALE_SECONDS 秒的任务
+会被其他渲染进程（或等待结果的Web进程）重新放回队列，最多尝试 JOB_MAX_ATTEMPTS 次。
+收到 SIGTERM 或 Ctrl+C 后完成当前任务再退出。
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
+from app.controllers.admission import DeadlineExceeded, request_deadline
+from app.controllers.boundary_store import get_boundary_store, reload_boundary_data, use_boundary_store
+from app.controllers.job_queue import (
+    RENDER_QUEUE, JOB_HEARTBEAT_SECONDS, JOB_STALE_SECONDS, ERROR_INVALID, ERROR_DEADLINE, ERROR_RENDER,
+    open_job_queue, default_worker_id, decode_map_kwargs
+)
+from app.controllers.map_controller import render_map_image
+
+_stopping = threading.Event()
+
+
+def _request_stop(signum, frame):
+    if not _stopping.is_set():
+        print(f"渲染进程 {default_worker_id()} 收到退出信号，完成当前任务后退出")
+    _stopping.set()
+
+
+def _heartbeat(queue, job_id, worker_id, finished):
+    """渲染期间定期发送心跳"""
+    while not finished.wait(JOB_HEARTBEAT_SECONDS):
+        try:
+            if not queue.heartbeat(job_id, worker_id):
+                print(f"任务 {job_id[:12]} 已被重新分配，继续渲染但结果可能被忽略")
+                return
+        except Exception as e:
+            print(f"发送心跳失败: {e}")
+
+
+def run_job(queue, worker_id, job_id, payload, deadline):
+    """
+    渲染一个任务并把结果（或失败原因）写回队列
+
+    返回:
+        str: 'done'、'failed' 或 'expired'
+    """
+    remaining = deadline - time.time() if deadline is not None else None
+    if remaining is not None and remaining <= 0:
+        queue.fail(job_id, worker_id, '请求已超过截止时间，任务未渲染', ERROR_DEADLINE)
+        return 'expired'
+
+    # Web进程已按其边界数据版本生成任务id，本进程的数据较旧时先加载新版本
+    store = get_boundary_store()
+    data_version = payload.get('data_version')
+    if data_version and store.version != data_version:
+        reload_boundary_data()
+        store = get_boundary_store()
+        if store.version != data_version:
+            queue.fail(job_id, worker_id, f"渲染进程的边界数据版本 {store.version} "
+                                          f"与请求的版本 {data_version} 不一致", ERROR_RENDER)
+            return 'failed'
+
+    finished = threading.Event()
+    beat = threading.Thread(target=_heartbeat, args=(queue, job_id, worker_id, finished), daemon=True)
+    beat.start()
+    try:
+        with request_deadline(remaining), use_boundary_store(store):
+            data, filename = render_map_image(decode_map_kwargs(payload['map_kwargs']))
+        queue.complete(job_id, worker_id, data, filename)
+        return 'done'
+    except ValueError as e:
+        queue.fail(job_id, worker_id, str(e), ERROR_INVALID)
+    except DeadlineExceeded as e:
+        queue.fail(job_id, worker_id, str(e), ERROR_DEADLINE)
+    except Exception as e:
+        traceback.print_exc()
+        queue.fail(job_id, worker_id, str(e), ERROR_RENDER)
+    finally:
+        finished.set()
+        beat.join()
+    return 'failed'
+
+
+def worker_loop(queue_url, max_jobs=0):
+    """
+    渲染进程主循环：领取任务、渲染、写回结果，并定期把心跳超时的任务放回队列
+
+    参数:
+        queue_url (str): 队列地址（见 job_queue.open_job_queue）
+        max_jobs (int): 处理该数量的任务后退出（0表示不限制），配合进程管理器定期重启以释放内存
+    """
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+    queue = open_job_queue(queue_url)
+    worker_id = default_worker_id()
+    print(f"渲染进程 {worker_id} 已启动，队列: {queue.describe()}")
+
+    handled = 0
+    last_check = 0
+    while not _stopping.is_set():
+        if time.monotonic() - last_check >= JOB_STALE_SECONDS / 2:
+            queue.requeue_stale()
+            last_check = time.monotonic()
+
+        job = queue.claim(worker_id, timeout=1.0)
+        if job is None:
+            continue
+        job_id, payload, deadline = job
+        started = time.time()
+        status = run_job(queue, worker_id, job_id, payload, deadline)
+        print(f"任务 {job_id[:12]}: {status} ({time.time() - started:.1f}秒)")
+
+        handled += 1
+        if max_jobs and handled >= max_jobs:
+            print(f"渲染进程 {worker_id} 已处理 {handled} 个任务，退出")
+            break
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='从共享队列领取并渲染地图')
+    parser.add_argument('--queue', default=RENDER_QUEUE or 'sqlite',
+                        help='队列地址：sqlite、sqlite:///路径 或 redis://...（默认为环境变量 RENDER_QUEUE）')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='渲染进程数（默认1）')
+    parser.add_argument('--max-jobs', type=int, default=0, help='每个进程处理该数量的任务后退出（默认不限制）')
+    args = parser.parse_args(argv)
+
+    # 提前检查队列地址（例如缺少redis库），避免每个子进程都报同样的错误
+    open_job_queue(args.queue)
+
+    if args.jobs <= 1:
+        worker_loop(args.queue, args.max_jobs)
+        return 0
+
+    processes = [multiprocessing.Process(target=worker_loop, args=(args.queue, args.max_jobs))
+                 for _ in range(args.jobs)]
+    for process in processes:
+        process.start()
+    # 主进程只转发退出信号（子进程各自完成当前任务后退出）
+    signal.signal(signal.SIGTERM, lambda signum, frame: [os.kill(p.pid, signal.SIGTERM) for p in processes])
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for process in processes:
+        process.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+测试公共设置
+
+仓库中不包含完整的边界数据，测试使用在临时目录中生成的小型数据：
+两个省（上下相邻），每省两个市（左右相邻），每市四个县（2×2网格），相邻区域的公共边使用相同的顶点。
+"""
+import os
+import tempfile
+
+# 配置在导入应用模块时读取，必须在导入之前设置
+_TEST_ROOT = tempfile.mkdtemp(prefix='china-map-tests-')
+os.environ.setdefault('SHARED_GEOMETRY_DIR', os.path.join(_TEST_ROOT, 'shared'))
+os.environ.setdefault('MAP_STORAGE_DIR', os.path.join(_TEST_ROOT, 'maps'))
+os.environ.setdefault('METRICS_DIR', os.path.join(_TEST_ROOT, 'metrics'))
+os.environ.setdefault('RENDER_LOCK_DIR', os.path.join(_TEST_ROOT, 'locks'))
+os.environ.setdefault('DATA_WATCH_SECONDS', '0')
+os.environ.setdefault('RENDER_QUEUE', '')
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import box
+
+# (省, 省代码, 纬度范围)
+PROVINCES = [('湖南省', 430000, (25, 29)), ('广东省', 440000, (21, 25))]
+# 每省的两个市: (市名后缀, 经度范围)
+CITY_COLUMNS = [('西', (110, 112)), ('东', (112, 114))]
+
+
+def _fixture_frames():
+    provinces, cities, counties = [], [], []
+    for province, province_code, (south, north) in PROVINCES:
+        provinces.append({'省代码': province_code, '省': province, '类型': '省',
+                          'geometry': box(110, south, 114, north)})
+        for city_index, (suffix, (west, east)) in enumerate(CITY_COLUMNS):
+            city = f"{province[:2]}{suffix}市"
+            city_code = province_code + (city_index + 1) * 100
+            cities.append({'省代码': province_code, '省': province, '市代码': city_code, '市': city,
+                           '类型': '地级市', 'geometry': box(west, south, east, north)})
+            county_index = 0
+            for lon in (west, west + 1):
+                for lat in (south, south + 2):
+                    county_index += 1
+                    counties.append({'PAC': city_code + county_index, 'NAME': f"{city[:-1]}{county_index}县",
+                                     '省代码': province_code, '省': province, '市代码': city_code, '市': city,
+                                     '类型': '县', 'geometry': box(lon, lat, lon + 1, lat + 2)})
+    return {level: gpd.GeoDataFrame(rows, crs='EPSG:4326')
+            for level, rows in (('省', provinces), ('市', cities), ('县', counties))}
+
+
+@pytest.fixture(scope='session')
+def boundary_dir():
+    """生成测试用的shp文件，返回包含 shp/ 目录的路径"""
+    root = os.path.join(_TEST_ROOT, 'data')
+    os.makedirs(os.path.join(root, 'shp'), exist_ok=True)
+    for level, frame in _fixture_frames().items():
+        frame.to_file(os.path.join(root, 'shp', f"{level}.shp"), encoding='utf-8')
+    return root
+
+
+@pytest.fixture
+def boundary_data(boundary_dir, monkeypatch):
+    """在测试数据目录中运行（SHP_FOLDER 是相对路径）"""
+    monkeypatch.chdir(boundary_dir)
+    return boundary_dir
+
+
+@pytest.fixture
+def client(boundary_data):
+    """Flask测试客户端（与gunicorn一样通过wsgi.py加载app.py）"""
+    from wsgi import app
+    app.config['TESTING'] = True
+    return app.test_client()
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+import shapely
+
+from app.controllers.adjacency import AUTO_COLOR_PALETTE, assign_colors, build_adjacency, get_adjacency
+from app.controllers.boundary_store import get_projected_data
+from app.controllers.shared_geometry import RaggedGeometry
+
+
+def _voronoi_regions(seed, count=120):
+    """随机点的Voronoi区域：相邻区域的公共边使用相同的顶点"""
+    rng = np.random.default_rng(seed)
+    points = shapely.multipoints(rng.uniform(0, 100, size=(count, 2)))
+    extent = shapely.box(0, 0, 100, 100)
+    cells = shapely.get_parts(shapely.voronoi_polygons(points, extend_to=extent))
+    return list(shapely.intersection(cells, extent))
+
+
+def _shapely_neighbors(geometries):
+    """公共边界长度大于0的区域对（只在一点相接的不算相邻）"""
+    tree = shapely.STRtree(geometries)
+    pairs = set()
+    for i, j in tree.query(geometries, predicate='intersects').T:
+        if i < j and shapely.length(shapely.intersection(geometries[i].boundary, geometries[j].boundary)) > 1e-9:
+            pairs.add((int(i), int(j)))
+    return pairs
+
+
+def _adjacency_pairs(adjacency):
+    return {(i, int(j)) for i in range(len(adjacency)) for j in adjacency.neighbors(i) if i < j}
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_adjacency_matches_shared_boundaries(seed):
+    geometries = _voronoi_regions(seed)
+    adjacency = build_adjacency(RaggedGeometry.from_geometries(geometries))
+
+    assert len(adjacency) == len(geometries)
+    assert _adjacency_pairs(adjacency) == _shapely_neighbors(geometries)
+
+
+def test_adjacency_handles_corners_enclaves_and_multipolygons():
+    geometries = [
+        shapely.box(0, 0, 1, 1),
+        shapely.box(1, 1, 2, 2),  # 与0只在一点相接
+        shapely.box(1, 0, 2, 1),  # 与0、1共边
+        # 带洞的区域，洞中是区域4（飞地）；另一部分与区域1共边
+        shapely.MultiPolygon([shapely.box(3, 0, 6, 3).difference(shapely.box(4, 1, 5, 2)),
+                              shapely.box(2, 1, 3, 2)]),
+        shapely.box(4, 1, 5, 2),
+    ]
+    adjacency = build_adjacency(RaggedGeometry.from_geometries(geometries))
+
+    assert _adjacency_pairs(adjacency) == _shapely_neighbors(geometries) == {(0, 2), (1, 2), (1, 3), (3, 4)}
+    assert list(adjacency.neighbors_of([3])) == [1, 4]
+
+
+def test_boundary_data_adjacency_matches_shapely(boundary_data):
+    dataset = get_projected_data('县')
+    geometries = list(dataset.geometry.to_shapely(np.arange(len(dataset))))
+
+    assert _adjacency_pairs(get_adjacency('县')) == _shapely_neighbors(geometries)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_assign_colors_has_no_neighbor_clashes(seed):
+    geometries = _voronoi_regions(seed)
+    adjacency = build_adjacency(RaggedGeometry.from_geometries(geometries))
+
+    # 全部区域和其中一部分区域（只考虑这部分区域之间的邻接）
+    for positions in (range(len(geometries)), range(0, len(geometries), 3)):
+        positions = list(positions)
+        colors = dict(zip(positions, assign_colors(adjacency, positions)))
+        assert set(colors.values()) <= set(AUTO_COLOR_PALETTE)
+        for i, j in _adjacency_pairs(adjacency):
+            if i in colors and j in colors:
+                assert colors[i] != colors[j], (i, j)
+
+
+def test_assign_colors_rejects_small_palette():
+    adjacency = build_adjacency(RaggedGeometry.from_geometries([shapely.box(0, 0, 1, 1)]))
+    with pytest.raises(ValueError):
+        assign_colors(adjacency, [0], palette=['#000000', '#FFFFFF'])
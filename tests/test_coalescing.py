@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.controllers import map_controller, render_cache
+from app.controllers.coalescing import read_handoff, write_handoff
+
+
+@pytest.fixture
+def slow_render(boundary_data, monkeypatch, tmp_path):
+    """不缓存结果，渲染替换为记录调用次数的慢函数"""
+    monkeypatch.setattr(render_cache, 'RENDER_CACHE_ENABLED', False)
+    calls_file = tmp_path / 'calls'
+    calls_file.write_text('')
+
+    def render(map_kwargs):
+        with open(calls_file, 'a') as f:
+            f.write('x')
+        time.sleep(0.5)
+        return b'png-' + map_kwargs['map_type'].encode(), 'map.png'
+
+    monkeypatch.setattr(map_controller, 'render_map_image', render)
+    return calls_file
+
+
+def test_concurrent_identical_requests_render_once_without_cache(slow_render):
+    with ThreadPoolExecutor(6) as pool:
+        results = list(pool.map(lambda _: map_controller.generate_map(map_type='省'), range(6)))
+
+    assert len(set(results)) == 1
+    assert slow_render.read_text() == 'x'
+
+
+def test_different_requests_are_not_coalesced(slow_render):
+    with ThreadPoolExecutor(2) as pool:
+        list(pool.map(lambda map_type: map_controller.generate_map(map_type=map_type), ['省', '市']))
+    assert slow_render.read_text() == 'xx'
+
+
+def _render_in_process(barrier, results):
+    barrier.wait()
+    results.put(map_controller.generate_map(map_type='省'))
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='需要fork')
+def test_concurrent_processes_hand_over_result_without_cache(slow_render):
+    context = multiprocessing.get_context('fork')
+    barrier, results = context.Barrier(3), context.Queue()
+    processes = [context.Process(target=_render_in_process, args=(barrier, results)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    outputs = [results.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join(timeout=30)
+
+    assert len(set(outputs)) == 1
+    assert slow_render.read_text() == 'x'
+
+
+def test_handoff_only_returns_results_finished_after_waiting_started():
+    write_handoff('key-a', b'data', 'a.png')
+    assert read_handoff('key-a', time.time() - 5) == (b'data', 'a.png')
+    assert read_handoff('key-a', time.time() + 5) is None
+    assert read_handoff('missing', 0) is None
+
+
+def test_inline_render_bypasses_cache_coalescing_and_queue(boundary_data, monkeypatch):
+    calls = []
+
+    def render(map_kwargs):
+        calls.append(map_kwargs['map_type'])
+        return b'png', 'map.png'
+
+    monkeypatch.setattr(map_controller, 'render_map_image', render)
+    map_controller.generate_map(map_type='省', save_local=True)
+    assert len(calls) == 1
+
+    # 已缓存的地图也重新渲染，不经过合并请求和渲染队列
+    monkeypatch.setattr(map_controller, 'get_single_flight', lambda: pytest.fail('不应合并请求'))
+    monkeypatch.setattr(map_controller, 'process_lock', lambda key: pytest.fail('不应加跨进程锁'))
+    monkeypatch.setattr(map_controller, 'get_render_queue', lambda: pytest.fail('不应使用渲染队列'))
+    assert map_controller.generate_map(map_type='省', inline=True) == 'data:image/png;base64,cG5n'
+    assert len(calls) == 2
@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app.controllers.map_controller import build_map_figure
+from app.controllers.map_options import parse_map_options
+
+# 不同级别、投影、分级着色和点图层混合的一组地图
+MAP_OPTIONS = [
+    {'mapType': '省'},
+    {'mapType': '市', 'regionName': '湖南省', 'highlightNeighbors': '湖南西市'},
+    {'mapType': '县', 'projection': 'albers', 'showCoordinates': True, 'showScaleBar': True},
+    {'mapType': '省', 'projection': 'mercator', 'highlightRegion': '广东省', 'autoColor': True},
+    {'mapType': '市', 'projection': 'geographic',
+     'choropleth': {'data': {'湖南西市': 1, '湖南东市': 2, '广东西市': 3, '广东东市': 4}}},
+    {'mapType': '省', 'points': {'data': [[110.5, 26], [113.5, 27], [112.5, 22]], 'mode': 'scatter'}},
+    {'mapType': '县', 'regionName': '广东省', 'points': {'data': [[111, 22], [113, 24]], 'mode': 'hexbin'}},
+]
+
+
+def _render(options):
+    map_kwargs = parse_map_options(options)
+    map_kwargs.pop('save_local')
+    return build_map_figure(**map_kwargs).render_png(40)
+
+
+def test_concurrent_renders_match_serial_renders(boundary_data):
+    serial = [_render(options) for options in MAP_OPTIONS]
+
+    # 每张图渲染多次并打乱顺序，让不同的地图在各线程中交错
+    jobs = [MAP_OPTIONS[i % len(MAP_OPTIONS)] for i in range(len(MAP_OPTIONS) * 3)][::-1]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        concurrent = list(executor.map(_render, jobs))
+
+    for options, png in zip(jobs, concurrent):
+        assert png == serial[MAP_OPTIONS.index(options)], options
@@ -0,0 +1,81 @@
+import gzip
+import json
+
+import numpy as np
+import shapely
+
+from app.controllers.geometry_export import build_topojson, get_geometry_export, normalize_geometry_options
+
+
+def _ring(*points):
+    return np.array(points + points[:1], dtype=np.int64)
+
+
+def _decode_arcs(topology):
+    """增量编码的弧段还原为网格坐标"""
+    return [np.cumsum(np.array(arc, dtype=np.int64), axis=0) for arc in topology['arcs']]
+
+
+def _decode_ring(arcs, references):
+    """按弧段引用拼接出环（负数引用 ~i 表示反向的第i条弧段）"""
+    points = []
+    for reference in references:
+        arc = arcs[reference] if reference >= 0 else arcs[~reference][::-1]
+        points.extend(arc.tolist() if not points else arc[1:].tolist())
+    return np.array(points)
+
+
+def _same_ring(decoded, original):
+    """环的起点可能不同，比较首尾相同的闭合环"""
+    assert np.array_equal(decoded[0], decoded[-1])
+    open_decoded, open_original = decoded[:-1], original[:-1]
+    assert len(open_decoded) == len(open_original)
+    start = next(i for i, point in enumerate(open_decoded.tolist()) if point == open_original[0].tolist())
+    assert np.array_equal(np.roll(open_decoded, -start, axis=0), open_original)
+
+
+def test_topojson_arcs_round_trip():
+    # 两个共边的方块（左块有洞），右块另有一个不相邻的岛
+    left = [[_ring((0, 0), (4, 0), (4, 4), (0, 4)), _ring((1, 1), (1, 2), (2, 2), (2, 1))]]
+    right = [[_ring((4, 0), (8, 0), (8, 4), (4, 4))], [_ring((10, 10), (12, 10), (11, 12))]]
+    regions = [left, right]
+    topology = build_topojson(regions, [{'id': 1}, {'id': 2}], 'test', np.array([1.0, 1.0]),
+                              np.array([0.0, 0.0]), [0, 0, 12, 12])
+
+    arcs = _decode_arcs(topology)
+    geometries = topology['objects']['test']['geometries']
+    for polygons, geometry in zip(regions, geometries):
+        for rings, ring_arcs in zip(polygons, geometry['arcs']):
+            for ring, references in zip(rings, ring_arcs):
+                _same_ring(_decode_ring(arcs, references), ring)
+
+    # 公共边 (4,0)-(4,4) 只保存一次，两侧方向相反
+    shared = [index for index, arc in enumerate(arcs) if {tuple(arc[0]), tuple(arc[-1])} == {(4, 0), (4, 4)}
+              and len(arc) == 2]
+    assert len(shared) == 1
+    references = [reference for geometry in geometries for polygon in geometry['arcs'] for ring in polygon
+                  for reference in ring if reference in (shared[0], ~shared[0])]
+    assert sorted(references) == [~shared[0], shared[0]]
+
+
+def test_topojson_export_matches_geojson(boundary_data):
+    documents = {}
+    for output_format in ('topojson', 'geojson'):
+        options = normalize_geometry_options('县', output_format, simplify='none')
+        documents[output_format] = json.loads(gzip.decompress(get_geometry_export(options)['gzip']))
+
+    topology, collection = documents['topojson'], documents['geojson']
+    arcs = _decode_arcs(topology)
+    scale, translate = (np.array(topology['transform'][key]) for key in ('scale', 'translate'))
+    geometries = topology['objects']['县']['geometries']
+    assert len(geometries) == len(collection['features']) == 16
+
+    for geometry, feature in zip(geometries, collection['features']):
+        assert geometry['properties'] == feature['properties']
+        polygons = []
+        for polygon in geometry['arcs']:
+            rings = [_decode_ring(arcs, references) * scale + translate for references in polygon]
+            polygons.append(shapely.Polygon(rings[0], rings[1:]))
+        decoded = shapely.MultiPolygon(polygons)
+        expected = shapely.geometry.shape(feature['geometry'])
+        assert shapely.equals_exact(shapely.normalize(decoded), shapely.normalize(expected), tolerance=1e-6)
@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import render_worker
+from app.controllers import job_queue, map_controller
+from app.controllers.admission import DeadlineExceeded
+from app.controllers.job_queue import (
+    ERROR_DEADLINE, ERROR_INVALID, ERROR_RENDER, JobFailed, SQLiteJobQueue, decode_map_kwargs, encode_map_kwargs,
+    render_via_queue
+)
+from app.controllers.render_cache import lookup_render, render_cache_key
+
+POINT_TABLE = pd.DataFrame({'lon': [110.5, 111.5, 113.5, 112.5], 'lat': [26.0, 28.0, 27.0, 22.0],
+                            'weight': [1.0, 2.5, 0.1, 3.0]})
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    queue = SQLiteJobQueue(str(tmp_path / 'queue.sqlite3'))
+    monkeypatch.setattr(map_controller, 'get_render_queue', lambda: queue)
+    return queue
+
+
+def _work_one(queue):
+    """在后台线程中领取并渲染一个任务"""
+    def run():
+        job = queue.claim('test-worker', timeout=10)
+        if job is not None:
+            render_worker.run_job(queue, 'test-worker', *job)
+    worker = threading.Thread(target=run)
+    worker.start()
+    return worker
+
+
+def test_uploaded_tables_survive_queue_payload():
+    choropleth_table = pd.DataFrame({'code': ['430000', None], 'value': [1.5, np.nan]})
+    map_kwargs = {'map_type': '省', 'choropleth': {'table': choropleth_table, 'k': 3},
+                  'points': {'table': POINT_TABLE, 'mode': 'hexbin'}}
+
+    payload = json.loads(json.dumps(encode_map_kwargs(map_kwargs)))
+    decoded = decode_map_kwargs(payload)
+
+    pd.testing.assert_frame_equal(decoded['choropleth']['table'], choropleth_table)
+    pd.testing.assert_frame_equal(decoded['points']['table'], POINT_TABLE)
+    assert decoded['choropleth']['k'] == 3
+    assert decoded['points']['mode'] == 'hexbin'
+
+
+def test_uploaded_table_key_follows_content(boundary_data):
+    map_kwargs = {'map_type': '省', 'points': {'table': POINT_TABLE}}
+    changed = POINT_TABLE.assign(weight=POINT_TABLE['weight'] * 2)
+
+    assert render_cache_key(map_kwargs) == render_cache_key({'map_type': '省', 'points': {'table': POINT_TABLE.copy()}})
+    assert render_cache_key(map_kwargs) != render_cache_key({'map_type': '省', 'points': {'table': changed}})
+    # 上传文件的地图不写入存储
+    assert lookup_render(None, map_kwargs) == (None, None)
+
+
+def test_uploaded_points_render_through_queue(boundary_data, queue, monkeypatch):
+    points = {'table': POINT_TABLE, 'mode': 'scatter'}
+    worker = _work_one(queue)
+    queued = map_controller.generate_map(map_type='省', points=points)
+    worker.join(timeout=30)
+
+    assert queue.stats()['done'] == 1
+    monkeypatch.setattr(map_controller, 'get_render_queue', lambda: None)
+    assert queued == map_controller.generate_map(map_type='省', points=points)
+
+
+def test_oversized_table_renders_inline(boundary_data, queue, monkeypatch):
+    monkeypatch.setattr(job_queue, 'RENDER_QUEUE_MAX_TABLE_BYTES', 16)
+    before = job_queue.inline_render_count()
+
+    assert map_controller.generate_map(map_type='省', points={'table': POINT_TABLE})
+
+    assert job_queue.inline_render_count() == before + 1
+    assert queue.stats()['pending'] == 0
+
+
+def test_claim_is_fifo_and_exclusive(queue):
+    for index in range(20):
+        assert queue.submit(f"job-{index:02d}", {'index': index})
+    # 相同id的任务在等待中时不重复提交
+    assert not queue.submit('job-00', {'index': 0})
+
+    first = queue.claim('worker-0', timeout=0)
+    assert first[:2] == ('job-00', {'index': 0})
+
+    def claim_all(worker):
+        claimed = []
+        while (job := queue.claim(worker, timeout=0)) is not None:
+            claimed.append(job[0])
+        return claimed
+
+    with ThreadPoolExecutor(4) as pool:
+        claimed = list(pool.map(claim_all, ['worker-1', 'worker-2', 'worker-3', 'worker-4']))
+    ids = [job_id for jobs in claimed for job_id in jobs]
+    assert sorted(ids) == [f"job-{index:02d}" for index in range(1, 20)]
+    assert queue.claim('worker-0', timeout=0.05) is None
+    assert queue.stats()['running'] == 20
+
+
+def test_stale_jobs_are_requeued_then_failed(queue, monkeypatch):
+    monkeypatch.setattr(job_queue, 'JOB_STALE_SECONDS', 0.05)
+    monkeypatch.setattr(job_queue, 'JOB_MAX_ATTEMPTS', 2)
+    queue.submit('job', {'map_kwargs': {}})
+
+    assert queue.claim('crashed-1', timeout=0)[0] == 'job'
+    time.sleep(0.1)
+    assert queue.requeue_stale() == 1
+    # 原渲染进程的心跳不再有效，任务由其他渲染进程领取
+    assert not queue.heartbeat('job', 'crashed-1')
+    assert queue.claim('crashed-2', timeout=0)[0] == 'job'
+    assert queue.heartbeat('job', 'crashed-2')
+    assert queue.result('job') is None
+
+    # 达到最多尝试次数后标记为失败，不再放回队列
+    time.sleep(0.1)
+    assert queue.requeue_stale() == 0
+    assert queue.claim('worker', timeout=0) is None
+    with pytest.raises(JobFailed) as failure:
+        queue.result('job')
+    assert failure.value.error_type == ERROR_RENDER
+
+
+def test_complete_keeps_first_result(queue):
+    queue.submit('job', {})
+    queue.claim('worker-1', timeout=0)
+    queue.complete('job', 'worker-1', b'png', 'map.png')
+    # 被重新分配后较晚完成或失败的结果被忽略
+    queue.complete('job', 'worker-2', b'other', 'other.png')
+    queue.fail('job', 'worker-2', '渲染失败')
+    assert queue.result('job') == (b'png', 'map.png')
+    assert not queue.submit('job', {})
+    assert queue.submit('job', {}, fresh=True)
+
+
+@pytest.mark.parametrize('error_type, exception', [
+    (ERROR_INVALID, ValueError),
+    (ERROR_DEADLINE, DeadlineExceeded),
+    (ERROR_RENDER, RuntimeError),
+])
+def test_job_failures_map_to_exceptions(queue, error_type, exception):
+    def fail_next():
+        job = queue.claim('worker', timeout=10)
+        queue.fail(job[0], 'worker', '失败原因', error_type)
+    worker = threading.Thread(target=fail_next)
+    worker.start()
+    with pytest.raises(exception, match='失败原因'):
+        render_via_queue(queue, 'job', {})
+    worker.join(timeout=10)
+
+
+def test_worker_maps_render_errors(boundary_data, queue):
+    queue.submit('invalid', {'map_kwargs': {'map_type': '省', 'projection': 'unknown'}})
+    assert render_worker.run_job(queue, 'worker', *queue.claim('worker', timeout=0)) == 'failed'
+    with pytest.raises(JobFailed) as failure:
+        queue.result('invalid')
+    assert failure.value.error_type == ERROR_INVALID
+
+    queue.submit('expired', {'map_kwargs': {'map_type': '省'}}, deadline=time.time() - 1)
+    assert render_worker.run_job(queue, 'worker', *queue.claim('worker', timeout=0)) == 'expired'
+    with pytest.raises(JobFailed) as failure:
+        queue.result('expired')
+    assert failure.value.error_type == ERROR_DEADLINE
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from app.controllers.locate import encode_arrow, iter_locate_batches
+
+pa = pytest.importorskip('pyarrow')
+
+
+def _read_stream(chunks):
+    return pa.ipc.open_stream(b''.join(chunks)).read_all()
+
+
+def test_arrow_stream_survives_all_miss_first_batch(boundary_data):
+    # 第一批的点都不在任何区域中，名称列全为空
+    chunks = [(np.array([120.0, 121.0]), np.array([40.0, 41.0])),
+              (np.array([110.5, 113.5]), np.array([26.0, 22.0]))]
+    levels = ['省', '县']
+
+    table = _read_stream(encode_arrow(iter_locate_batches(chunks, levels), levels))
+
+    assert table.schema.field('index').type == pa.int64()
+    assert all(table.schema.field(name).type == pa.string() for name in table.schema.names[1:])
+    assert table.column('index').to_pylist() == [0, 1, 2, 3]
+    assert table.column('province').to_pylist() == [None, None, '湖南省', '广东省']
+    assert table.column('county').to_pylist() == [None, None, '湖南西1县', '广东东3县']
+    assert table.column('countyCode').to_pylist()[2:] == ['430101', '440203']
+
+
+def test_arrow_stream_without_points_has_schema(boundary_data):
+    table = _read_stream(encode_arrow(iter_locate_batches([], ['市']), ['市']))
+
+    assert table.num_rows == 0
+    assert table.schema.names == ['index', 'city', 'cityCode']
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import shapely
+from matplotlib.figure import Figure
+
+from app.controllers.map_controller import build_map_figure
+from app.controllers.map_options import parse_map_options
+from app.controllers.points import draw_points, locate_points
+
+
+@pytest.mark.parametrize('mode', ['scatter', 'hexbin', 'grid'])
+@pytest.mark.parametrize('log_scale', [False, True])
+def test_draw_points_with_no_points_in_view(mode, log_scale):
+    ax = Figure().add_subplot()
+    ax.set_xlim(0, 10)
+    ax.set_ylim(0, 10)
+    x, y = np.array([50.0, 60.0]), np.array([50.0, 60.0])
+
+    draw_points(ax, x, y, None, {'mode': mode, 'logScale': log_scale})
+
+    assert ax.get_xlim() == (0, 10)
+    assert ax.get_ylim() == (0, 10)
+
+
+@pytest.mark.parametrize('mode', ['scatter', 'hexbin', 'grid'])
+def test_region_map_with_points_outside_view(boundary_data, mode):
+    # 点都在广东省，地图只显示湖南省
+    options = {'mapType': '市', 'regionName': '湖南省', 'points': {'data': [[112.5, 22], [113.5, 23]], 'mode': mode}}
+    map_kwargs = parse_map_options(options)
+    map_kwargs.pop('save_local')
+    map_figure = build_map_figure(**map_kwargs)
+    assert map_figure.render_png(40).startswith(b'\x89PNG')
+
+
+def _first_containing(geometries, x, y):
+    """逐区域用 shapely.contains_xy 判断，返回每个点第一个包含它的区域"""
+    expected = np.full(len(x), -1, dtype=np.int64)
+    for position in range(len(geometries) - 1, -1, -1):
+        expected[shapely.contains_xy(geometries[position], x, y)] = position
+    return expected
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_locate_points_matches_contains_xy(seed):
+    rng = np.random.default_rng(seed)
+    sites = shapely.multipoints(rng.uniform(0, 100, size=(80, 2)))
+    extent = shapely.box(0, 0, 100, 100)
+    cells = shapely.intersection(shapely.get_parts(shapely.voronoi_polygons(sites, extend_to=extent)), extent)
+    # 加入带洞的区域、与其他区域重叠的区域和空几何
+    geometries = np.concatenate([cells, [
+        shapely.box(20, 20, 60, 60).difference(shapely.box(30, 30, 40, 40)),
+        shapely.Polygon(),
+    ]])
+    x, y = rng.uniform(-10, 110, size=(2, 20000))
+
+    located = locate_points(geometries.copy(), x, y)
+
+    assert np.array_equal(located, _first_containing(geometries, x, y))
+    # 范围外的点为-1；重叠的区域被位置靠前的Voronoi区域覆盖
+    assert (located == -1).any()
+    assert not (located == len(cells)).any()
+
+
+def test_locate_points_on_shared_edge_uses_first_region():
+    geometries = np.array([shapely.box(0, 0, 1, 1), shapely.box(1, 0, 2, 1)])
+    x, y = np.array([1.0, 0.5, 1.5, 3.0]), np.array([0.5, 0.5, 0.5, 0.5])
+
+    assert locate_points(geometries, x, y).tolist() == [0, 0, 1, -1]
+    assert locate_points(geometries, x[:0], y[:0]).tolist() == []
@@ -0,0 +1,108 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.controllers import poster
+from app.controllers.map_controller import build_map_figure
+from app.controllers.map_options import parse_map_options
+
+WIDTH, HEIGHT = 640, 480
+# 条带高度不整除图片高度，最后一个条带较短
+STRIP_ROWS = 37
+
+
+def _map_figure(options):
+    map_kwargs = parse_map_options(options)
+    map_kwargs.pop('save_local')
+    map_figure = build_map_figure(**map_kwargs)
+    map_figure.set_output_size(WIDTH, HEIGHT)
+    return map_figure
+
+
+@pytest.fixture(autouse=True)
+def small_strips(monkeypatch):
+    monkeypatch.setattr(poster, 'POSTER_STRIP_MB', STRIP_ROWS * WIDTH * 4 / 1024 / 1024)
+    assert poster.strip_rows_for(WIDTH) == STRIP_ROWS
+
+
+def _write(map_figure, output_format='png'):
+    """条带渲染并解码输出的图片"""
+    buffer = io.BytesIO()
+    poster.write_poster(map_figure, buffer, WIDTH, HEIGHT, output_format)
+    buffer.seek(0)
+    with Image.open(buffer) as image:
+        assert image.format == {'png': 'PNG', 'tiff': 'TIFF'}[output_format]
+        decoded = np.asarray(image.convert('RGB'))
+    assert decoded.shape == (HEIGHT, WIDTH, 3)
+    return decoded
+
+
+@pytest.mark.parametrize('output_format', ['png', 'tiff'])
+@pytest.mark.parametrize('options', [
+    {'mapType': '县', 'highlightRegion': '湖南东1县', 'autoColor': True},
+    {'mapType': '市', 'projection': 'albers', 'showScaleBar': True,
+     'choropleth': {'data': {'湖南西市': 1, '湖南东市': 2, '广东西市': 3, '广东东市': 4}},
+     'points': {'data': [[110.5, 26], [113.5, 27], [112.5, 22]], 'mode': 'scatter'}},
+])
+def test_streamed_poster_matches_single_render(boundary_data, options, output_format):
+    map_figure = _map_figure(options)
+    expected = np.asarray(map_figure.render_image())
+
+    assert np.array_equal(_write(map_figure, output_format), expected)
+    # 条带渲染后图形恢复原状
+    assert np.array_equal(np.asarray(map_figure.render_image()), expected)
+
+
+def test_streamed_overlay_lines_differ_only_by_rounding(boundary_data):
+    map_figure = _map_figure({'mapType': '县', 'overlayLevels': ['省']})
+    expected = np.asarray(map_figure.render_image()).astype(int)
+
+    difference = np.abs(_write(map_figure).astype(int) - expected)
+    assert difference.max() <= 2
+    assert np.mean(difference.any(axis=2)) < 0.01
+
+
+def test_streamed_graticule_differs_only_in_dashes(boundary_data):
+    map_figure = _map_figure({'mapType': '省', 'showCoordinates': True})
+    expected = np.asarray(map_figure.render_image())
+    graticule = next(collection for collection in map_figure.ax.collections if collection.get_zorder() == 500)
+    # 经纬线画成实线时覆盖的像素
+    graticule.set_visible(False)
+    without_graticule = np.asarray(map_figure.render_image())
+    graticule.set_visible(True)
+    graticule.set_linestyle('solid')
+    solid_graticule = np.asarray(map_figure.render_image())
+    graticule.set_linestyle('--')
+
+    # 虚线图案可能不同的只有经纬线，其他位置只有线条抗锯齿的舍入差异
+    graticule_pixels = np.any(solid_graticule != without_graticule, axis=2)
+    difference = np.abs(_write(map_figure).astype(int) - expected.astype(int)).max(axis=2)
+    assert difference[~graticule_pixels].max() <= 2
+
+
+@pytest.mark.parametrize('writer_class', [poster.StreamingPNGWriter, poster.StreamingTIFFWriter])
+def test_streaming_writers_encode_exact_pixels(writer_class):
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, size=(50, 23, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    if writer_class is poster.StreamingTIFFWriter:
+        writer = writer_class(buffer, 23, 50, 16, dpi=300)
+    else:
+        writer = writer_class(buffer, 23, 50, dpi=300)
+    for top in range(0, 50, 16):
+        writer.write_rows(pixels[top:top + 16])
+    writer.close()
+
+    buffer.seek(0)
+    with Image.open(buffer) as image:
+        assert np.array_equal(np.asarray(image), pixels)
+        assert tuple(round(value) for value in image.info['dpi']) == (300, 300)
+
+
+def test_incomplete_image_is_rejected():
+    writer = poster.StreamingPNGWriter(io.BytesIO(), 10, 20)
+    writer.write_rows(np.zeros((16, 10, 3), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        writer.close()
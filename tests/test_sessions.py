@@ -0,0 +1,32 @@
+from app.controllers.map_options import parse_map_options
+from app.controllers.sessions import SessionManager
+
+# 湖南省有3个点，广东省有1个点
+POINTS = [[110.5, 26], [111.5, 28], [113.5, 27], [112.5, 22]]
+
+
+def _create_session(boundary_data, points):
+    options = {'mapType': '省', 'baseColor': '#EAEAEA', 'points': points}
+    session = SessionManager().create(parse_map_options(options), options, dpi=40)
+    return session, options
+
+
+def test_base_color_change_rebuilds_region_point_counts(boundary_data):
+    session, options = _create_session(boundary_data, {'data': POINTS, 'mode': 'regions', 'k': 2})
+    assert len(set(session.map_figure.base_colors)) == 2
+
+    rebuilt, changed = session.update(parse_map_options(dict(options, baseColor='#FF0000')))
+
+    assert rebuilt
+    assert changed == ['base_color']
+    # 各区域仍按点数着色，图例保持一致
+    assert len(set(session.map_figure.base_colors)) == 2
+
+
+def test_base_color_change_is_incremental_for_scatter_points(boundary_data):
+    session, options = _create_session(boundary_data, {'data': POINTS, 'mode': 'scatter'})
+
+    rebuilt, changed = session.update(parse_map_options(dict(options, baseColor='#FF0000')))
+
+    assert not rebuilt
+    assert set(session.map_figure.base_colors) == {'#FF0000'}
@@ -0,0 +1,65 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+import shapely
+
+from app.controllers import shared_geometry
+from app.controllers.shared_geometry import RaggedGeometry, attach_or_publish
+
+
+@pytest.fixture
+def shared_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_geometry, 'SHARED_GEOMETRY_DIR', str(tmp_path))
+    monkeypatch.setattr(shared_geometry, 'SHARED_GEOMETRY_ENABLED', True)
+    return tmp_path
+
+
+def _build():
+    geometry = RaggedGeometry.from_geometries([shapely.box(0, 0, 1, 1)])
+    return geometry, pd.DataFrame({'NAME': ['测试区']})
+
+
+def _versions(shared_dir):
+    return sorted(name.split('-')[2] for name in os.listdir(shared_dir) if not name.endswith('.lock'))
+
+
+def _age(shared_dir, version, seconds):
+    path = shared_dir / f"县-lcc-{version}-v{shared_geometry.GEOMETRY_FORMAT_VERSION}"
+    published = time.time() - seconds
+    os.utime(path, (published, published))
+
+
+def test_previous_version_is_kept_after_publish(shared_dir):
+    attach_or_publish('县-lcc', 'a', _build)
+    attach_or_publish('县-lcc', 'b', _build)
+    assert _versions(shared_dir) == ['a', 'b']
+
+    # 固定在旧版本上的进程仍可挂载
+    geometry, attributes = attach_or_publish('县-lcc', 'a', lambda: pytest.fail('旧版本不应重新生成'))
+    assert len(geometry) == 1
+    assert attributes['NAME'].tolist() == ['测试区']
+
+
+def test_older_versions_are_removed_after_grace_period(shared_dir):
+    attach_or_publish('县-lcc', 'a', _build)
+    attach_or_publish('县-lcc', 'b', _build)
+    attach_or_publish('县-lcc', 'c', _build)
+    # 宽限期内都保留
+    assert _versions(shared_dir) == ['a', 'b', 'c']
+
+    _age(shared_dir, 'a', shared_geometry.SHARED_GEOMETRY_GRACE_SECONDS + 20)
+    _age(shared_dir, 'b', shared_geometry.SHARED_GEOMETRY_GRACE_SECONDS + 10)
+    attach_or_publish('县-lcc', 'd', _build)
+    # 最近的一个旧版本即使过期也保留
+    assert _versions(shared_dir) == ['c', 'd']
+
+
+def test_other_datasets_are_not_removed(shared_dir):
+    attach_or_publish('市-lcc', 'a', _build)
+    attach_or_publish('县-lcc', 'a', _build)
+    _age(shared_dir, 'a', shared_geometry.SHARED_GEOMETRY_GRACE_SECONDS + 10)
+    attach_or_publish('县-lcc', 'b', _build)
+    attach_or_publish('县-lcc', 'c', _build)
+    assert os.path.exists(shared_dir / f"市-lcc-a-v{shared_geometry.GEOMETRY_FORMAT_VERSION}")
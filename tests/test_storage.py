@@ -0,0 +1,74 @@
+import os
+import threading
+
+from app.controllers.storage import MapStorage, MAP_STORAGE_DIR, get_map_storage
+
+
+def test_storage_is_not_served_as_static_files(client):
+    storage = get_map_storage()
+    digest = storage.put(b'png-data', 'example.png')
+
+    assert not os.path.abspath(storage.root).startswith(os.path.abspath('app/static'))
+    assert os.path.abspath(storage.root) == os.path.abspath(MAP_STORAGE_DIR)
+    assert client.get('/static/maps/index.sqlite3').status_code == 404
+    assert client.get(f'/static/maps/blobs/{digest[:2]}/{digest}').status_code == 404
+
+    response = client.get('/maps/example.png')
+    assert response.status_code == 200
+    assert response.data == b'png-data'
+
+
+def test_legacy_static_store_is_migrated(tmp_path):
+    legacy = tmp_path / 'static-maps'
+    old = MapStorage(str(legacy), quota_bytes=10 ** 9)
+    old.put(b'old-map', 'old.png')
+    (legacy / 'loose.png').write_bytes(b'loose-map')
+
+    storage = MapStorage(str(tmp_path / 'maps'), quota_bytes=10 ** 9)
+    storage.import_legacy_files(str(legacy))
+
+    for alias, data in (('old.png', b'old-map'), ('loose.png', b'loose-map')):
+        path = storage.resolve(alias)[0]
+        with open(path, 'rb') as f:
+            assert f.read() == data
+    assert not (legacy / 'index.sqlite3').exists()
+    assert not (legacy / 'blobs').exists()
+    assert not (legacy / 'loose.png').exists()
+
+
+def test_eviction_skips_blob_saved_after_selection(tmp_path):
+    storage = MapStorage(str(tmp_path), quota_bytes=10 ** 9)
+    digest = storage.put(b'map', 'a.png')
+    selected = storage._connect().execute('SELECT accessed FROM blobs WHERE digest = ?', (digest,)).fetchone()[0]
+
+    # 淘汰选出该blob之后，另一个请求又保存了相同的内容
+    storage.put(b'map', 'b.png')
+    assert not storage._delete_blob(digest, selected)
+    assert os.path.exists(storage.resolve('b.png')[0])
+
+
+def test_concurrent_put_and_evict_keep_index_consistent(tmp_path):
+    # 配额为0时每次保存都会触发淘汰
+    storage = MapStorage(str(tmp_path), quota_bytes=0)
+    errors = []
+
+    def worker(index):
+        try:
+            for round_index in range(30):
+                storage.put(f"map-{round_index % 3}".encode(), f"w{index}-{round_index}.png")
+                storage.evict(force=True)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    conn = storage._connect()
+    for (digest,) in conn.execute('SELECT digest FROM blobs'):
+        assert os.path.exists(storage.blob_path(digest))
+    for (digest,) in conn.execute('SELECT digest FROM aliases'):
+        assert conn.execute('SELECT 1 FROM blobs WHERE digest = ?', (digest,)).fetchone()
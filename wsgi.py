@@ -0,0 +1,17 @@
+"""
+WSGI入口（供gunicorn等服务器使用）
+
+app.py与app包同名，`import app`会导入app包，因此这里按文件路径加载app.py。
+"""
+import importlib.util
+import os
+import sys
+
+_app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+_spec = importlib.util.spec_from_file_location('map_app', _app_path)
+_module = importlib.util.module_from_spec(_spec)
+# 注册模块，Flask据此确定根目录（static、templates）
+sys.modules['map_app'] = _module
+_spec.loader.exec_module(_module)
+
+app = _module.app